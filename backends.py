@@ -0,0 +1,299 @@
+"""
+Backend groups: several OpenAI-compatible endpoints behind one client.
+
+A BackendGroup exposes the same `chat.completions.create(...)` surface as an
+OpenAI client, so tools and the router use it transparently. Each request goes
+to the healthiest, least busy endpoint. If the first token (or, for
+non-streaming calls, the whole response) has not arrived within the endpoint's
+observed latency percentile, a hedged request is sent to the next endpoint;
+whichever answers first wins and the other is cancelled. Endpoints that keep
+failing are taken out of rotation for a cooldown period. A streaming request
+counts as in flight on its endpoint until the stream is exhausted or closed.
+"""
+import inspect
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from openai import OpenAI
+
+
+class Endpoint:
+    """One OpenAI-compatible server plus its health and latency history."""
+
+    def __init__(self, name: str, client: Any, window: int = 200):
+        self.name = name
+        self.client = client
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+        self.latencies = {"stream": deque(maxlen=window), "blocking": deque(maxlen=window)}
+        self.lock = threading.Lock()
+
+    def is_healthy(self, now: float) -> bool:
+        return now >= self.down_until
+
+    def percentile(self, mode: str, p: float) -> Optional[float]:
+        with self.lock:
+            samples = sorted(self.latencies[mode])
+        if len(samples) < 5:
+            return None
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+    def record_success(self, mode: str, latency: float):
+        with self.lock:
+            self.latencies[mode].append(latency)
+            self.consecutive_failures = 0
+
+    def record_failure(self, failure_threshold: int, cooldown: float):
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= failure_threshold:
+                self.down_until = time.monotonic() + cooldown
+
+
+class HedgedStream:
+    """Stream returned by the winning endpoint; `close()` closes the HTTP stream."""
+
+    def __init__(self, stream: Any, iterator, first: Any, has_first: bool, on_close: Callable[[], None] = None):
+        self._stream = stream
+        self._iterator = iterator
+        self._first = first
+        self._has_first = has_first
+        self._on_close = on_close
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._has_first:
+            self._has_first = False
+            return self._first
+        if self._closed:
+            raise StopIteration
+        try:
+            return next(self._iterator)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        _close_quietly(self._stream)
+        if self._on_close is not None:
+            self._on_close()
+
+
+def _close_quietly(stream: Any):
+    close = getattr(stream, "close", None)
+    if close is None:
+        return
+    try:
+        close()
+    except (ValueError, RuntimeError):
+        # Generators that are still executing on another thread cannot be
+        # closed from here; their attempt thread notices the cancel flag.
+        pass
+
+
+class _Attempt:
+    """One request to one endpoint; holds an in-flight slot there until released."""
+
+    def __init__(self, endpoint: Endpoint):
+        self.endpoint = endpoint
+        self.cancelled = False
+        self.stream = None
+        self.started = time.monotonic()
+        self._released = False
+        with endpoint.lock:
+            endpoint.in_flight += 1
+
+    def release(self):
+        with self.endpoint.lock:
+            if self._released:
+                return
+            self._released = True
+            self.endpoint.in_flight -= 1
+
+    def cancel(self):
+        self.cancelled = True
+        if self.stream is not None and not inspect.isgenerator(self.stream):
+            _close_quietly(self.stream)
+        self.release()
+
+
+class _Completions:
+    def __init__(self, group: "BackendGroup"):
+        self._group = group
+
+    def create(self, **kwargs):
+        return self._group.create(**kwargs)
+
+
+class _Chat:
+    def __init__(self, group: "BackendGroup"):
+        self.completions = _Completions(group)
+
+
+class BackendGroup:
+    def __init__(self,
+                 endpoints: List[Endpoint],
+                 hedge_percentile: float = 0.9,
+                 default_hedge_delay: float = 1.5,
+                 min_hedge_delay: float = 0.1,
+                 failure_threshold: int = 3,
+                 cooldown: float = 15.0):
+        if not endpoints:
+            raise ValueError("BackendGroup needs at least one endpoint")
+        self.endpoints = endpoints
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.chat = _Chat(self)
+        self.stats = {"requests": 0, "hedges": 0, "hedge_wins": 0, "failovers": 0, "cancelled": 0}
+        self._stats_lock = threading.Lock()
+
+    @classmethod
+    def from_urls(cls, base_urls: List[str], api_key: str = "lm-studio", **kwargs) -> "BackendGroup":
+        endpoints = [Endpoint(url, OpenAI(api_key=api_key, base_url=url)) for url in base_urls]
+        return cls(endpoints, **kwargs)
+
+    def _bump(self, name: str):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _candidates(self) -> List[Endpoint]:
+        now = time.monotonic()
+        healthy = [e for e in self.endpoints if e.is_healthy(now)]
+        # If everything is cooling down, still try the least recently failed.
+        pool = healthy or sorted(self.endpoints, key=lambda e: e.down_until)
+        return sorted(pool, key=lambda e: (e.in_flight, e.percentile("stream", 0.5) or 0.0))
+
+    def _hedge_delay(self, endpoint: Endpoint, mode: str) -> float:
+        threshold = endpoint.percentile(mode, self.hedge_percentile)
+        if threshold is None:
+            return self.default_hedge_delay
+        return max(self.min_hedge_delay, threshold)
+
+    def _create_direct(self, endpoint: Endpoint, kwargs: Dict, mode: str):
+        """Nothing to hedge against: call the only endpoint on this thread."""
+        attempt = _Attempt(endpoint)
+        try:
+            response = endpoint.client.chat.completions.create(**kwargs)
+        except Exception:
+            attempt.release()
+            endpoint.record_failure(self.failure_threshold, self.cooldown)
+            raise
+        endpoint.record_success(mode, time.monotonic() - attempt.started)
+        if mode == "blocking":
+            attempt.release()
+            return response
+        return HedgedStream(response, iter(response), None, False, on_close=attempt.release)
+
+    def _run_attempt(self, attempt: _Attempt, kwargs: Dict, mode: str, results: queue.Queue):
+        endpoint = attempt.endpoint
+        # A delivered stream keeps its slot until the caller closes or exhausts it
+        delivered = False
+        try:
+            response = endpoint.client.chat.completions.create(**kwargs)
+            if mode == "blocking":
+                results.put((attempt, ("ok", response)))
+                return
+            attempt.stream = response
+            if attempt.cancelled:
+                _close_quietly(response)
+                return
+            iterator = iter(response)
+            try:
+                first, has_first = next(iterator), True
+            except StopIteration:
+                first, has_first = None, False
+            if attempt.cancelled:
+                # Lost the race while waiting for the first token.
+                _close_quietly(response)
+                return
+            delivered = True
+            results.put((attempt, ("ok", (response, iterator, first, has_first))))
+        except Exception as e:
+            results.put((attempt, ("error", e)))
+        finally:
+            if not delivered:
+                attempt.release()
+
+    def create(self, **kwargs):
+        mode = "stream" if kwargs.get("stream") else "blocking"
+        self._bump("requests")
+        candidates = self._candidates()
+        if len(candidates) == 1:
+            return self._create_direct(candidates[0], kwargs, mode)
+        results: queue.Queue = queue.Queue()
+        pending: List[_Attempt] = []
+        last_error = None
+
+        def launch():
+            attempt = _Attempt(candidates.pop(0))
+            pending.append(attempt)
+            threading.Thread(target=self._run_attempt, args=(attempt, kwargs, mode, results),
+                             daemon=True).start()
+            return attempt
+
+        primary = launch()
+        while pending:
+            wait = None
+            if candidates and len(pending) == 1:
+                wait = max(0.0, primary.started + self._hedge_delay(primary.endpoint, mode) - time.monotonic())
+            try:
+                attempt, (status, value) = results.get(timeout=wait)
+            except queue.Empty:
+                self._bump("hedges")
+                launch()
+                continue
+
+            pending.remove(attempt)
+            if attempt.cancelled:
+                if status == "ok" and mode == "stream":
+                    _close_quietly(value[0])
+                continue
+            if status == "error":
+                last_error = value
+                attempt.endpoint.record_failure(self.failure_threshold, self.cooldown)
+                if not pending and candidates:
+                    self._bump("failovers")
+                    primary = launch()
+                continue
+
+            attempt.endpoint.record_success(mode, time.monotonic() - attempt.started)
+            if attempt is not primary:
+                self._bump("hedge_wins")
+            for loser in pending:
+                loser.cancel()
+                self._bump("cancelled")
+            if mode == "blocking":
+                return value
+            stream, iterator, first, has_first = value
+            return HedgedStream(stream, iterator, first, has_first, on_close=attempt.release)
+
+        raise last_error
+
+    def snapshot(self) -> Dict:
+        now = time.monotonic()
+        return {
+            **self.stats,
+            "endpoints": [
+                {
+                    "name": e.name,
+                    "healthy": e.is_healthy(now),
+                    "in_flight": e.in_flight,
+                    "ttft_p50": e.percentile("stream", 0.5),
+                    "ttft_p90": e.percentile("stream", 0.9),
+                }
+                for e in self.endpoints
+            ],
+        }
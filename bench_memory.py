@@ -0,0 +1,172 @@
+"""
+Long-session memory benchmark and leak detector.
+
+Drives thousands of turns across many sessions through one ToolHandler (stub
+backend from loadgen.py, no delays) and samples tracemalloc and RSS as it
+goes. The retained bytes per turn is the slope of traced memory over turns
+after a warm-up; the run fails (exit 1) when it exceeds `--budget` bytes.
+
+The front-ends keep their own ever-growing copies of every turn (the chat
+textbox, `VoiceChatApp.sessions`, `AudioTranscriptionGUI.history`); those are
+simulated here as plain buffers fed the same text so their share shows up in
+the breakdown next to the engine's structures.
+
+The structure breakdown measures what each structure holds now; allocation
+sites come from tracemalloc and can name the line that first allocated a
+block the interpreter later recycled from a free list.
+
+    python bench_memory.py [--sessions 50] [--turns 5000] [--budget 4096] [--json out.json]
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import sys
+import tracemalloc
+from collections import defaultdict
+from typing import Dict, List
+
+from loadgen import StubBackend
+from main import ToolHandler
+from measure import rss_bytes
+
+MIX = {"ideation": 0.5, "therapist": 0.3, "internet_search": 0.2}
+
+
+def deep_size(obj, seen=None) -> int:
+    """Approximate bytes reachable from `obj` (containers and plain objects)."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)) or type(obj).__name__ == "deque":
+        size += sum(deep_size(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+        size += deep_size(vars(obj), seen)
+    return size
+
+
+def structures(handler: ToolHandler, frontend: Dict) -> Dict[str, object]:
+    """The long-lived structures worth watching, by name."""
+    store = handler.conversation_history
+    watched = {
+        "ToolHandler.conversation_history": store._histories,
+        "ToolHandler.reports": handler.reports,
+        "SingleFlight.flights": handler.client_manager.singleflight,
+        "ClientManager.cancellation_stats": handler.client_manager.cancellation_stats,
+        "Router.stats": handler.router.stats,
+    }
+    for name, value in vars(handler).items():
+        if name not in ("conversation_history", "reports", "client_manager", "router", "registry", "warmer") \
+                and isinstance(value, (dict, list, set)):
+            watched[f"ToolHandler.{name}"] = value
+    watched.update(frontend)
+    return watched
+
+
+def run(args) -> Dict:
+    handler = ToolHandler()
+    # The stub does the routing, and its picks are not training data
+    handler.router.log = handler.router.distilled = None
+    for client_type in list(handler.client_manager.clients):
+        handler.client_manager.register_client(client_type, StubBackend(0, 0, args.reply_tokens, MIX, seed=1))
+    handler.client_manager.limiters.clear()
+
+    # Simulated front-end buffers (see module docstring)
+    frontend = {
+        "VoiceChatApp.chat_display (simulated)": defaultdict(list),
+        "VoiceChatApp.sessions (simulated)": defaultdict(list),
+        "AudioTranscriptionGUI.history (simulated)": [],
+    }
+
+    tracemalloc.start(args.frames)
+    gc.collect()
+    baseline = tracemalloc.take_snapshot()
+    samples: List[Dict] = []
+    for turn in range(args.turns):
+        session_id = f"s{turn % args.sessions}"
+        text = f"turn {turn}: " + "tell me more about the plan " * (args.words // 6 + 1)
+        tool, response = handler.tool_selection(text, session_id)
+        full = "".join(chunk for chunk in response if chunk)
+        handler.update_conversation_history(tool, text, full, session_id)
+        frontend["VoiceChatApp.chat_display (simulated)"][session_id].append(f"\nYou: {text}\nAI: Using {tool} tool:{full}")
+        frontend["VoiceChatApp.sessions (simulated)"][session_id].append(f"prompt:{text}, response:{full}")
+        frontend["AudioTranscriptionGUI.history (simulated)"].append(full)
+
+        if turn % args.sample_every == 0 or turn == args.turns - 1:
+            # Count only what is still reachable, not cycles awaiting collection
+            gc.collect()
+            current, peak = tracemalloc.get_traced_memory()
+            samples.append({"turn": turn + 1, "traced_bytes": current, "peak_bytes": peak, "rss_bytes": rss_bytes()})
+    final = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    # Least-squares slope of traced memory over turns, after the warm-up
+    steady = [s for s in samples if s["turn"] > args.turns * args.warmup] or samples
+    n = len(steady)
+    mean_x = sum(s["turn"] for s in steady) / n
+    mean_y = sum(s["traced_bytes"] for s in steady) / n
+    var_x = sum((s["turn"] - mean_x) ** 2 for s in steady)
+    slope = sum((s["turn"] - mean_x) * (s["traced_bytes"] - mean_y) for s in steady) / var_x if var_x else 0.0
+
+    sizes = {name: deep_size(obj) for name, obj in structures(handler, frontend).items()}
+    top_lines = [
+        {"where": str(stat.traceback[0]), "size_bytes": stat.size_diff, "count": stat.count_diff}
+        for stat in final.compare_to(baseline, "lineno")[:args.top]
+    ]
+    return {
+        "turns": args.turns,
+        "sessions": args.sessions,
+        "retained_bytes_per_turn": round(slope, 1),
+        "budget_bytes_per_turn": args.budget,
+        "traced_bytes": samples[-1]["traced_bytes"],
+        "rss_growth_bytes": samples[-1]["rss_bytes"] - samples[0]["rss_bytes"],
+        "structures": dict(sorted(sizes.items(), key=lambda item: -item[1])),
+        "top_allocations": top_lines,
+        "samples": samples,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=5000, help="total turns across all sessions")
+    parser.add_argument("--words", type=int, default=20, help="approximate words per user message")
+    parser.add_argument("--reply-tokens", type=int, default=60)
+    parser.add_argument("--budget", type=float, default=4096, help="max retained bytes per turn")
+    parser.add_argument("--warmup", type=float, default=0.1, help="fraction of turns ignored for the slope")
+    parser.add_argument("--sample-every", type=int, default=50)
+    parser.add_argument("--frames", type=int, default=1, help="tracemalloc traceback depth")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", help="write the full result, including samples, to this file")
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = run(args)
+
+    print(f"{result['turns']} turns over {result['sessions']} sessions")
+    print(f"retained per turn: {result['retained_bytes_per_turn']:.0f} B (budget {args.budget:.0f} B)")
+    print(f"traced at end: {result['traced_bytes'] / 2 ** 20:.1f} MB, "
+          f"RSS growth: {result['rss_growth_bytes'] / 2 ** 20:.1f} MB")
+    print("\nDominant structures:")
+    for name, size in result["structures"].items():
+        print(f"  {size / 2 ** 20:>8.2f} MB  {name}")
+    print("\nTop allocation sites (growth since start):")
+    for line in result["top_allocations"]:
+        print(f"  {line['size_bytes'] / 2 ** 10:>9.1f} KB  {line['count']:>7}  {line['where']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if result["retained_bytes_per_turn"] > args.budget:
+        print(f"\nFAILED: {result['retained_bytes_per_turn']:.0f} B retained per turn exceeds the budget")
+        sys.exit(1)
+    print("\nOK")
+
+
+if __name__ == "__main__":
+    main()
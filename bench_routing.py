@@ -0,0 +1,68 @@
+"""
+Microbenchmark: per-query routing overhead of ToolRegistry.
+
+Measures only the in-process work tool_selection does before the router
+request goes out (building the tool list twice and the routing prompt), with
+3 and 100 registered tools. `rebuild` is the old per-query approach, `snapshot`
+reads the precompiled RegistrySnapshot.
+
+    python bench_routing.py [--queries 20000]
+"""
+import argparse
+import timeit
+
+from main import BaseTool, Tool, ToolRegistry
+
+QUERY = "What's the latest on the outage in us-east-1? Is it still affecting deploys?"
+
+
+class _NoopTool(BaseTool):
+    def process(self, text, history, cancel_token=None):
+        yield ""
+
+
+def build_registry(tool_count: int) -> ToolRegistry:
+    registry = ToolRegistry()
+    for i in range(tool_count):
+        registry.register_tool(
+            Tool(
+                name=f"tool_{i}",
+                description=f"Handle category {i} requests: questions, follow ups and anything related to topic {i}.",
+                system_prompt=f"You are specialist number {i}.",
+                client_type="local",
+            ),
+            _NoopTool,
+        )
+    return registry
+
+
+def route_rebuild(registry: ToolRegistry, text: str):
+    tools = [tool.to_openai_tool() for tool in registry.tools.values()]
+    prompt = f"You are an expert decision maker. Tools: {tools}. Here is the text: {text}. Previously used tool: None."
+    return prompt, [tool.to_openai_tool() for tool in registry.tools.values()]
+
+
+def route_snapshot(registry: ToolRegistry, text: str):
+    snapshot = registry.snapshot
+    return snapshot.router_prompt(text, None), snapshot.openai_tools
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--queries", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'tools':>6} {'approach':>9} {'us/query':>10} {'speedup':>8}")
+    for tool_count in (3, 100):
+        registry = build_registry(tool_count)
+        timings = {}
+        for name, route in (("rebuild", route_rebuild), ("snapshot", route_snapshot)):
+            seconds = min(timeit.repeat(lambda: route(registry, QUERY), number=args.queries, repeat=3))
+            timings[name] = seconds / args.queries * 1e6
+        for name, micros in timings.items():
+            speedup = timings["rebuild"] / micros
+            print(f"{tool_count:>6} {name:>9} {micros:>10.2f} {speedup:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Cancellation of superseded generations.
+
+A CancellationToken is created per generation by the caller (GUI, server) and
+passed through ToolHandler.tool_selection and BaseTool.process down to the
+streaming call. Cancelling it stops the stream at once and closes the upstream
+HTTP response, so an abandoned generation no longer holds a server slot.
+"""
+import threading
+from collections import defaultdict
+from typing import Callable, Dict
+
+
+class CancellationToken:
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        """Cancel the generation and run registered callbacks (once)."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def register(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Run `callback` on cancel (immediately if already cancelled). Returns an unregister function."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._unregister(callback)
+        callback()
+        return lambda: None
+
+    def _unregister(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+class CancellationStats:
+    """Counts cancelled generations and estimates completion tokens they saved.
+
+    Savings are estimated against `max_tokens` when the request set one,
+    otherwise against the average length of completed generations of the
+    same model.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.cancelled_generations = 0
+        self.tokens_saved = 0
+        self._completed = defaultdict(lambda: [0, 0])  # model -> [generations, tokens]
+
+    def record_completion(self, model: str, tokens: int):
+        with self._lock:
+            totals = self._completed[model]
+            totals[0] += 1
+            totals[1] += tokens
+
+    def record_cancellation(self, model: str, tokens_emitted: int, max_tokens: int = None):
+        with self._lock:
+            generations, tokens = self._completed[model]
+            expected = max_tokens or (tokens / generations if generations else 0)
+            self.cancelled_generations += 1
+            self.tokens_saved += max(0, int(expected) - tokens_emitted)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "cancelled_generations": self.cancelled_generations,
+                "tokens_saved": self.tokens_saved,
+            }
@@ -0,0 +1,121 @@
+"""
+Prompt token compaction.
+
+System prompts are written as indented triple-quoted strings, so every line
+carries the source indentation, which is tokenized and evaluated on every
+request. `compact_prompt` is applied once when a tool is registered: it strips
+line indentation and trailing space, collapses inner runs of spaces and
+blank lines, and trims the ends, leaving the wording, bullets and line
+structure as written.
+
+HistoryCompactor (optional, DEVDUCK_COMPACT_HISTORY=1) compacts each exchange
+as it is stored: blank lines and trailing space are collapsed, inner runs of
+spaces only in prose (fenced and indented code is left as written), and a
+long prose paragraph an earlier assistant reply already had (a repeated
+greeting, disclaimer or sign-off) is dropped from later replies.
+
+Savings are counted with `estimate_tokens` (words, punctuation and runs of
+whitespace) unless a real tokenizer's count function is passed in.
+"""
+import re
+from typing import Callable, Dict, Iterable, List, Sequence, Set, Tuple
+
+Message = Dict[str, str]
+
+_TOKEN = re.compile(r"\w+|[^\w\s]|\s{2,}")
+_INNER_SPACE = re.compile(r"(?<=\S)[ \t]{2,}")
+_TRAILING_SPACE = re.compile(r"[ \t]+(?=\n|$)")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough BPE token count: words, punctuation and multi-character whitespace runs."""
+    return len(_TOKEN.findall(text))
+
+
+def message_tokens(messages: Iterable[Message], count: Callable[[str], int] = estimate_tokens) -> int:
+    return sum(count(message.get("content") or "") for message in messages)
+
+
+def compact_prompt(text: str) -> str:
+    """Dedented, whitespace-collapsed version of a prompt written in source code."""
+    lines = [_INNER_SPACE.sub(" ", line.strip()) for line in text.splitlines()]
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+
+
+def compact_whitespace(text: str) -> str:
+    """Collapse inner space runs, trailing space and blank lines; keep indentation."""
+    text = _TRAILING_SPACE.sub("", _INNER_SPACE.sub(" ", text))
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+def _blocks(text: str) -> List[Tuple[bool, List[str]]]:
+    """Split text into (is_code, lines) blocks: fenced or indented code, prose paragraphs and blank lines."""
+    blocks: List[Tuple[bool, List[str]]] = []
+    fenced = False
+    for line in text.splitlines():
+        is_fence = line.lstrip().startswith("```")
+        code = fenced or is_fence or (line.startswith(("    ", "\t")) and line.strip() != "")
+        if is_fence:
+            fenced = not fenced
+        if not code and not line.strip():
+            blocks.append((False, []))
+        elif blocks and blocks[-1][0] == code and (code or blocks[-1][1]):
+            blocks[-1][1].append(line)
+        else:
+            blocks.append((code, [line]))
+    return blocks
+
+
+class HistoryCompactor:
+    def __init__(self, min_chars: int = 40, count: Callable[[str], int] = estimate_tokens):
+        self.min_chars = min_chars
+        self.count = count
+
+    def _key(self, lines: List[str]) -> str:
+        key = " ".join(" ".join(lines).split())
+        return key if len(key) >= self.min_chars else ""
+
+    def _paragraphs(self, text: str) -> List[str]:
+        return [self._key(lines) for code, lines in _blocks(text) if not code and lines]
+
+    def compact_text(self, text: str, seen: Set[str] = None) -> str:
+        """Whitespace-compact prose (code is only right-trimmed) and drop prose paragraphs in `seen`."""
+        out, blank = [], False
+        for code, lines in _blocks(text):
+            if not lines:
+                blank = bool(out)
+                continue
+            if not code:
+                key = self._key(lines)
+                if seen is not None and key:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                lines = [_INNER_SPACE.sub(" ", line) for line in lines]
+            if blank:
+                out.append("")
+                blank = False
+            out.extend(line.rstrip() for line in lines)
+        return "\n".join(out).strip("\n")
+
+    def compact_new(self, history: Sequence[Message], new: Sequence[Message]) -> Tuple[List[Message], int]:
+        """Compact `new` messages against the stored `history`; returns them and the tokens saved.
+
+        Only whole prose paragraphs of assistant replies (greetings, disclaimers,
+        sign-offs) are dropped when an earlier reply had them; user text and
+        code are never dropped.
+        """
+        seen = {key for message in history if message.get("role") == "assistant"
+                for key in self._paragraphs(message.get("content") or "")}
+        seen.discard("")
+        compacted, saved = [], 0
+        for message in new:
+            original = message.get("content") or ""
+            content = self.compact_text(original, seen if message.get("role") == "assistant" else None)
+            if not content.strip():
+                # Never store an empty turn; a fully repeated reply keeps its whitespace-only compaction
+                content = self.compact_text(original)
+            saved += self.count(original) - self.count(content)
+            compacted.append(dict(message, content=content))
+        return compacted, saved
@@ -7,6 +7,8 @@ from dataclasses import dataclass
 from abc import ABC, abstractmethod
 import re
 
+from compaction import compact_prompt
+
 load_dotenv(override=True)
 
 @dataclass
@@ -123,6 +125,7 @@ class ToolRegistry:
         
     def register_tool(self, tool: Tool, handler_class: type[BaseTool]):
         """Register a new tool and its handler."""
+        tool.system_prompt = compact_prompt(tool.system_prompt)
         self.tools[tool.name] = tool
         self.tool_handlers[tool.name] = handler_class
         
@@ -3,6 +3,8 @@ from typing import Dict, Tuple, Any, List, Callable
 from collections import defaultdict
 import os
 from dotenv import load_dotenv
+from compaction import compact_prompt
+from vector_memory import LocalEmbedder, VectorMemory
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
 import re
@@ -122,6 +124,7 @@ class ToolRegistry:
         
     def register_tool(self, tool: Tool, handler_class: type[BaseTool]):
         """Register a new tool and its handler."""
+        tool.system_prompt = compact_prompt(tool.system_prompt)
         self.tools[tool.name] = tool
         self.tool_handlers[tool.name] = handler_class
         
@@ -138,7 +141,7 @@ class ToolRegistry:
         return self.tools[tool_name].client_type
 
 class ToolHandler:
-    def __init__(self):
+    def __init__(self, session_id: str = "default", history_window: int = 6, recall_token_budget: int = 512):
         # Initialize OpenAI clients
         self.client_manager = ClientManager()
         
@@ -150,6 +153,20 @@ class ToolHandler:
         self.conversation_history = defaultdict(list)
         self.current_tool = None
 
+        # Long-term memory: only the last `history_window` exchanges are sent
+        # verbatim, older or other-session turns are recalled by similarity
+        self.session_id = session_id
+        self.history_window = history_window
+        self.recall_token_budget = recall_token_budget
+        # Without the embedding model, fall back to hashed embeddings in their own
+        # directory so the two vector spaces are never mixed in one matrix
+        memory_dir = os.getenv("DEVDUCK_MEMORY_DIR", "memory_store")
+        embedder = LocalEmbedder(self.client_manager.get_client("local"))
+        if embedder.probe():
+            self.memory = VectorMemory(directory=memory_dir, embed=embedder)
+        else:
+            self.memory = VectorMemory(directory=os.path.join(memory_dir, "hashed"))
+
     def _register_default_tools(self):
         """Register the default set of tools."""
         # Internet Search Tool
@@ -231,13 +248,25 @@ class ToolHandler:
             {"role": "user", "content": user_message},
             {"role": "assistant", "content": assistant_message}
         ])
+        self.memory.add(user_message, assistant_message, session_id=self.session_id, tool=tool_name)
 
     def get_conversation_messages(self, tool_name: str, text: str) -> List[Dict[str, str]]:
-        """Get the full conversation history for a tool."""
+        """Get the recent conversation history for a tool, plus recalled older turns."""
         messages = [
             {"role": "system", "content": self.registry.get_system_prompt(tool_name)}
         ]
-        messages.extend(self.conversation_history[tool_name])
+        history = self.conversation_history[tool_name]
+        recent = history[-2 * self.history_window:] if self.history_window else []
+        recent_texts = {m["content"] for m in recent if m["role"] == "user"}
+        recalled = self.memory.recall(
+            text,
+            token_budget=self.recall_token_budget,
+            exclude=lambda record: record["user"] in recent_texts
+        )
+        recall_text = VectorMemory.format_recall(recalled)
+        if recall_text:
+            messages.append({"role": "system", "content": recall_text})
+        messages.extend(recent)
         messages.append({"role": "user", "content": text})
         return messages
 
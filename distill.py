@@ -0,0 +1,225 @@
+"""
+Router distillation: a small in-process classifier trained on logged LLM
+routing decisions.
+
+With DEVDUCK_ROUTING_LOG set (off by default, the log holds raw user text),
+Router logs every valid LLM decision for a real turn (text, previous tool,
+chosen tool) there. `train` fits a
+multinomial logistic regression over hashed word uni/bigrams plus the
+previous tool and saves it as a versioned artifact in DEVDUCK_ROUTER_MODEL
+(default router_models/):
+
+    router_v<N>.npz    weights and bias
+    router_v<N>.json   labels, feature settings, sample counts, held-out accuracy
+
+ToolHandler loads the newest version at startup and Router asks it first; the
+LLM only routes when the classifier's confidence is below the threshold (and
+those decisions are logged, so the next training run covers them).
+
+    python distill.py train --log router_data/routes.jsonl [--out router_models] [--epochs 300]
+    python distill.py info [--out router_models]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import time
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+FORMAT_VERSION = 1
+_WORD = re.compile(r"[a-z0-9']+")
+_ARTIFACT = re.compile(r"router_v(\d+)\.json$")
+
+
+def features(text: str, previous_tool: Optional[str], dim: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Hashed feature indices and L2-normalised weights for one routing input."""
+    words = _WORD.findall(text.lower())
+    grams = words + [a + " " + b for a, b in zip(words, words[1:])]
+    grams.append(f"__prev={previous_tool or ''}")
+    counts: Dict[int, float] = {}
+    for gram in grams:
+        index = zlib.crc32(gram.encode("utf-8")) % dim
+        counts[index] = counts.get(index, 0.0) + 1.0
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    return indices, values / np.linalg.norm(values)
+
+
+def _batch(samples: Sequence[Tuple[str, Optional[str]]], dim: int):
+    """Sparse (rows, indices, values) for a list of (text, previous_tool)."""
+    rows, indices, values = [], [], []
+    for row, (text, previous_tool) in enumerate(samples):
+        idx, val = features(text, previous_tool, dim)
+        rows.append(np.full(len(idx), row, dtype=np.int64))
+        indices.append(idx)
+        values.append(val)
+    return np.concatenate(rows), np.concatenate(indices), np.concatenate(values)
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class DistilledRouter:
+    def __init__(self, labels: List[str], weights: np.ndarray, bias: np.ndarray, meta: Dict = None):
+        self.labels = list(labels)
+        self.weights = weights
+        self.bias = bias
+        self.dim = weights.shape[0]
+        self.meta = meta or {}
+
+    @property
+    def version(self) -> Optional[int]:
+        return self.meta.get("version")
+
+    def probabilities(self, text: str, previous_tool: Optional[str] = None) -> np.ndarray:
+        indices, values = features(text, previous_tool, self.dim)
+        logits = values @ self.weights[indices] + self.bias
+        return _softmax(logits[None, :])[0]
+
+    def predict(self, text: str, previous_tool: Optional[str] = None) -> Tuple[str, float]:
+        """(tool, confidence) for one routing input."""
+        probabilities = self.probabilities(text, previous_tool)
+        best = int(probabilities.argmax())
+        return self.labels[best], float(probabilities[best])
+
+    def save(self, directory: str) -> str:
+        """Write the next router_v<N> artifact in `directory`; returns the metadata path."""
+        os.makedirs(directory, exist_ok=True)
+        version = (latest_version(directory) or 0) + 1
+        base = os.path.join(directory, f"router_v{version}")
+        np.savez_compressed(base + ".npz", weights=self.weights, bias=self.bias)
+        self.meta.update(version=version, format=FORMAT_VERSION, labels=self.labels, dim=self.dim,
+                         created=int(time.time()))
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, indent=2)
+        return base + ".json"
+
+    @classmethod
+    def load(cls, meta_path: str) -> "DistilledRouter":
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"{meta_path}: unsupported router artifact format {meta.get('format')}")
+        arrays = np.load(meta_path[:-len(".json")] + ".npz")
+        return cls(meta["labels"], arrays["weights"], arrays["bias"], meta)
+
+
+def latest_version(directory: str) -> Optional[int]:
+    if not os.path.isdir(directory):
+        return None
+    versions = [int(m.group(1)) for m in map(_ARTIFACT.match, os.listdir(directory)) if m]
+    return max(versions) if versions else None
+
+
+def load_latest(directory: str) -> Optional[DistilledRouter]:
+    """The newest artifact in `directory`, or None if there is none."""
+    version = latest_version(directory)
+    if version is None:
+        return None
+    return DistilledRouter.load(os.path.join(directory, f"router_v{version}.json"))
+
+
+def read_log(path: str) -> List[Dict]:
+    """Logged decisions, de-duplicated (the same input can be routed more than once)."""
+    records, seen = [], set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            key = (record["text"], record.get("prev"), record["tool"])
+            if key not in seen:
+                seen.add(key)
+                records.append(record)
+    return records
+
+
+def fit(samples: Sequence[Tuple[str, Optional[str]]], targets: Sequence[str], dim: int = 2 ** 14,
+        epochs: int = 300, learning_rate: float = 0.5, l2: float = 1e-4) -> DistilledRouter:
+    """Full-batch gradient descent on softmax cross-entropy over sparse hashed features."""
+    labels = sorted(set(targets))
+    label_index = {label: i for i, label in enumerate(labels)}
+    y = np.array([label_index[t] for t in targets], dtype=np.int64)
+    rows, indices, values = _batch(samples, dim)
+    n, classes = len(samples), len(labels)
+    weights = np.zeros((dim, classes), dtype=np.float32)
+    bias = np.zeros(classes, dtype=np.float32)
+    onehot = np.eye(classes, dtype=np.float32)[y]
+
+    for _ in range(epochs):
+        logits = np.tile(bias, (n, 1))
+        np.add.at(logits, rows, values[:, None] * weights[indices])
+        error = (_softmax(logits) - onehot) / n
+        grad = l2 * weights
+        np.add.at(grad, indices, values[:, None] * error[rows])
+        weights -= learning_rate * grad
+        bias -= learning_rate * error.sum(axis=0)
+    return DistilledRouter(labels, weights, bias)
+
+
+def accuracy(model: DistilledRouter, samples, targets) -> float:
+    if not samples:
+        return float("nan")
+    hits = sum(model.predict(text, previous)[0] == target for (text, previous), target in zip(samples, targets))
+    return hits / len(samples)
+
+
+def train(log_path: str, out_dir: str, dim: int = 2 ** 14, epochs: int = 300, holdout: float = 0.2,
+          seed: int = 0) -> DistilledRouter:
+    records = read_log(log_path)
+    if len({r["tool"] for r in records}) < 2:
+        raise ValueError(f"{log_path}: need logged decisions for at least two tools, found {len(records)} records")
+    random.Random(seed).shuffle(records)
+    split = int(len(records) * (1 - holdout)) if len(records) >= 10 else len(records)
+    samples = [(r["text"], r.get("prev")) for r in records]
+    targets = [r["tool"] for r in records]
+
+    held_out = accuracy(fit(samples[:split], targets[:split], dim, epochs), samples[split:], targets[split:]) \
+        if split < len(records) else None
+    # The shipped model is refit on everything
+    model = fit(samples, targets, dim, epochs)
+    model.meta = {
+        "samples": len(records),
+        "holdout_accuracy": None if held_out is None else round(held_out, 4),
+        "train_accuracy": round(accuracy(model, samples, targets), 4),
+        "epochs": epochs,
+        "source": os.path.abspath(log_path),
+    }
+    model.save(out_dir)
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    sub = parser.add_subparsers(dest="command", required=True)
+    train_parser = sub.add_parser("train", help="fit a new router version from the routing log")
+    train_parser.add_argument("--log", default=os.getenv("DEVDUCK_ROUTING_LOG"), required=not os.getenv("DEVDUCK_ROUTING_LOG"),
+                              help="routing log to train on (default DEVDUCK_ROUTING_LOG)")
+    train_parser.add_argument("--out", default=os.getenv("DEVDUCK_ROUTER_MODEL", "router_models"))
+    train_parser.add_argument("--dim", type=int, default=2 ** 14, help="hashed feature dimensions")
+    train_parser.add_argument("--epochs", type=int, default=300)
+    train_parser.add_argument("--holdout", type=float, default=0.2)
+    info_parser = sub.add_parser("info", help="show the newest router version")
+    info_parser.add_argument("--out", default=os.getenv("DEVDUCK_ROUTER_MODEL", "router_models"))
+    args = parser.parse_args()
+
+    if args.command == "train":
+        model = train(args.log, args.out, args.dim, args.epochs, args.holdout)
+    else:
+        model = load_latest(args.out)
+        if model is None:
+            parser.exit(1, f"No router artifact in {args.out}\n")
+    meta = model.meta
+    print(f"router v{meta['version']}: {meta['samples']} samples, labels {', '.join(model.labels)}")
+    print(f"train accuracy {meta['train_accuracy']}, held-out accuracy {meta['holdout_accuracy']}")
+
+
+if __name__ == "__main__":
+    main()
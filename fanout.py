@@ -0,0 +1,181 @@
+"""
+Parallel multi-tool fan-out with a merged streaming response.
+
+Every branch's `process` stream runs on its own thread from the start, so the
+wall-clock time of a fan-out is that of the slowest surviving branch rather
+than the sum. Branches that miss their deadline are cancelled (closing their
+upstream request) and dropped without affecting the others.
+
+Merge policies:
+    sectioned    one section per tool, in routing order; the first section
+                 streams live while later ones buffer in the background
+    interleaved  whichever branch has a finished sentence goes next, with a
+                 header whenever the speaking tool changes
+"""
+import queue
+import re
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+from cancellation import CancellationToken
+
+MERGE_POLICIES = ("sectioned", "interleaved")
+
+_BOUNDARY = re.compile(r"[.!?\n](?=\s|$)")
+
+
+class FanOutStream:
+    """Iterator over the merged output; `outputs` holds each branch's own text."""
+
+    def __init__(self, branches: Dict[str, Callable[[CancellationToken], Iterator[str]]],
+                 policy: str = "sectioned", timeouts: Dict[str, float] = None,
+                 default_timeout: float = 60.0, cancel_token: CancellationToken = None,
+                 headers: Dict[str, str] = None):
+        if policy not in MERGE_POLICIES:
+            raise ValueError(f"Unknown merge policy '{policy}', expected one of {MERGE_POLICIES}")
+        self.order = list(branches)
+        self.policy = policy
+        self.headers = headers or {name: f"[{name}]" for name in self.order}
+        self.outputs: Dict[str, str] = {name: "" for name in self.order}
+        self.dropped: List[str] = []
+        self.failed: Dict[str, str] = {}
+        self.done = set()
+        self.cancelled = False
+        self.started = time.monotonic()
+
+        timeouts = timeouts or {}
+        self._deadlines = {name: self.started + timeouts.get(name, default_timeout) for name in self.order}
+        self._tokens = {name: CancellationToken() for name in self.order}
+        self._events: queue.Queue = queue.Queue()
+        self._cancel_token = cancel_token
+        if cancel_token is not None:
+            cancel_token.register(self.cancel)
+
+        for name, start in branches.items():
+            threading.Thread(target=self._run_branch, args=(name, start), daemon=True,
+                             name=f"fanout-{name}").start()
+        self._merged = self._merge()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        return next(self._merged)
+
+    def cancel(self):
+        self.cancelled = True
+        for token in self._tokens.values():
+            token.cancel()
+        self._events.put((None, "cancel", None))
+
+    def _run_branch(self, name: str, start: Callable[[CancellationToken], Iterator[str]]):
+        token = self._tokens[name]
+        try:
+            for chunk in start(token):
+                if token.cancelled:
+                    return
+                if chunk:
+                    self._events.put((name, "chunk", chunk))
+        except Exception as e:
+            self._events.put((name, "error", str(e)))
+            return
+        self._events.put((name, "end", None))
+
+    def _next_event(self):
+        """Wait for the next branch event, dropping branches whose deadline passed."""
+        while True:
+            live = [n for n in self.order if n not in self.done]
+            if not live:
+                return None
+            now = time.monotonic()
+            for name in live:
+                if now >= self._deadlines[name]:
+                    self._tokens[name].cancel()
+                    self.dropped.append(name)
+                    self.done.add(name)
+                    return name, "dropped", None
+            wait = min(self._deadlines[n] for n in live) - now
+            try:
+                name, kind, data = self._events.get(timeout=max(0.0, wait))
+            except queue.Empty:
+                continue
+            if kind == "cancel":
+                return None
+            if name in self.done:
+                continue
+            if kind in ("end", "error"):
+                self.done.add(name)
+                if kind == "error":
+                    self.failed[name] = data
+            if kind == "chunk":
+                self.outputs[name] += data
+            return name, kind, data
+
+    def _merge(self) -> Iterator[str]:
+        if self.policy == "sectioned":
+            yield from self._merge_sectioned()
+        else:
+            yield from self._merge_interleaved()
+
+    def _merge_sectioned(self) -> Iterator[str]:
+        emitted = {name: 0 for name in self.order}
+        for index, name in enumerate(self.order):
+            header_sent = False
+            while True:
+                if name in self.dropped:
+                    # Late branch: whatever was already shown stays, nothing more is added
+                    break
+                pending = self.outputs[name][emitted[name]:]
+                if pending:
+                    if not header_sent:
+                        yield ("\n\n" if index else "") + self.headers[name] + "\n"
+                        header_sent = True
+                    emitted[name] += len(pending)
+                    yield pending
+                if name in self.done:
+                    break
+                if self._next_event() is None:
+                    break
+            if self.cancelled:
+                return
+
+    def _merge_interleaved(self) -> Iterator[str]:
+        emitted = {name: 0 for name in self.order}
+        speaker: Optional[str] = None
+
+        def flush(name, final=False):
+            nonlocal speaker
+            pending = self.outputs[name][emitted[name]:]
+            if not final:
+                boundaries = list(_BOUNDARY.finditer(pending))
+                if not boundaries:
+                    return None
+                pending = pending[:boundaries[-1].end()]
+            if not pending:
+                return None
+            emitted[name] += len(pending)
+            prefix = ""
+            if speaker != name:
+                prefix = ("\n\n" if speaker else "") + self.headers[name] + "\n"
+                speaker = name
+            return prefix + pending.lstrip() if prefix else pending
+
+        while True:
+            event = self._next_event()
+            if event is None:
+                break
+            name, kind, _ = event
+            if kind == "dropped":
+                continue
+            piece = flush(name, final=kind != "chunk")
+            if piece:
+                yield piece
+        for name in self.order:
+            if self.cancelled:
+                return
+            if name in self.dropped:
+                continue
+            piece = flush(name, final=True)
+            if piece:
+                yield piece
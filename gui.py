@@ -115,6 +115,8 @@ import threading
 import queue
 import time
 from openai import OpenAI
+from prerouting import PreRouter
+from report_writer import ConversationReport
 
 
 class AudioTranscriptionGUI:
@@ -138,6 +140,11 @@ class AudioTranscriptionGUI:
         self.llm_client = OpenAI(api_key="lm-studio", base_url="http://localhost:1234/v1")
         self.system_prompt = '''You are a helpful assistant. Your job is to filter the user's text (which is a transcript of a conversation) and remove all filler, unnecessary and unrelated text. You must output text directly, such that it can be fed to another llm model. Fix incorrect transcripts to preserve technical knowledge. Just output '''
         self.llm_model_name = "llama-3.2-3b-qnn"
+
+        # Nothing is routed here: every turn starts with the cleanup prompt, so
+        # the PreRouter only throttles warming that prefix while the user speaks
+        self.prefix_warmer = PreRouter(route=lambda text: "cleanup", warm=self.warm_cleanup)
+        self.report = None
         self.create_gui()
         
     def create_gui(self):
@@ -173,6 +180,7 @@ class AudioTranscriptionGUI:
                 if result["text"].strip():
                     self.log_message(result["text"])
                     self.text_chunks.append(result["text"])
+                    self.prefix_warmer.feed("".join(self.text_chunks))
                     
             except queue.Empty:
                 continue
@@ -183,6 +191,7 @@ class AudioTranscriptionGUI:
     def start_recording(self):
         try:
             self.is_recording = True
+            self.prefix_warmer.reset()
             self.stream = sd.InputStream(
                 device=None,
                 channels=self.CHANNELS,
@@ -224,18 +233,29 @@ class AudioTranscriptionGUI:
         self.text_area.insert(tk.END, f"{message}\n")
         self.text_area.see(tk.END)
         
+    def cleanup_messages(self, transcription):
+        history = " ".join(self.history)
+        user_prompt = f'''Here's the transcription, clean it up and preserve technical knowledge and return first person text: "{transcription}"'''
+        return [
+            {"role": "system", "content": self.system_prompt + f''' Here is out conversation till now: "{history}" '''},
+            {"role": "user", "content": user_prompt},
+        ]
+
+    def warm_cleanup(self, tool, partial_transcription):
+        """Have the local server evaluate the cleanup prompt prefix ahead of Stop."""
+        self.llm_client.chat.completions.create(
+            model=self.llm_model_name,
+            messages=self.cleanup_messages(partial_transcription),
+            max_tokens=1,
+        )
+
     def process_text(self):
         transcription = "".join(self.text_chunks)
         self.log_message(transcription)
-        history = " ".join(self.history)
-        user_prompt = f'''Here's the transcription, clean it up and preserve technical knowledge and return first person text: "{transcription}"'''
 
         response1 = self.llm_client.chat.completions.create(
         model=self.llm_model_name,
-        messages=[
-            {"role": "system", "content": self.system_prompt + f''' Here is out conversation till now: "{history}" '''},
-            {"role": "user", "content": user_prompt},
-        ],
+        messages=self.cleanup_messages(transcription),
         )
         cleaned_idea = response1.choices[0].message.content
         system_prompt2 = '''You are a helpful assistant whose job is to guide the user in ideating a project or code approach. do not supply the answer but ask questions to guide the user. '''
@@ -253,6 +273,9 @@ class AudioTranscriptionGUI:
         duck_response = response2.choices[0].message.content
 
         cleaned_idea = response1.choices[0].message.content
+        if self.report is None:
+            self.report = ConversationReport(original_idea=cleaned_idea, project_name="devduck_voice")
+        self.report.add_turn(cleaned_idea, duck_response, tool="ideation")
         self.history.append(duck_response)
         self.log_message(duck_response)
         self.text_chunks = []
@@ -261,6 +284,8 @@ def main():
     root = tk.Tk()
     app = AudioTranscriptionGUI(root)
     root.mainloop()
+    if app.report is not None:
+        app.report.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,67 @@
+"""
+Thread-safe per-session, per-tool conversation history.
+
+Each (session, tool) history is an immutable tuple that is replaced, never
+mutated: writers build the new tuple under the session's lock and swap it in,
+so readers take a snapshot without locking and can never observe a
+half-written exchange (a user message without its reply) or a list that grows
+while a request is being built from it. Sessions have independent locks, so
+turns of different sessions never wait on each other. Session locks are
+reentrant, so a caller can hold one across a read-modify-write that uses the
+store's own methods.
+"""
+import threading
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+Message = Dict[str, str]
+
+
+class ConversationStore:
+    def __init__(self):
+        self._histories: Dict[Hashable, Dict[str, Tuple[Message, ...]]] = {}
+        self._locks: Dict[Hashable, threading.RLock] = {}
+        self._locks_guard = threading.Lock()
+
+    def session_lock(self, session_id) -> threading.RLock:
+        """The lock serializing writes to one session (for read-modify-write callers)."""
+        lock = self._locks.get(session_id)
+        if lock is None:
+            with self._locks_guard:
+                lock = self._locks.setdefault(session_id, threading.RLock())
+                self._histories.setdefault(session_id, {})
+        return lock
+
+    def snapshot(self, session_id, tool_name: str) -> Tuple[Message, ...]:
+        """An immutable view of a tool's history as of now."""
+        return self._histories.get(session_id, {}).get(tool_name, ())
+
+    def messages(self, session_id, tool_name: str) -> List[Message]:
+        """A private copy of the history, safe to extend and send with a request."""
+        return [dict(message) for message in self.snapshot(session_id, tool_name)]
+
+    def append_exchange(self, session_id, tool_name: str, user_message: str, assistant_message: str):
+        """Append a user message and its reply as one atomic step."""
+        exchange = (
+            {"role": "user", "content": user_message},
+            {"role": "assistant", "content": assistant_message},
+        )
+        with self.session_lock(session_id):
+            histories = self._histories[session_id]
+            histories[tool_name] = histories.get(tool_name, ()) + exchange
+
+    def replace(self, session_id, tool_name: str, messages: Iterable[Message]):
+        """Swap in a rewritten history (e.g. a compacted one)."""
+        new = tuple(dict(message) for message in messages)
+        with self.session_lock(session_id):
+            self._histories[session_id][tool_name] = new
+
+    def tools(self, session_id) -> List[str]:
+        return list(self._histories.get(session_id, {}))
+
+    def sessions(self) -> List[Hashable]:
+        with self._locks_guard:
+            return list(self._histories)
+
+    def clear(self, session_id):
+        with self.session_lock(session_id):
+            self._histories[session_id] = {}
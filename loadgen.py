@@ -0,0 +1,247 @@
+"""
+Load generator: N concurrent multi-turn sessions against one ToolHandler.
+
+Every client is replaced by an in-process stub backend with a configurable
+time to first token and token rate, so the numbers measure this process
+(routing, limiters, single-flight, history, threads) rather than a model
+server. The stub router answers according to the tool mix, so routing still
+goes through the normal parse and fallback path. The tool counts in the
+summary are what was actually served; they drift from the mix while the
+handler's current tool keeps turns sticky.
+
+Each session sends `--turns` messages of about `--words` words, waiting an
+exponentially distributed think time between them. A sampler records CPU
+and RSS over time. Runs can sweep several session counts to find the knee.
+
+    python loadgen.py --sessions 1,4,16,64 --turns 5 --think 0.5 \\
+        --mix ideation=0.5,therapist=0.3,internet_search=0.2 --csv results --json results.json
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, List
+
+from main import ToolHandler
+from measure import percentile, rss_bytes
+
+WORDS = ("idea project users data launch plan feeling stress weekend news market team build "
+         "design test ship weather price sleep focus friend career app code").split()
+
+
+class StubBackend:
+    """OpenAI-compatible client that streams `reply_tokens` tokens at a fixed rate."""
+
+    def __init__(self, ttft: float, tokens_per_second: float, reply_tokens: int, mix: Dict[str, float], seed: int):
+        self.ttft = ttft
+        self.token_delay = 1.0 / tokens_per_second if tokens_per_second else 0.0
+        self.reply_tokens = reply_tokens
+        self.tools = list(mix)
+        self.weights = list(mix.values())
+        self.random = random.Random(seed)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _stream(self):
+        time.sleep(self.ttft)
+        for i in range(self.reply_tokens):
+            if i:
+                time.sleep(self.token_delay)
+            delta = SimpleNamespace(content=" tok", role=None, tool_calls=None)
+            yield SimpleNamespace(choices=[SimpleNamespace(index=0, delta=delta, finish_reason=None)])
+
+    def create(self, **request):
+        if request.get("stream"):
+            return self._stream()
+        # Router request: answer with a tool drawn from the mix
+        time.sleep(self.ttft)
+        tool = self.random.choices(self.tools, weights=self.weights)[0]
+        message = SimpleNamespace(role="assistant", content=tool, tool_calls=None)
+        return SimpleNamespace(choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")], usage=None)
+
+
+class Sampler(threading.Thread):
+    def __init__(self, interval: float, progress: Dict[str, int]):
+        super().__init__(daemon=True, name="loadgen-sampler")
+        self.interval = interval
+        self.progress = progress
+        self.samples: List[Dict] = []
+        self._done = threading.Event()
+
+    def run(self):
+        started = last_wall = time.monotonic()
+        last_cpu = time.process_time()
+        while not self._done.wait(self.interval):
+            wall, cpu = time.monotonic(), time.process_time()
+            self.samples.append({
+                "t": round(wall - started, 3),
+                "cpu_percent": round(100 * (cpu - last_cpu) / (wall - last_wall), 1),
+                "rss_mb": round(rss_bytes() / 2 ** 20, 1),
+                "threads": threading.active_count(),
+                "active_turns": self.progress["active"],
+                "completed_turns": self.progress["completed"],
+            })
+            last_wall, last_cpu = wall, cpu
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def run_level(args, sessions: int, mix: Dict[str, float]) -> Dict:
+    handler = ToolHandler()
+    # The stub does the routing, and its picks are not training data
+    handler.router.log = handler.router.distilled = None
+    for client_type in list(handler.client_manager.clients):
+        handler.client_manager.register_client(
+            client_type,
+            StubBackend(args.ttft, args.tokens_per_second, args.reply_tokens, mix, seed=args.seed)
+        )
+    if args.no_limits:
+        handler.client_manager.limiters.clear()
+
+    turns: List[Dict] = []
+    lock = threading.Lock()
+    progress = {"active": 0, "completed": 0}
+    start = threading.Barrier(sessions + 1)
+
+    def session(index: int):
+        rng = random.Random(args.seed * 100003 + index)
+        session_id = f"load-{index}"
+        start.wait()
+        for turn in range(args.turns):
+            if turn:
+                time.sleep(rng.expovariate(1.0 / args.think) if args.think else 0)
+            words = max(1, int(rng.gauss(args.words, args.words / 4)))
+            text = f"[{session_id}/{turn}] " + " ".join(rng.choice(WORDS) for _ in range(words))
+            row = {"sessions": sessions, "session": session_id, "turn": turn, "tool": None,
+                   "start": time.monotonic(), "ttft": None, "total": None, "tokens": 0, "error": ""}
+            with lock:
+                progress["active"] += 1
+            try:
+                tool, response = handler.tool_selection(text, session_id)
+                row["tool"] = tool
+                full = ""
+                for chunk in response:
+                    if chunk:
+                        if row["ttft"] is None:
+                            row["ttft"] = time.monotonic() - row["start"]
+                        row["tokens"] += 1
+                        full += chunk
+                handler.update_conversation_history(tool, text, full, session_id)
+            except Exception as e:
+                row["error"] = str(e)
+            row["total"] = time.monotonic() - row["start"]
+            with lock:
+                progress["active"] -= 1
+                progress["completed"] += 1
+                turns.append(row)
+
+    sampler = Sampler(args.sample_interval, progress)
+    threads = [threading.Thread(target=session, args=(i,), daemon=True) for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    sampler.start()
+    started = time.monotonic()
+    start.wait()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    sampler.stop()
+    if handler.warmer is not None:
+        handler.warmer.stop()
+
+    for row in turns:
+        row["start"] = round(row["start"] - started, 4)
+        for key in ("ttft", "total"):
+            if row[key] is not None:
+                row[key] = round(row[key], 4)
+    ok = [row for row in turns if not row["error"]]
+    ttfts = [row["ttft"] for row in ok if row["ttft"] is not None]
+    summary = {
+        "sessions": sessions,
+        "turns": len(turns),
+        "errors": len(turns) - len(ok),
+        "seconds": round(elapsed, 3),
+        "turns_per_second": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "tokens_per_second": round(sum(row["tokens"] for row in ok) / elapsed, 1) if elapsed else 0.0,
+        "ttft_p50": round(percentile(ttfts, 0.5), 4),
+        "ttft_p99": round(percentile(ttfts, 0.99), 4),
+        "turn_p50": round(percentile([row["total"] for row in ok], 0.5), 4),
+        "turn_p99": round(percentile([row["total"] for row in ok], 0.99), 4),
+        "cpu_percent_mean": round(sum(s["cpu_percent"] for s in sampler.samples) / len(sampler.samples), 1)
+        if sampler.samples else None,
+        "rss_mb_peak": max((s["rss_mb"] for s in sampler.samples), default=round(rss_bytes() / 2 ** 20, 1)),
+        "tools": {tool: sum(1 for row in ok if row["tool"] == tool) for tool in mix},
+    }
+    for sample in sampler.samples:
+        sample["sessions"] = sessions
+    return {"summary": summary, "turns": turns, "samples": sampler.samples}
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def write_csv(path: str, rows: List[Dict]):
+    if not rows:
+        return
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", default="1,4,16", help="comma-separated concurrent session counts to sweep")
+    parser.add_argument("--turns", type=int, default=5, help="turns per session")
+    parser.add_argument("--think", type=float, default=0.5, help="mean think time between turns (seconds)")
+    parser.add_argument("--words", type=int, default=20, help="mean words per user message")
+    parser.add_argument("--mix", default="ideation=0.5,therapist=0.3,internet_search=0.2",
+                        help="tool mix the stub router answers with")
+    parser.add_argument("--ttft", type=float, default=0.05, help="stub backend time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200, help="stub backend token rate")
+    parser.add_argument("--reply-tokens", type=int, default=60)
+    parser.add_argument("--no-limits", action="store_true", help="drop the Perplexity rate limiter")
+    parser.add_argument("--sample-interval", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--csv", help="prefix for <prefix>_summary.csv, _turns.csv and _samples.csv")
+    parser.add_argument("--json", help="write summaries, turns and samples to this JSON file")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    levels = [int(n) for n in args.sessions.split(",")]
+    results = []
+    print(f"{'sessions':>8} {'turns/s':>8} {'tok/s':>8} {'ttft p50':>9} {'ttft p99':>9} "
+          f"{'cpu %':>6} {'rss MB':>7} {'errors':>6}")
+    for sessions in levels:
+        # Tool handlers print a line per turn; keep the table readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = run_level(args, sessions, mix)
+        results.append(result)
+        s = result["summary"]
+        print(f"{s['sessions']:>8} {s['turns_per_second']:>8} {s['tokens_per_second']:>8} {s['ttft_p50']:>9} "
+              f"{s['ttft_p99']:>9} {s['cpu_percent_mean'] if s['cpu_percent_mean'] is not None else '-':>6} "
+              f"{s['rss_mb_peak']:>7} {s['errors']:>6}")
+
+    if args.csv:
+        write_csv(f"{args.csv}_summary.csv",
+                  [{k: v for k, v in r["summary"].items() if k != "tools"} for r in results])
+        write_csv(f"{args.csv}_turns.csv", [row for r in results for row in r["turns"]])
+        write_csv(f"{args.csv}_samples.csv", [sample for r in results for sample in r["samples"]])
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "levels": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
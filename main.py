@@ -1,10 +1,29 @@
 from openai import OpenAI
 from typing import Dict, Tuple, Any, List, Callable
-from collections import defaultdict
 import os
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
 import re
+import threading
+import time
+
+from backends import BackendGroup
+from cancellation import CancellationStats, CancellationToken
+from compaction import HistoryCompactor, compact_prompt, estimate_tokens, message_tokens
+from distill import load_latest
+from fanout import FanOutStream
+from history import ConversationStore
+from plugins import ToolSpec, discover
+from postprocess import display_pipeline
+from rate_limit import BackendLimiter
+from replay import ReplayClient, record_clients, replay_clients
+from report_writer import ConversationReport
+from router import Router, RoutingLog
+from warmup import ModelWarmer
+from singleflight import SingleFlight, make_key
+from slo import SLOPlanner, ThroughputStats
+from token_ledger import TokenCounter, TokenLedger
+from topic_shift import TopicShiftDetector
 
 os.environ['PERPLEXITY_API_KEY'] = "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"
 
@@ -14,6 +33,9 @@ class Tool:
     description: str
     system_prompt: str
     client_type: str
+    # Target seconds for a whole reply, and faster models to fall back to
+    latency_slo: float = None
+    model_variants: Tuple[str, ...] = ()
     
     def to_openai_tool(self) -> Dict:
         """Convert tool to OpenAI tool format."""
@@ -37,13 +59,22 @@ class ClientManager:
     
     def __init__(self):
         self.clients = {}
+        self.limiters: Dict[str, BackendLimiter] = {}
+        self.singleflight = SingleFlight()
+        self.cancellation_stats = CancellationStats()
+        self.throughput = ThroughputStats()
         self._initialize_default_clients()
     
     def _initialize_default_clients(self):
         """Initialize default API clients."""
+        # LOCAL_BASE_URLS can list several LM Studio / OpenAI-compatible servers;
+        # requests are hedged across them when the first one is slow.
         self.register_client(
             "local",
-            OpenAI(api_key="lm-studio", base_url="http://localhost:1234/v1")
+            BackendGroup.from_urls(
+                os.getenv("LOCAL_BASE_URLS", "http://localhost:1234/v1").split(","),
+                api_key="lm-studio"
+            )
         )
         self.register_client(
             "perplexity",
@@ -52,6 +83,20 @@ class ClientManager:
                 base_url="https://api.perplexity.ai"
             )
         )
+        # Perplexity enforces per-minute request and token quotas
+        self.register_limiter(
+            "perplexity",
+            BackendLimiter(
+                requests_per_minute=float(os.getenv("PERPLEXITY_RPM", 50)),
+                tokens_per_minute=float(os.getenv("PERPLEXITY_TPM", 100000)),
+                max_concurrency=int(os.getenv("PERPLEXITY_MAX_CONCURRENCY", 8)),
+            )
+        )
+        # Record or replay every client's completions (see replay.py)
+        if os.getenv("DEVDUCK_RECORD"):
+            record_clients(self, os.getenv("DEVDUCK_RECORD"))
+        elif os.getenv("DEVDUCK_REPLAY"):
+            replay_clients(self, os.getenv("DEVDUCK_REPLAY"), speed=float(os.getenv("DEVDUCK_REPLAY_SPEED", 1)))
         # Example of adding more clients:
         # self.register_client(
         #     "anthropic",
@@ -68,97 +113,365 @@ class ClientManager:
             raise ValueError(f"Client type '{client_type}' not registered")
         return self.clients[client_type]
 
+    def register_limiter(self, client_type: str, limiter: BackendLimiter):
+        """Rate limit all requests sent through a client type."""
+        self.limiters[client_type] = limiter
+
+    def get_limiter(self, client_type: str) -> BackendLimiter:
+        """Get the limiter for a client type, or None if it is unlimited."""
+        return self.limiters.get(client_type)
+
 class BaseTool(ABC):
+    # Model and client the handler generates with; also used for warming.
+    # ToolHandler may override model and max_tokens per request (see slo.py).
+    model: str = None
+    client_type: str = "local"
+    max_tokens: int = None
+    # Set by ToolHandler.create_handler so usage is booked to the session and tool
+    ledger: TokenLedger = None
+    session_id = None
+    tool_name: str = None
+
     def __init__(self, client_manager: ClientManager):
         self.client_manager = client_manager
         
     @abstractmethod
-    def process(self, text: str, history:str) -> str:
+    def process(self, text: str, history:str, cancel_token: CancellationToken = None) -> str:
         pass
 
+    def stream_completion(self, client_type: str, cancel_token: CancellationToken = None, **kwargs):
+        """Stream a chat completion, yielding content deltas.
+
+        Requests go through the client type's limiter when one is registered,
+        and identical concurrent requests share a single upstream stream.
+        Cancelling `cancel_token` ends the stream immediately and closes the
+        upstream response once no other subscriber needs it.
+        """
+        kwargs = {key: value for key, value in kwargs.items() if value is not None}
+        client = self.client_manager.get_client(client_type)
+        limiter = self.client_manager.get_limiter(client_type)
+        stats = self.client_manager.cancellation_stats
+        upstream = {}
+
+        def create():
+            upstream["response"] = client.chat.completions.create(stream=True, **kwargs)
+            return upstream["response"]
+
+        def close_upstream(flight):
+            # Called once per abandoned upstream, however many subscribers it had
+            generated = sum(1 for chunk in flight.chunks if chunk.choices and chunk.choices[0].delta.content)
+            stats.record_cancellation(kwargs.get("model"), generated, kwargs.get("max_tokens"))
+            response = upstream.get("response")
+            try:
+                if response is not None and hasattr(response, "close"):
+                    response.close()
+            except (ValueError, RuntimeError):
+                # A generator-backed stream that is mid-read is stopped by the
+                # flight's pump thread at the next chunk instead.
+                pass
+
+        def open_stream():
+            if limiter is None:
+                return create()
+            prompt_chars = sum(len(str(m.get("content", ""))) for m in kwargs.get("messages", []))
+            max_tokens = kwargs.get("max_tokens", 512)
+            return limiter.stream(create, estimated_tokens=prompt_chars / 4 + max_tokens, max_tokens=max_tokens)
+
+        ledger, tool_name = self.ledger, self.tool_name or type(self).__name__
+        if ledger is not None:
+            ledger.record_prompt(self.session_id, tool_name, kwargs.get("messages", []))
+
+        key = make_key(type(self).__name__, client_type, kwargs)
+        response = self.client_manager.singleflight.stream(
+            key, open_stream, cancel_token=cancel_token, on_abandon=close_upstream
+        )
+        emitted = 0
+        started = time.monotonic()
+        first = last = None
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                emitted += 1
+                last = time.monotonic()
+                if first is None:
+                    first = last
+                if ledger is not None:
+                    ledger.record_completion(self.session_id, tool_name, chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+
+        if cancel_token is None or not cancel_token.cancelled:
+            stats.record_completion(kwargs.get("model"), emitted)
+            # Only the subscriber that opened the stream saw real timing; followers
+            # and replayed fixtures would skew the model's throughput estimate
+            if first is not None and "response" in upstream and not isinstance(client, ReplayClient):
+                self.client_manager.throughput.record(kwargs.get("model"), first - started, emitted, last - first)
+
+    def warm(self, text: str, history: List[Dict[str, str]]):
+        """Have a local server evaluate (and cache) this tool's prompt prefix."""
+        if self.client_type != "local" or not self.model:
+            return
+        client = self.client_manager.get_client(self.client_type)
+        client.chat.completions.create(
+            model=self.model,
+            messages=history + [{"role": "user", "content": text}],
+            max_tokens=1
+        )
+
 class InternetSearchTool(BaseTool):
-    def process(self, text: str, history:str) -> str:
+    model = "llama-3.1-sonar-large-128k-online"
+    client_type = "perplexity"
+    max_tokens = 1024
+
+    def process(self, text: str, history:str, cancel_token: CancellationToken = None) -> str:
         print(f"**Selected tool: internet_search**")
         # print(f"Searching the internet for: {text}")
-        client = self.client_manager.get_client("perplexity")
-        response = client.chat.completions.create(
-            model="llama-3.1-sonar-large-128k-online",
+        # Strip [n] citation markers as they stream, even when split across chunks
+        yield from display_pipeline().apply(self.stream_completion(
+            self.client_type,
+            cancel_token=cancel_token,
+            model=self.model,
             messages=[{"role": "user", "content": text + f"Here is the conversation history: {history}"}],
-            max_tokens=1024,
-            stream=True
-        )
-        for chunk in response:
-            if chunk.choices[0].delta.content:
-                yield chunk.choices[0].delta.content
+            max_tokens=self.max_tokens
+        ))
 
 
 class IdeationTool(BaseTool):
-    def process(self, text: str, history:str) -> str:
+    model = "llama-3.2-3b-qnn"
+
+    def process(self, text: str, history:str, cancel_token: CancellationToken = None) -> str:
         print(f"**Selected tool: ideation**")
         # print(f"Processing ideation query: {text}")
         # print(f"history: {history}")
-        client = self.client_manager.get_client("local")
         input_text = f"You are an ideation specialist. Do not immediately provide solutions. Always ask questions to help the user think through their ideas: {text}"
-        response = client.chat.completions.create(
-            model="llama-3.2-3b-qnn",
+        yield from self.stream_completion(
+            self.client_type,
+            cancel_token=cancel_token,
+            model=self.model,
             messages= history + [{"role": "user", "content": input_text}],
-            stream=True
+            max_tokens=self.max_tokens
         )
-        for chunk in response:
-            if chunk.choices[0].delta.content:
-                yield chunk.choices[0].delta.content
 
 class TherapistTool(BaseTool):
-    def process(self, text: str, history:str) -> str:
+    model = "llama-3.2-3b-qnn"
+
+    def process(self, text: str, history:str, cancel_token: CancellationToken = None) -> str:
         print(f"**Selected tool: therapist**")
         # print(f"Processing therapist query: {text}")
         # print(f"history: {history}")
-        client = self.client_manager.get_client("local")
         input_text = f"Talk to the user about their mental health and provide emotional support: {text}. Here is the conversation history: {history}"
-        response = client.chat.completions.create(
-            model="llama-3.2-3b-qnn",
+        yield from self.stream_completion(
+            self.client_type,
+            cancel_token=cancel_token,
+            model=self.model,
             messages= history + [{"role": "user", "content": input_text}],
-            stream=True
+            max_tokens=self.max_tokens
         )
-        for chunk in response:
-            if chunk.choices[0].delta.content:
-                yield chunk.choices[0].delta.content
+STICKY_MODES = ("shift", "always", "never")
+
+ROUTER_PROMPT = (
+    "You are an expert decision maker. I want your help to make a tool choice depending on the tools provided. "
+    "Tools:\n{catalogue}\n"
+    "Here is the text that you should use to decide what tool to use: {text}. "
+    "Return only the tool name. Previously used tool: {previous_tool}. It might be a follow up question."
+)
+
+@dataclass(frozen=True)
+class RegistrySnapshot:
+    """Everything routing needs, precompiled once per registry change.
+
+    Snapshots are shared by every reader and never copied, so treat the
+    contained list and dicts as read-only.
+    """
+    version: int
+    openai_tools: List[Dict]
+    catalogue: str
+    router_prompt_parts: Tuple[str, str, str]
+
+    def router_prompt(self, text: str, previous_tool: str = None) -> str:
+        head, middle, tail = self.router_prompt_parts
+        return head + text + middle + str(previous_tool) + tail
+
+class _LazyHandlers(dict):
+    """Handler classes by tool name; plugin handlers are imported on first lookup."""
+
+    def __init__(self):
+        super().__init__()
+        self.loaders: Dict[str, Callable[[], type]] = {}
+
+    def __missing__(self, name: str):
+        if name not in self.loaders:
+            raise KeyError(name)
+        handler_class = self.loaders[name]()
+        self[name] = handler_class
+        return handler_class
+
 class ToolRegistry:
     """Registry of all available tools and their configurations."""
     
-    def __init__(self):
+    def __init__(self, count_tokens: Callable[[str], int] = None):
         self.tools: Dict[str, Tool] = {}
-        self.tool_handlers: Dict[str, BaseTool] = {}
+        # Only loaded handlers are iterable here; lookups load plugin handlers
+        self.tool_handlers: Dict[str, BaseTool] = _LazyHandlers()
+        self.prompt_loaders: Dict[str, Callable[[], str]] = {}
+        # System prompts are compacted once here; tokens saved per request, by tool
+        self.count_tokens: Callable[[str], int] = count_tokens or estimate_tokens
+        self.prompt_savings: Dict[str, int] = {}
+        self.snapshot = self._build_snapshot(version=0)
         
     def register_tool(self, tool: Tool, handler_class: type[BaseTool]):
         """Register a new tool and its handler."""
+        if tool.system_prompt is not None:
+            tool.system_prompt = self._compact_prompt(tool.name, tool.system_prompt)
         self.tools[tool.name] = tool
         self.tool_handlers[tool.name] = handler_class
+        # Swap in a new snapshot; readers holding the old one are unaffected
+        self.snapshot = self._build_snapshot(version=self.snapshot.version + 1)
+
+    def register_lazy_tools(self, specs: List[ToolSpec]):
+        """Register plugin tools; handlers and file prompts load on first use."""
+        for spec in specs:
+            if spec.name in self.tools:
+                print(f"Skipping tool plugin {spec.name} from {spec.source}: name already registered")
+                continue
+            self.tools[spec.name] = Tool(
+                name=spec.name,
+                description=spec.description,
+                system_prompt=None if spec.system_prompt is None else self._compact_prompt(spec.name, spec.system_prompt),
+                client_type=spec.client_type,
+                latency_slo=spec.latency_slo,
+                model_variants=tuple(spec.model_variants)
+            )
+            self.tool_handlers.loaders[spec.name] = spec.load_handler
+            if spec.system_prompt is None:
+                self.prompt_loaders[spec.name] = spec.load_system_prompt
+        self.snapshot = self._build_snapshot(version=self.snapshot.version + 1)
+
+    def _compact_prompt(self, tool_name: str, prompt: str) -> str:
+        compacted = compact_prompt(prompt)
+        self.prompt_savings[tool_name] = self.count_tokens(prompt) - self.count_tokens(compacted)
+        return compacted
+
+    def _build_snapshot(self, version: int) -> RegistrySnapshot:
+        openai_tools = [tool.to_openai_tool() for tool in self.tools.values()]
+        catalogue = "\n".join(f"- {tool.name}: {tool.description}" for tool in self.tools.values())
+        # Split before inserting the catalogue so tool descriptions can't clash with placeholders
+        head, rest = ROUTER_PROMPT.split("{text}")
+        middle, tail = rest.split("{previous_tool}")
+        head = head.replace("{catalogue}", catalogue)
+        return RegistrySnapshot(
+            version=version,
+            openai_tools=openai_tools,
+            catalogue=catalogue,
+            router_prompt_parts=(head, middle, tail),
+        )
         
     def get_openai_tools(self) -> List[Dict]:
         """Get all tools in OpenAI format."""
-        return [tool.to_openai_tool() for tool in self.tools.values()]
+        return self.snapshot.openai_tools
     
     def get_system_prompt(self, tool_name: str) -> str:
         """Get system prompt for a specific tool."""
-        return self.tools[tool_name].system_prompt
+        tool = self.tools[tool_name]
+        if tool.system_prompt is None:
+            tool.system_prompt = self._compact_prompt(tool_name, self.prompt_loaders[tool_name]())
+        return tool.system_prompt
     
     def get_client_type(self, tool_name: str) -> str:
         """Get client type for a specific tool."""
         return self.tools[tool_name].client_type
 
 class ToolHandler:
-    def __init__(self):
+    def __init__(self, router_mode: str = None, warmup: bool = None, keepalive_interval: float = None,
+                 report_dir: str = None, report_format: str = "text", tools_dir: str = None,
+                 sticky: str = None, compact_history: bool = None):
         # Initialize OpenAI clients
         self.client_manager = ClientManager()
         
+        # Token accounting with a local tokenizer (DEVDUCK_TOKENIZER, else the local
+        # Llama 3.2 tokenizer if cached), per session and tool
+        self.token_counter = TokenCounter(os.getenv("DEVDUCK_TOKENIZER"), model="llama-3.2-3b-instruct")
+        self.token_ledger = TokenLedger(self.token_counter)
+
         # Initialize tool registry and register tools
-        self.registry = ToolRegistry()
+        self.registry = ToolRegistry(count_tokens=self.token_counter)
         self._register_default_tools()
+        self.load_plugins(tools_dir)
+
+        # Router; ROUTER_MODE picks free / json_schema / codes output. LLM
+        # decisions are only logged when DEVDUCK_ROUTING_LOG is set (they hold
+        # raw user text) and the newest distilled classifier in
+        # DEVDUCK_ROUTER_MODEL answers first
+        routing_log = os.getenv("DEVDUCK_ROUTING_LOG")
+        self.router = Router(
+            self.registry,
+            self.client_manager,
+            model="llama-3.2-3b-instruct",
+            mode=router_mode or os.getenv("ROUTER_MODE", "codes"),
+            default_tool="ideation",
+            log=RoutingLog(routing_log) if routing_log else None,
+            distilled=self._load_distilled_router(os.getenv("DEVDUCK_ROUTER_MODEL", "router_models")),
+            distilled_threshold=float(os.getenv("DEVDUCK_ROUTER_CONFIDENCE", "0.8")),
+            ledger=self.token_ledger,
+        )
+
+        # Optional background warm-up / keep-alive of local models
+        # (DEVDUCK_WARMUP=1, DEVDUCK_KEEPALIVE=<seconds>)
+        if warmup is None:
+            warmup = os.getenv("DEVDUCK_WARMUP", "0") == "1"
+        if keepalive_interval is None and os.getenv("DEVDUCK_KEEPALIVE"):
+            keepalive_interval = float(os.getenv("DEVDUCK_KEEPALIVE"))
+        self.warmer = ModelWarmer(self, keepalive_interval).start() if warmup else None
+
+        # Per-request model / max_tokens choice against each tool's latency SLO
+        # (DEVDUCK_SLO_LOG=<file> logs every selection)
+        self.slo = SLOPlanner(self.client_manager.throughput, log_path=os.getenv("DEVDUCK_SLO_LOG"))
+
+        # Per-session transcripts, appended as each exchange completes
+        # (DEVDUCK_REPORTS=<directory> enables them without code changes)
+        self.report_dir = report_dir or os.getenv("DEVDUCK_REPORTS")
+        self.report_format = report_format
+        self.reports: Dict[Any, ConversationReport] = {}
         
-        # Conversation history
-        self.conversation_history = defaultdict(lambda: defaultdict(list))
+        # Conversation history, safe to read while another thread appends.
+        # DEVDUCK_COMPACT_HISTORY=1 compacts each exchange as it is stored
+        self.conversation_history = ConversationStore()
         self.current_tool = None
+        if compact_history is None:
+            compact_history = os.getenv("DEVDUCK_COMPACT_HISTORY", "0") == "1"
+        self.history_compactor = HistoryCompactor(count=self.registry.count_tokens) if compact_history else None
+        self.history_savings: Dict[Tuple[Any, str], int] = {}
+        self.compaction_stats = {"requests": 0, "tokens_sent": 0, "tokens_saved": 0, "last_request_saved": 0}
+        self._compaction_lock = threading.Lock()
+
+        # Sticky routing (DEVDUCK_STICKY): "shift" keeps each session's tool for
+        # follow-ups and re-routes on a detected topic change, "always" never
+        # re-routes once a tool is chosen, "never" routes every turn
+        self.sticky = sticky or os.getenv("DEVDUCK_STICKY", "shift")
+        if self.sticky not in STICKY_MODES:
+            raise ValueError(f"Unknown sticky routing mode '{self.sticky}', expected one of {STICKY_MODES}")
+        self.topic_detector = TopicShiftDetector()
+        self.session_tools: Dict[Any, str] = {}
+        self.audit_every = 10
+        self.routing_stats = {
+            "turns": 0,
+            "router_calls": 0,
+            "router_calls_avoided": 0,
+            "preselected": 0,
+            "topic_shifts": 0,
+            "false_shifts": 0,
+            "audits": 0,
+            "misroutes_detected": 0,
+        }
+        self._routing_lock = threading.Lock()
+
+    def _load_distilled_router(self, directory: str):
+        try:
+            model = load_latest(directory)
+        except Exception as e:
+            print(f"Ignoring distilled router in {directory}: {e}")
+            return None
+        if model is not None:
+            print(f"Using distilled router v{model.version} ({model.meta.get('samples')} samples)")
+        return model
 
     def _register_default_tools(self):
         """Register the default set of tools."""
@@ -176,7 +489,9 @@ class ToolHandler:
                 - Limit the response to 400 words.
                 
                 Remember to maintain the user's preferred communication style from previous interactions.""",
-                client_type="perplexity"
+                client_type="perplexity",
+                latency_slo=15.0,
+                model_variants=("llama-3.1-sonar-small-128k-online",)
             ),
             InternetSearchTool
         )
@@ -216,7 +531,9 @@ class ToolHandler:
 
                 Remember: You're having a friendly chat to help them discover their own solutions. Keep responses conversational and engaging, as if you're brainstorming with a friend over coffee. Adapt your questions and approach based on the specific idea or topic presented, while maintaining context from the entire conversation.
                 """,
-                client_type="local"
+                client_type="local",
+                latency_slo=6.0,
+                model_variants=("llama-3.2-1b-instruct",)
             ),
             IdeationTool
         )
@@ -233,7 +550,9 @@ class ToolHandler:
                 - Keep the conversation flowing naturally
                 - Limit the response to 400 words.
                 """,
-                client_type="local"
+                client_type="local",
+                latency_slo=10.0,
+                model_variants=("llama-3.2-1b-instruct",)
             ),
             TherapistTool
         )
@@ -242,64 +561,239 @@ class ToolHandler:
                          name: str, 
                          description: str, 
                          system_prompt: str, 
-                         handler_class: type[BaseTool]):
+                         handler_class: type[BaseTool],
+                         client_type: str = None):
         """Register a new tool with the system."""
-        tool = Tool(name=name, description=description, system_prompt=system_prompt)
+        tool = Tool(
+            name=name,
+            description=description,
+            system_prompt=system_prompt,
+            client_type=client_type or handler_class.client_type
+        )
         self.registry.register_tool(tool, handler_class)
 
+    def load_plugins(self, tools_dir: str = None):
+        """Register tools from entry points and `tools_dir` (DEVDUCK_TOOLS_DIR by default)."""
+        self.registry.register_lazy_tools(discover(tools_dir or os.getenv("DEVDUCK_TOOLS_DIR")))
+
     def update_conversation_history(self, tool_name: str, user_message: str, assistant_message: str, session_id):
         """Update the conversation history for the specified tool."""
-        self.conversation_history[session_id][tool_name].extend([
-            {"role": "user", "content": user_message},
-            {"role": "assistant", "content": assistant_message}
-        ])
+        # One session lock around read, compaction and append, so concurrent turns
+        # of a session never compact against a history the other is changing (it
+        # also keeps close_report from closing the transcript mid-write)
+        with self.conversation_history.session_lock(session_id):
+            stored_user, stored_assistant = user_message, assistant_message
+            if self.history_compactor is not None:
+                (user, assistant), saved = self.history_compactor.compact_new(
+                    self.conversation_history.snapshot(session_id, tool_name),
+                    [{"role": "user", "content": user_message}, {"role": "assistant", "content": assistant_message}]
+                )
+                stored_user, stored_assistant = user["content"], assistant["content"]
+                with self._compaction_lock:
+                    key = (session_id, tool_name)
+                    self.history_savings[key] = self.history_savings.get(key, 0) + saved
+            self.conversation_history.append_exchange(session_id, tool_name, stored_user, stored_assistant)
+            if self.report_dir:
+                self._report(session_id).add_turn(user_message, assistant_message, tool=tool_name)
+
+    def get_report(self, session_id) -> ConversationReport:
+        """The streaming transcript for a session, created on first use."""
+        with self.conversation_history.session_lock(session_id):
+            return self._report(session_id)
+
+    def _report(self, session_id) -> ConversationReport:
+        # Caller holds the session lock
+        if session_id not in self.reports:
+            self.reports[session_id] = ConversationReport(
+                project_name=f"session_{session_id}",
+                directory=self.report_dir,
+                fmt=self.report_format
+            )
+        return self.reports[session_id]
+
+    def close_report(self, session_id):
+        """Close a session's transcript (its file and sync timer); a later turn starts a new one."""
+        with self.conversation_history.session_lock(session_id):
+            report = self.reports.pop(session_id, None)
+        if report is not None:
+            report.close()
+
+    def close_reports(self):
+        for session_id in list(self.reports):
+            self.close_report(session_id)
+
+    def export_token_ledger(self, path: str = None) -> int:
+        """Export the token ledger to `path` (DEVDUCK_TOKEN_LEDGER by default), if one is set."""
+        path = path or os.getenv("DEVDUCK_TOKEN_LEDGER")
+        return self.token_ledger.export(path) if path else 0
 
     def get_conversation_messages(self, tool_name: str, text: str, session_id) -> List[Dict[str, str]]:
-        """Get the full conversation history for a tool."""
-        messages = self.conversation_history[session_id][tool_name]
+        """Get a copy of the full conversation history for a tool, for one request."""
+        return self.conversation_history.messages(session_id, tool_name)
+
+    def request_messages(self, tool_name: str, text: str, session_id, record: bool = True) -> List[Dict[str, str]]:
+        """History (or the system prompt on a first turn) for one request, with compaction savings recorded."""
+        messages = self.get_conversation_messages(tool_name, text, session_id)
+        if messages:
+            saved = self.history_savings.get((session_id, tool_name), 0)
+        else:
+            messages = [{"role": "system", "content": self.registry.get_system_prompt(tool_name)}]
+            saved = self.registry.prompt_savings.get(tool_name, 0)
+        if record:
+            sent = message_tokens(messages, self.registry.count_tokens)
+            with self._compaction_lock:
+                stats = self.compaction_stats
+                stats["requests"] += 1
+                stats["tokens_sent"] += sent
+                stats["tokens_saved"] += saved
+                stats["last_request_saved"] = saved
         return messages
 
-    def tool_selection(self, text: str, session_id) -> Tuple[str, str]:
-        """Select and execute the appropriate tool."""
+    def create_handler(self, tool_name: str, session_id=None) -> BaseTool:
+        """Instantiate a tool's handler with the model and max_tokens its latency SLO allows."""
+        handler_class = self.registry.tool_handlers[tool_name]
+        handler = handler_class(self.client_manager)
+        handler.ledger, handler.session_id, handler.tool_name = self.token_ledger, session_id, tool_name
+        selection = self.slo.plan(self.registry.tools[tool_name], handler_class.model, handler_class.max_tokens)
+        handler.model, handler.max_tokens = selection.model, selection.max_tokens
+        return handler
+
+    def _previous_tool(self, session_id) -> str:
+        if session_id is None:
+            return self.current_tool
+        return self.session_tools.get(session_id)
+
+    def _route(self, text: str, session_id, log: bool = True) -> Tuple[str, str]:
+        """(tool, how) where how is "sticky", "shift" or "routed"; `log=False` keeps it out of the routing log."""
+        previous = self._previous_tool(session_id)
+        if previous in self.registry.tools and self.sticky != "never":
+            if self.sticky == "always" or not self.topic_detector.is_shift(session_id, text):
+                return previous, "sticky"
+            return self.router.route(text, previous, session_id, log), "shift"
+        return self.router.route(text, previous, session_id, log), "routed"
+
+    def predict_tool(self, text: str, session_id=None) -> str:
+        """The tool tool_selection would pick for `text`, without side effects."""
+        return self._route(text, session_id, log=False)[0]
+
+    def _record_route(self, text: str, session_id, tool: str, how: str):
+        previous = self._previous_tool(session_id)
+        with self._routing_lock:
+            stats = self.routing_stats
+            stats["turns"] += 1
+            audit = False
+            if how == "sticky":
+                stats["router_calls_avoided"] += 1
+                audit = self.audit_every and stats["router_calls_avoided"] % self.audit_every == 0
+            elif how == "preselected":
+                stats["preselected"] += 1
+            else:
+                stats["router_calls"] += 1
+            if how == "shift":
+                stats["topic_shifts"] += 1
+                if tool == previous:
+                    stats["false_shifts"] += 1
+        self.topic_detector.observe(session_id, text, new_topic=how != "sticky" and tool != previous)
+        if audit:
+            # Spot-check a kept tool in the background; disagreement counts as a misroute
+            threading.Thread(target=self._audit_route, args=(text, tool, session_id), daemon=True).start()
+
+    def _audit_route(self, text: str, kept_tool: str, session_id=None):
         try:
-            if not self.current_tool :
-            # Determine which tool to use
-                local_client = self.client_manager.get_client("local")
-                tool_selection_prompt = f"You are an expert decision maker. I want your help to make a tool choice depending on the tools provided. Tools: {self.registry.get_openai_tools()}. Here is the text that you should use to decide what tool to use: {text}. Return only the tool name. Previously used tool: {self.current_tool}. It might be a follow up question."
-                response = local_client.chat.completions.create(
-                    model="llama-3.2-3b-instruct",
-                    messages=[{"role": "user", "content": tool_selection_prompt}],
-                    tools=self.registry.get_openai_tools(),
-                    tool_choice="auto"
-                )
-                
-                # Get selected tool name
-                tool_calls = response.choices[0].message.content
-                selected_tool = tool_calls if tool_calls else "ideation"
+            routed = self.router.route_llm(text, kept_tool, session_id, log=False)
+        except Exception:
+            return
+        with self._routing_lock:
+            self.routing_stats["audits"] += 1
+            if routed != kept_tool:
+                self.routing_stats["misroutes_detected"] += 1
+
+    def warm_tool(self, tool_name: str, text: str, session_id):
+        """Pre-evaluate a tool's prompt prefix on its server (used while the user is speaking)."""
+        messages = self.request_messages(tool_name, text, session_id, record=False)
+        handler = self.registry.tool_handlers[tool_name](self.client_manager)
+        handler.warm(text, messages)
+
+    def tool_selection(self, text: str, session_id, cancel_token: CancellationToken = None,
+                       selected_tool: str = None) -> Tuple[str, str]:
+        """Select and execute the appropriate tool.
+
+        Cancelling `cancel_token` stops the returned stream and closes its
+        upstream request, e.g. when a newer message supersedes this one.
+        Passing `selected_tool` (e.g. from a pre-route) skips routing.
+        """
+        if self.warmer is not None:
+            self.warmer.touch()
+        try:
+            how = "preselected"
+            if selected_tool is None:
+                selected_tool, how = self._route(text, session_id)
+            if selected_tool not in self.registry.tools:
+                selected_tool = "ideation"
+            # Pre-routed turns too, so the topic window keeps following the session
+            self._record_route(text, session_id, selected_tool, how)
                 
-                # Print tool switch notification
-                # if self.current_tool and selected_tool != self.current_tool:
-                    # print(f"\nSwitching from {self.current_tool} to {selected_tool}")
-                self.current_tool = selected_tool
+            # Print tool switch notification
+            # if self.current_tool and selected_tool != self.current_tool:
+                # print(f"\nSwitching from {self.current_tool} to {selected_tool}")
+            self.current_tool = selected_tool
+            if session_id is not None:
+                self.session_tools[session_id] = selected_tool
                 
-            messages = self.get_conversation_messages(selected_tool, text, session_id)
-            if not messages:
-                messages = [{"role": "system", "content": self.registry.get_system_prompt(selected_tool)}]
+            messages = self.request_messages(selected_tool, text, session_id)
                 
             # Create and execute tool handler
-            handler_class = self.registry.tool_handlers[selected_tool]
-            handler = handler_class(self.client_manager)
-            result = handler.process(text, messages)
+            handler = self.create_handler(selected_tool, session_id)
+            if cancel_token is not None and cancel_token.cancelled:
+                return selected_tool, iter(())
+            result = handler.process(text, messages, cancel_token=cancel_token)
             
             return selected_tool, result
 
         except Exception as e:
             # print(f"Error in tool_selection: {str(e)}")
             messages = self.get_conversation_messages("ideation", text, session_id)
-            return "ideation", IdeationTool(self.client_manager).process(text, messages)
+            return "ideation", IdeationTool(self.client_manager).process(text, messages, cancel_token=cancel_token)
 
-    def reset(self):
-        self.current_tool = None
+    def tool_selection_multi(self, text: str, session_id, cancel_token: CancellationToken = None,
+                             max_tools: int = 2, policy: str = "sectioned",
+                             branch_timeout: float = 60.0, timeouts: Dict[str, float] = None) -> Tuple[List[str], FanOutStream]:
+        """Route to up to `max_tools` tools and run them concurrently.
+
+        Returns the selected tools and a FanOutStream of merged output. After
+        consuming it, `stream.outputs` holds each tool's own reply (e.g. for
+        update_conversation_history); tools in `stream.dropped` missed their
+        deadline.
+        """
+        selected_tools = self.router.route_many(text, self._previous_tool(session_id), max_tools=max_tools,
+                                               session_id=session_id)
+        self._record_route(text, session_id, selected_tools[0], "routed")
+        self.current_tool = selected_tools[0]
+        if session_id is not None:
+            self.session_tools[session_id] = selected_tools[0]
+
+        def branch(tool_name):
+            messages = self.request_messages(tool_name, text, session_id)
+            handler = self.create_handler(tool_name, session_id)
+            return lambda token: handler.process(text, messages, cancel_token=token)
+
+        stream = FanOutStream(
+            {tool_name: branch(tool_name) for tool_name in selected_tools},
+            policy=policy,
+            timeouts=timeouts,
+            default_timeout=branch_timeout,
+            cancel_token=cancel_token
+        )
+        return selected_tools, stream
+
+    def reset(self, session_id=None):
+        """Forget the current tool (of one session, or of all of them)."""
+        if session_id is None:
+            self.current_tool = None
+            self.session_tools.clear()
+        else:
+            self.session_tools.pop(session_id, None)
+        self.topic_detector.forget(session_id)
 def main():
     handler = ToolHandler()
     
@@ -329,12 +823,17 @@ def main():
     """
     
     while True:
-        query = input("\nEnter your query (type 'bye' to end): ")
+        query = input("\nEnter your query (type 'bye' to end, 'tokens' for token usage): ")
         if query.lower() == 'bye':
+            handler.close_reports()
+            handler.export_token_ledger()
             print("\nGoodbye! Have a great day!")
             break
+        if query.lower() == 'tokens':
+            print(handler.token_ledger.table())
+            continue
             
-        tool, response = handler.tool_selection(query)
+        tool, response = handler.tool_selection(query, None)
         print(f"Response:")
         for i in response:
             print(i, end="")
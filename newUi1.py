@@ -1,10 +1,11 @@
 import customtkinter as ctk
 import speech_recognition as sr
-import threading
 import pyaudio
 import wave
 import os
 from main import ToolHandler, ClientManager
+from postprocess import speech_pipeline
+from session_executor import SessionExecutor
 import pyttsx3
 
 class VoiceChatApp(ctk.CTk):
@@ -47,6 +48,9 @@ class VoiceChatApp(ctk.CTk):
                                                        command=self.change_appearance_mode)
         self.mode_menu.grid(row=5, column=0, padx=20, pady=(10, 10))
 
+        self.tokens_button = ctk.CTkButton(self.sidebar_frame, text="Token Usage", command=self.show_token_usage)
+        self.tokens_button.grid(row=6, column=0, padx=20, pady=(10, 20))
+
         # Create main frame
         self.main_frame = ctk.CTkFrame(self, corner_radius=0)
         self.main_frame.grid(row=0, column=1, sticky="nsew")
@@ -75,7 +79,12 @@ class VoiceChatApp(ctk.CTk):
         self.speech_engine = pyttsx3.init()
         
         # Initialize ToolHandler and session management
-        self.tool_handler = ToolHandler()
+        self.tool_handler = ToolHandler(report_dir="reports")
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        # Turns of a session run in order; sessions and audio run in parallel
+        # (recording holds a worker for as long as it lasts)
+        self.executor = SessionExecutor(max_workers=int(os.getenv("DEVDUCK_WORKERS", "4")))
         
         # Dictionary to hold chat sessions
         self.sessions = {}
@@ -109,6 +118,19 @@ class VoiceChatApp(ctk.CTk):
 
     def change_appearance_mode(self, new_appearance_mode: str):
         ctk.set_appearance_mode(new_appearance_mode)
+
+    def show_token_usage(self):
+        session_name = self.session_menu.get()
+        table = self.tool_handler.token_ledger.table(session_name)
+        self.chat_display.insert(ctk.END, f"\n{table}\n")
+        self.chat_display.see(ctk.END)
+
+    def on_close(self):
+        self.is_recording = False
+        self.executor.shutdown(wait=False, cancel_pending=True)
+        self.tool_handler.close_reports()
+        self.tool_handler.export_token_ledger()
+        self.destroy()
     
     def start_recording(self):
         self.is_recording = True
@@ -118,7 +140,7 @@ class VoiceChatApp(ctk.CTk):
         self.chat_display.insert(ctk.END, "\nRecording started...\n")
         
         self.stream = self.audio.open(format=pyaudio.paInt16, channels=1, rate=44100, input=True, frames_per_buffer=1024)
-        threading.Thread(target=self.record_audio).start()
+        self.executor.submit("audio", self.record_audio)
         
     def record_audio(self):
         while self.is_recording:
@@ -158,22 +180,28 @@ class VoiceChatApp(ctk.CTk):
 
     def process_input(self, text):
         self.chat_display.insert("end", "\nAI: ")
-        threading.Thread(target=self.stream_response, args=(text,)).start()
+        session_id = self.session_menu.get()
+        self.executor.submit(session_id, self.stream_response, text, session_id)
 
-    def stream_response(self, text):
-        tool, response = self.tool_handler.tool_selection(text, self.session_menu.get())
+    def stream_response(self, text, session_id):
+        tool, response = self.tool_handler.tool_selection(text, session_id)
         self.chat_display.insert(ctk.END, f"Using {tool} tool:")
         full_response = ""
+        # Queue each sentence for speech as soon as it is complete
+        speech = speech_pipeline()
         for chunk in response:
             if chunk is not None:
                 full_response += chunk
                 self.chat_display.insert(ctk.END, chunk)
                 self.chat_display.see(ctk.END)
+                for sentence in speech.push(chunk):
+                    self.speech_engine.say(sentence)
                 
-        self.tool_handler.update_conversation_history(tool, text, full_response, self.session_menu.get())
+        self.tool_handler.update_conversation_history(tool, text, full_response, session_id)
         
-        # Speak the full response
-        self.speech_engine.say(full_response)
+        # Speak the rest of the response
+        for sentence in speech.finish():
+            self.speech_engine.say(sentence)
         # self.speech_engine.runAndWait()
         
         self.chat_display.see(ctk.END)
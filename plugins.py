@@ -0,0 +1,111 @@
+"""
+Tool plugins, discovered from entry points or a config directory.
+
+Only the metadata routing needs (name, description, client type) is read at
+startup. The handler class is named by an import path and imported the first
+time the tool is selected, and a prompt kept in a file is read at the same
+point, so tools that are never used cost neither import time nor memory.
+
+Entry points (group "devduck.tools") should point at a ToolSpec, a dict with
+the same fields, or a list of either, defined in a module that is cheap to
+import:
+
+    [project.entry-points."devduck.tools"]
+    jira = "devduck_jira.spec:JIRA_TOOL"
+
+A config directory (DEVDUCK_TOOLS_DIR) holds one JSON file per tool:
+
+    {"name": "jira", "description": "Look up and file Jira tickets.",
+     "client_type": "local", "handler": "jira_tool:JiraTool",
+     "system_prompt_file": "jira_prompt.txt"}
+
+Handler modules and prompt files may live in the same directory.
+"""
+import importlib
+import json
+import os
+import sys
+from dataclasses import dataclass
+from importlib import metadata
+from typing import List, Optional, Tuple
+
+ENTRY_POINT_GROUP = "devduck.tools"
+
+
+@dataclass
+class ToolSpec:
+    name: str
+    description: str
+    handler: str
+    client_type: str = "local"
+    system_prompt: Optional[str] = None
+    system_prompt_file: Optional[str] = None
+    latency_slo: Optional[float] = None
+    model_variants: Tuple[str, ...] = ()
+    source: str = ""
+
+    def load_handler(self) -> type:
+        """Import and return the handler class (module:Class)."""
+        module_name, _, class_name = self.handler.partition(":")
+        if not class_name:
+            raise ValueError(f"Tool '{self.name}': handler must look like 'module:Class', got '{self.handler}'")
+        if os.path.isdir(self.source) and self.source not in sys.path:
+            sys.path.append(self.source)
+        return getattr(importlib.import_module(module_name), class_name)
+
+    def load_system_prompt(self) -> str:
+        if self.system_prompt is not None:
+            return self.system_prompt
+        if not self.system_prompt_file:
+            return ""
+        path = self.system_prompt_file
+        if not os.path.isabs(path) and os.path.isdir(self.source):
+            path = os.path.join(self.source, path)
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+
+
+def _to_specs(value, source: str) -> List[ToolSpec]:
+    if isinstance(value, ToolSpec):
+        return [value]
+    if isinstance(value, dict):
+        return [ToolSpec(source=source, **value)]
+    if isinstance(value, (list, tuple)):
+        return [spec for item in value for spec in _to_specs(item, source)]
+    raise TypeError(f"Unsupported tool spec from {source}: {type(value).__name__}")
+
+
+def load_entry_points(group: str = ENTRY_POINT_GROUP) -> List[ToolSpec]:
+    try:
+        entry_points = metadata.entry_points(group=group)
+    except TypeError:
+        # Python < 3.10
+        entry_points = metadata.entry_points().get(group, [])
+    specs = []
+    for entry_point in entry_points:
+        try:
+            specs.extend(_to_specs(entry_point.load(), f"entry point {entry_point.value}"))
+        except Exception as e:
+            print(f"Skipping tool plugin {entry_point.name}: {e}")
+    return specs
+
+
+def load_config_dir(directory: str) -> List[ToolSpec]:
+    specs = []
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, file_name), encoding="utf-8") as f:
+                specs.extend(_to_specs(json.load(f), os.path.abspath(directory)))
+        except Exception as e:
+            print(f"Skipping tool plugin {file_name}: {e}")
+    return specs
+
+
+def discover(directory: str = None, group: str = ENTRY_POINT_GROUP) -> List[ToolSpec]:
+    """All plugin tool specs: entry points first, then the config directory."""
+    specs = load_entry_points(group)
+    if directory and os.path.isdir(directory):
+        specs.extend(load_config_dir(directory))
+    return specs
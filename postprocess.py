@@ -0,0 +1,260 @@
+"""
+Incremental post-processing of streamed model output.
+
+Each transformer takes chunks as they arrive (`feed`) and returns the text it
+can already emit, holding back only a short tail that might still turn into
+something it has to rewrite (a citation marker split across chunks, a link
+whose URL has not arrived yet, whitespace that may continue). `flush` emits
+the held tail at the end of the stream. Held tails are bounded, patterns are
+compiled once, and each chunk is processed once, so cleanup adds O(chunk)
+work and never buffers the whole response.
+
+    CitationStripper     removes Perplexity-style [1] / [1, 2] markers
+    WhitespaceNormalizer collapses runs of spaces and blank lines, drops the
+                         space a removed marker leaves before punctuation
+    MarkdownToSpeech     strips headings, bullets, emphasis, code fences and
+                         link URLs so text reads naturally aloud
+    SentenceSegmenter    emits complete sentences only (`push` returns them
+                         one by one), e.g. to start TTS before the reply ends
+
+Transformers are chained with Pipeline.
+"""
+import re
+from abc import ABC, abstractmethod
+from typing import Iterable, Iterator, List
+
+_CITATION = re.compile(r"\[\d+(?:,\s*\d+)*\]")
+_CITATION_PREFIX = re.compile(r"\[[\d,\s]*")
+
+_SPACE_RUN = re.compile(r"(?<=\S)[ \t]{2,}")
+_TRAILING_SPACE = re.compile(r"[ \t]+(?=\n)")
+_BLANK_LINES = re.compile(r"\n{3,}")
+_SPACE_BEFORE_PUNCT = re.compile(r"(?<=\S)[ \t]+(?=[,.;:!?])")
+_TRAILING_WS = re.compile(r"\s+$")
+
+_FENCE = re.compile(r"^[ \t]*```[^\n]*(?:\n|$)", re.M)
+_HEADING = re.compile(r"^[ \t]*#{1,6}[ \t]+", re.M)
+_BULLET = re.compile(r"^[ \t]*(?:[-*+]|\d{1,3}[.)])[ \t]+", re.M)
+_QUOTE = re.compile(r"^[ \t]*>[ \t]?", re.M)
+_LINK = re.compile(r"!?\[([^\]\n]*)\]\([^)\s]*\)")
+_LINK_PREFIX = re.compile(r"!?\[[^\]\n]*(?:\](?:\([^)\s]*)?)?")
+_EMPHASIS = re.compile(r"\*\*|__|[*`]")
+_LINE_START_PREFIX = re.compile(r"[ \t]*(?:#{1,6}|>|[-*+]|\d{1,3}[.)]?|`{1,3}[\w+-]*)?")
+_MARKUP_TAIL = re.compile(r"[*_`]+$")
+
+_SENTENCE_END = re.compile(r"[.!?]+[\"')\]]*(?=\s)|\n")
+
+
+class StreamTransformer(ABC):
+    @abstractmethod
+    def feed(self, chunk: str) -> str:
+        pass
+
+    def flush(self) -> str:
+        return ""
+
+
+class CitationStripper(StreamTransformer):
+    def __init__(self, max_marker: int = 16):
+        self.max_marker = max_marker
+        self._held = ""
+
+    def feed(self, chunk: str) -> str:
+        text = _CITATION.sub("", self._held + chunk)
+        self._held = ""
+        start = text.rfind("[", max(0, len(text) - self.max_marker))
+        if start >= 0 and _CITATION_PREFIX.fullmatch(text, start):
+            text, self._held = text[:start], text[start:]
+        return text
+
+    def flush(self) -> str:
+        text, self._held = self._held, ""
+        return text
+
+
+class WhitespaceNormalizer(StreamTransformer):
+    def __init__(self, strip_leading: bool = True, max_held: int = 64):
+        self.strip_leading = strip_leading
+        self.max_held = max_held
+        self._held = ""
+        self._last = ""
+        self._started = False
+
+    def feed(self, chunk: str) -> str:
+        text = self._held + chunk
+        if not self._started:
+            if self.strip_leading:
+                text = text.lstrip()
+            if not text:
+                self._held = ""
+                return ""
+            self._started = True
+        # Re-attach the last emitted character so lookbehinds see across chunks
+        text = self._last + text
+        text = _TRAILING_SPACE.sub("", text)
+        text = _SPACE_BEFORE_PUNCT.sub("", text)
+        text = _SPACE_RUN.sub(" ", text)
+        text = _BLANK_LINES.sub("\n\n", text)
+        text = text[len(self._last):]
+
+        self._held = ""
+        trailing = _TRAILING_WS.search(text)
+        if trailing and len(text) - trailing.start() <= self.max_held:
+            text, self._held = text[:trailing.start()], text[trailing.start():]
+        if text:
+            self._last = text[-1]
+        return text
+
+    def flush(self) -> str:
+        # Trailing whitespace at the very end is dropped
+        self._held = ""
+        return ""
+
+
+class MarkdownToSpeech(StreamTransformer):
+    def __init__(self, max_link: int = 300):
+        self.max_link = max_link
+        self._held = ""
+        self._line_start = True
+
+    def _convert(self, text: str, line_start: bool) -> str:
+        if not line_start:
+            # The first line continues one already emitted: no line-start rules
+            newline = text.find("\n")
+            if newline < 0:
+                return _EMPHASIS.sub("", _LINK.sub(r"\1", text))
+            return self._convert(text[:newline], False) + "\n" + self._convert(text[newline + 1:], True)
+        text = _FENCE.sub("", text)
+        text = _HEADING.sub("", text)
+        text = _BULLET.sub("", text)
+        text = _QUOTE.sub("", text)
+        text = _LINK.sub(r"\1", text)
+        return _EMPHASIS.sub("", text)
+
+    def _hold_from(self, text: str) -> int:
+        cut = len(text)
+        # An unfinished [label](url)
+        start = text.rfind("[", max(0, len(text) - self.max_link))
+        if start >= 0:
+            if start and text[start - 1] == "!":
+                start -= 1
+            if _LINK_PREFIX.fullmatch(text, start):
+                cut = start
+        # A line prefix (heading, bullet, fence) that is not complete yet
+        line = text.rfind("\n") + 1
+        if (line or self._line_start) and len(text) - line < 12 and _LINE_START_PREFIX.fullmatch(text, line):
+            cut = min(cut, line)
+        # A run of * _ ` that may continue (e.g. ** or ```)
+        markup = _MARKUP_TAIL.search(text)
+        if markup:
+            cut = min(cut, markup.start())
+        return cut
+
+    def feed(self, chunk: str) -> str:
+        text = self._held + chunk
+        cut = self._hold_from(text)
+        ready, self._held = text[:cut], text[cut:]
+        if not ready:
+            return ""
+        out = self._convert(ready, self._line_start)
+        self._line_start = ready.endswith("\n")
+        return out
+
+    def flush(self) -> str:
+        text, self._held = self._held, ""
+        out = self._convert(text, self._line_start) if text else ""
+        self._line_start = True
+        return out
+
+
+class SentenceSegmenter(StreamTransformer):
+    def __init__(self, max_sentence: int = 400):
+        self.max_sentence = max_sentence
+        self._held = ""
+
+    def push(self, chunk: str) -> List[str]:
+        """Return the sentences `chunk` completes, in order."""
+        text = self._held + chunk
+        sentences = []
+        # Only the new part can contain a boundary not already checked
+        position = 0
+        for match in _SENTENCE_END.finditer(text, max(0, len(self._held) - 4)):
+            sentence = text[position:match.end()].strip()
+            if sentence:
+                sentences.append(sentence)
+            position = match.end()
+        text = text[position:]
+        while len(text) > self.max_sentence:
+            # No boundary for too long: cut at the last space instead
+            space = text.rfind(" ", 0, self.max_sentence)
+            cut = space if space > 0 else self.max_sentence
+            sentences.append(text[:cut].strip())
+            text = text[cut:]
+        self._held = text
+        return sentences
+
+    def finish(self) -> List[str]:
+        text, self._held = self._held.strip(), ""
+        return [text] if text else []
+
+    def feed(self, chunk: str) -> str:
+        return "".join(sentence + " " for sentence in self.push(chunk))
+
+    def flush(self) -> str:
+        return "".join(self.finish())
+
+
+class Pipeline(StreamTransformer):
+    """Chain of transformers; `push`/`finish` are available when the last one is a SentenceSegmenter."""
+
+    def __init__(self, *transformers: StreamTransformer):
+        self.transformers = transformers
+
+    def _through(self, chunk: str, upto: int) -> str:
+        for transformer in self.transformers[:upto]:
+            if not chunk:
+                return ""
+            chunk = transformer.feed(chunk)
+        return chunk
+
+    def _flush_through(self, upto: int) -> str:
+        text = ""
+        for transformer in self.transformers[:upto]:
+            text = (transformer.feed(text) if text else "") + transformer.flush()
+        return text
+
+    def feed(self, chunk: str) -> str:
+        return self._through(chunk, len(self.transformers))
+
+    def flush(self) -> str:
+        return self._flush_through(len(self.transformers))
+
+    def push(self, chunk: str) -> List[str]:
+        text = self._through(chunk, len(self.transformers) - 1)
+        return self.transformers[-1].push(text) if text else []
+
+    def finish(self) -> List[str]:
+        text = self._flush_through(len(self.transformers) - 1)
+        last = self.transformers[-1]
+        return (last.push(text) if text else []) + last.finish()
+
+    def apply(self, chunks: Iterable[str]) -> Iterator[str]:
+        """Transform a stream of chunks, e.g. the output of BaseTool.process."""
+        for chunk in chunks:
+            if chunk:
+                out = self.feed(chunk)
+                if out:
+                    yield out
+        tail = self.flush()
+        if tail:
+            yield tail
+
+
+def display_pipeline() -> Pipeline:
+    """Cleanup for text shown to the user."""
+    return Pipeline(CitationStripper(), WhitespaceNormalizer())
+
+
+def speech_pipeline() -> Pipeline:
+    """Cleanup for text read aloud, one sentence at a time via push/finish."""
+    return Pipeline(CitationStripper(), MarkdownToSpeech(), WhitespaceNormalizer(), SentenceSegmenter())
@@ -0,0 +1,128 @@
+"""
+Pre-routing on partial transcripts.
+
+While the user is still speaking, the voice front-ends feed each partial
+transcript to a PreRouter. On a background thread it predicts the tool for the
+text so far and warms that tool on the local server (a one-token request with
+the same prompt prefix, so LM Studio has the prefix evaluated and cached). When
+recording stops, `final_tool` hands back the prediction if the final
+transcript is essentially what was pre-routed, so only generation remains.
+
+`stats()` reports how often the pre-route matched the final route, over the
+utterances where that is known: those routed again because the prediction
+was not reused, plus a sample (`audit_rate`, off by default) of reused ones
+whose final transcript is re-routed on a background thread. Audits compete
+with the answer being generated on the same local model, so keep the rate
+low.
+"""
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+
+class PreRouter:
+    def __init__(self,
+                 route: Callable[[str], str],
+                 warm: Callable[[str, str], None] = None,
+                 min_interval: float = 1.0,
+                 min_chars: int = 12,
+                 reuse_ratio: float = 0.8,
+                 audit_rate: float = 0.0):
+        self.route = route
+        self.warm = warm
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+        self.reuse_ratio = reuse_ratio
+        self.audit_rate = audit_rate
+
+        self._lock = threading.Lock()
+        self._busy = False
+        self._last_fed = 0.0
+        self._pending_text: Optional[str] = None
+        self.predicted_tool: Optional[str] = None
+        self.predicted_text = ""
+        self.warmed_tools = set()
+        self.counts = {"utterances": 0, "checked": 0, "matched": 0, "reused": 0, "preroutes": 0}
+
+    def reset(self):
+        """Forget the current utterance (call when recording starts)."""
+        with self._lock:
+            self.predicted_tool = None
+            self.predicted_text = ""
+            self._pending_text = None
+            self.warmed_tools = set()
+
+    def feed(self, partial_text: str):
+        """Offer the transcript so far; never blocks the caller."""
+        partial_text = partial_text.strip()
+        now = time.monotonic()
+        with self._lock:
+            if len(partial_text) < self.min_chars or partial_text == self.predicted_text:
+                return
+            if self._busy or now - self._last_fed < self.min_interval:
+                # Keep only the newest text; it is picked up when the worker frees up
+                self._pending_text = partial_text
+                return
+            self._busy = True
+            self._last_fed = now
+        threading.Thread(target=self._preroute, args=(partial_text,), daemon=True).start()
+
+    def _preroute(self, text: str):
+        while text:
+            try:
+                tool = self.route(text)
+                with self._lock:
+                    self.counts["preroutes"] += 1
+                    self.predicted_tool, self.predicted_text = tool, text
+                    needs_warm = tool not in self.warmed_tools
+                    self.warmed_tools.add(tool)
+                if needs_warm and self.warm is not None:
+                    self.warm(tool, text)
+            except Exception as e:
+                print(f"Pre-route failed: {e}")
+            with self._lock:
+                text, self._pending_text = self._pending_text, None
+                if not text:
+                    self._busy = False
+
+    def final_tool(self, final_text: str) -> Optional[str]:
+        """Return the pre-routed tool if it still applies to `final_text`, else None."""
+        final_text = final_text.strip()
+        with self._lock:
+            tool, routed_text = self.predicted_tool, self.predicted_text
+            self.counts["utterances"] += 1
+        if tool is None or not final_text:
+            return None
+        if len(routed_text) < self.reuse_ratio * len(final_text):
+            return None
+        with self._lock:
+            self.counts["reused"] += 1
+        if self.audit_rate and random.random() < self.audit_rate:
+            threading.Thread(target=self._audit, args=(final_text, tool), daemon=True).start()
+        return tool
+
+    def record_final(self, final_tool: str):
+        """Record the route the final transcript got when the prediction was not reused."""
+        with self._lock:
+            if self.predicted_tool is None:
+                return
+            self.counts["checked"] += 1
+            if final_tool == self.predicted_tool:
+                self.counts["matched"] += 1
+
+    def _audit(self, final_text: str, predicted: str):
+        try:
+            actual = self.route(final_text)
+        except Exception:
+            return
+        with self._lock:
+            self.counts["checked"] += 1
+            if actual == predicted:
+                self.counts["matched"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = dict(self.counts)
+        counts["match_rate"] = round(counts["matched"] / counts["checked"], 3) if counts["checked"] else None
+        return counts
@@ -0,0 +1,208 @@
+"""
+Per-backend rate limiting for API clients.
+
+A BackendLimiter combines two token buckets (requests/minute and
+tokens/minute) with an AIMD concurrency window: the window grows by roughly
+one slot per round trip while calls succeed within the latency target and is
+halved on a 429 or a slow response. Callers queue in FIFO order until a slot
+and bucket capacity are available, or until their deadline passes.
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Iterator, Optional
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a request could not be admitted before its deadline."""
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """True for HTTP 429 errors raised by OpenAI-compatible clients."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Read the Retry-After header (seconds) from a rate limit error, if present."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `per_minute / 60` per second."""
+
+    def __init__(self, per_minute: float, capacity: float = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` tokens are available (0 if available now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class BackendLimiter:
+    """Admission control for a single backend (e.g. Perplexity)."""
+
+    def __init__(self,
+                 requests_per_minute: float = None,
+                 tokens_per_minute: float = None,
+                 max_concurrency: int = 8,
+                 min_concurrency: int = 1,
+                 target_latency: float = 5.0,
+                 max_retries: int = 3,
+                 default_timeout: float = 30.0):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency_limit = float(max_concurrency)
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.default_timeout = default_timeout
+
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self._waiters = deque()
+        self._cond = threading.Condition()
+        self.stats = {"admitted": 0, "rate_limited": 0, "timeouts": 0, "retries": 0}
+
+    # ----------------------------------------------------------- admission
+
+    def _admission_delay(self, estimated_tokens: float, now: float) -> float:
+        delay = max(0.0, self.blocked_until - now)
+        if self.in_flight >= int(self.concurrency_limit):
+            # Woken by release(); the poll interval only bounds deadline checks.
+            delay = max(delay, 0.05)
+        if self.request_bucket:
+            delay = max(delay, self.request_bucket.wait_time(1, now))
+        if self.token_bucket:
+            delay = max(delay, self.token_bucket.wait_time(estimated_tokens, now))
+        return delay
+
+    def acquire(self, estimated_tokens: float = 0, deadline: float = None):
+        """Block until the request may be sent; raise RateLimitTimeout past the deadline."""
+        deadline = deadline if deadline is not None else time.monotonic() + self.default_timeout
+        ticket = object()
+        with self._cond:
+            self._waiters.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    is_head = self._waiters[0] is ticket
+                    delay = self._admission_delay(estimated_tokens, now) if is_head else 0.05
+                    if is_head and delay == 0.0:
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self.stats["timeouts"] += 1
+                        raise RateLimitTimeout(
+                            f"request not admitted within deadline ({self.in_flight} in flight, "
+                            f"limit {int(self.concurrency_limit)})"
+                        )
+                    self._cond.wait(timeout=min(delay, remaining))
+            finally:
+                self._waiters.remove(ticket)
+                self._cond.notify_all()
+
+            if self.request_bucket:
+                self.request_bucket.take(1)
+            if self.token_bucket:
+                self.token_bucket.take(estimated_tokens)
+            self.in_flight += 1
+            self.stats["admitted"] += 1
+
+    def release(self, latency: float = None, rate_limited: bool = False,
+                retry_after: float = None, unused_tokens: float = 0):
+        """Return the slot and feed the outcome back into the AIMD window."""
+        with self._cond:
+            self.in_flight -= 1
+            if unused_tokens and self.token_bucket:
+                self.token_bucket.refund(unused_tokens)
+            if rate_limited:
+                self.stats["rate_limited"] += 1
+                self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit / 2)
+                pause = retry_after if retry_after is not None else 1.0
+                self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+            elif latency is not None and self.target_latency and latency > self.target_latency:
+                self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit / 2)
+            elif latency is not None:
+                self.concurrency_limit = min(self.max_concurrency,
+                                             self.concurrency_limit + 1.0 / self.concurrency_limit)
+            self._cond.notify_all()
+
+    # ------------------------------------------------------------- calling
+
+    def stream(self, create: Callable[[], Any], estimated_tokens: float = 0,
+               timeout: float = None, max_tokens: float = 0) -> Iterator[Any]:
+        """Run `create()` under the limiter and yield items from the returned stream.
+
+        Retries on 429 (honouring Retry-After) as long as nothing has been
+        yielded yet and the deadline allows. Latency fed to the AIMD window is
+        time to the first item. `estimated_tokens` (prompt plus `max_tokens`)
+        is charged up front; once the stream ends, the completion allowance it
+        did not use (`max_tokens` minus items emitted) is refunded. The prompt
+        share of the estimate is never refunded.
+        """
+        deadline = time.monotonic() + (timeout if timeout is not None else self.default_timeout)
+        attempt = 0
+        while True:
+            self.acquire(estimated_tokens, deadline)
+            started = time.monotonic()
+            latency = None
+            emitted = 0
+            try:
+                for item in create():
+                    if latency is None:
+                        latency = time.monotonic() - started
+                    emitted += 1
+                    yield item
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    self.release(latency)
+                    raise
+                retry_after = retry_after_seconds(e)
+                self.release(rate_limited=True, retry_after=retry_after, unused_tokens=estimated_tokens)
+                attempt += 1
+                if emitted or attempt > self.max_retries:
+                    raise
+                self.stats["retries"] += 1
+                continue
+            except GeneratorExit:
+                self.release(latency, unused_tokens=max(0, max_tokens - emitted))
+                raise
+            self.release(latency if latency is not None else time.monotonic() - started,
+                         unused_tokens=max(0, max_tokens - emitted))
+            return
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                **self.stats,
+                "in_flight": self.in_flight,
+                "queued": len(self._waiters),
+                "concurrency_limit": round(self.concurrency_limit, 2),
+                "blocked_for": round(max(0.0, self.blocked_until - time.monotonic()), 3),
+            }
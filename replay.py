@@ -0,0 +1,339 @@
+"""
+Record and replay upstream completions for offline, repeatable timing runs.
+
+RecordingClient wraps a real client and appends every completion to a JSONL
+fixture: the request key, the content deltas of a stream with the delay
+before each one (the first delay is time to first token), or the message of a
+non-streaming call. ReplayClient serves a fixture back through the same
+`chat.completions.create` interface with the original timing scaled by
+`speed` (2.0 = twice as fast, 0 = no delays), so tool_selection, the GUIs and
+TTS can run end to end without a model server.
+
+Requests are matched by the same key single-flight uses (model, normalized
+messages, options). A request with no exact match gets the next unused
+recording for its model unless `strict` is set, so small prompt changes
+degrade to in-order replay instead of failing.
+
+Environment: DEVDUCK_RECORD=<fixture> or DEVDUCK_REPLAY=<fixture>
+(+ DEVDUCK_REPLAY_SPEED) switch every ClientManager client.
+
+    python replay.py record queries.txt fixture.jsonl
+    python replay.py bench fixture.jsonl [--speed 0] [--save-baseline b.json | --baseline b.json]
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from singleflight import make_key
+
+
+def request_key(client_type: str, request: Dict[str, Any]) -> str:
+    return make_key("replay", client_type, request)
+
+
+class FixtureWriter:
+    """Appends records to a JSONL fixture; safe to share between clients and threads."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._file = open(path, "a", encoding="utf-8")
+
+    def next_seq(self) -> int:
+        with self._lock:
+            self._seq += 1
+            return self._seq
+
+    def write(self, record: Dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class _RecordedStream:
+    def __init__(self, response, record: Dict, writer: FixtureWriter, started: float):
+        self._response = response
+        self._iterator = iter(response)
+        self._record = record
+        self._writer = writer
+        self._last = started
+        self._written = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._iterator)
+        except StopIteration:
+            self._finish(truncated=False)
+            raise
+        now = time.monotonic()
+        content = chunk.choices[0].delta.content if chunk.choices else None
+        if content:
+            self._record["chunks"].append([round(now - self._last, 6), content])
+            self._last = now
+        if chunk.choices and chunk.choices[0].finish_reason:
+            self._record["finish_reason"] = chunk.choices[0].finish_reason
+        return chunk
+
+    def _finish(self, truncated: bool):
+        if not self._written:
+            self._written = True
+            self._record["truncated"] = truncated
+            self._writer.write(self._record)
+
+    def close(self):
+        self._finish(truncated=True)
+        if hasattr(self._response, "close"):
+            self._response.close()
+
+
+class RecordingClient:
+    """Passes requests through to `client` and records the completions."""
+
+    def __init__(self, client, client_type: str, writer: FixtureWriter):
+        self.client = client
+        self.client_type = client_type
+        self.writer = writer
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **request):
+        record = {
+            "type": "completion",
+            "seq": self.writer.next_seq(),
+            "client_type": self.client_type,
+            "model": request.get("model"),
+            "key": request_key(self.client_type, request),
+            "stream": bool(request.get("stream")),
+        }
+        started = time.monotonic()
+        response = self.client.chat.completions.create(**request)
+        if record["stream"]:
+            record["chunks"] = []
+            return _RecordedStream(response, record, self.writer, started)
+
+        choice = response.choices[0]
+        record["elapsed"] = round(time.monotonic() - started, 6)
+        record["content"] = choice.message.content
+        record["tool_calls"] = [
+            {"name": call.function.name, "arguments": call.function.arguments}
+            for call in (getattr(choice.message, "tool_calls", None) or [])
+        ]
+        record["finish_reason"] = getattr(choice, "finish_reason", None)
+        self.writer.write(record)
+        return response
+
+
+def _chunk(content: Optional[str], finish_reason: Optional[str] = None):
+    delta = SimpleNamespace(content=content, role=None, tool_calls=None)
+    return SimpleNamespace(choices=[SimpleNamespace(index=0, delta=delta, finish_reason=finish_reason)])
+
+
+class ReplayStream:
+    def __init__(self, record: Dict, scale: float):
+        self._chunks = record["chunks"]
+        self._finish_reason = record.get("finish_reason") or "stop"
+        self._scale = scale
+        self._index = 0
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed or self._index > len(self._chunks):
+            raise StopIteration
+        if self._index == len(self._chunks):
+            self._index += 1
+            return _chunk(None, self._finish_reason)
+        delay, content = self._chunks[self._index]
+        self._index += 1
+        if self._scale and delay > 0:
+            time.sleep(delay * self._scale)
+        return _chunk(content)
+
+    def close(self):
+        self._closed = True
+
+
+class ReplayClient:
+    """Serves recorded completions for one client type."""
+
+    def __init__(self, records: List[Dict], client_type: str, speed: float = 1.0, strict: bool = False):
+        self.client_type = client_type
+        self.scale = 1.0 / speed if speed else 0.0
+        self.strict = strict
+        self.stats = {"exact": 0, "fallback": 0, "missing": 0}
+        self._by_key: Dict[str, List[Dict]] = {}
+        self._by_model: Dict[Any, List[Dict]] = {}
+        self._used = set()
+        self._lock = threading.Lock()
+        for record in sorted(records, key=lambda r: r.get("seq", 0)):
+            if record.get("type") == "completion" and record["client_type"] == client_type:
+                self._by_key.setdefault(record["key"], []).append(record)
+                self._by_model.setdefault(record.get("model"), []).append(record)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _take(self, request: Dict) -> Dict:
+        with self._lock:
+            candidates = self._by_key.get(request_key(self.client_type, request), [])
+            for record in candidates:
+                if id(record) not in self._used:
+                    self._used.add(id(record))
+                    self.stats["exact"] += 1
+                    return record
+            if candidates:
+                # Identical request seen more often than recorded: repeat the last one
+                self.stats["exact"] += 1
+                return candidates[-1]
+            if not self.strict:
+                for record in self._by_model.get(request.get("model"), []):
+                    if id(record) not in self._used and record["stream"] == bool(request.get("stream")):
+                        self._used.add(id(record))
+                        self.stats["fallback"] += 1
+                        return record
+            self.stats["missing"] += 1
+        raise LookupError(f"No recorded {self.client_type} completion for model {request.get('model')}")
+
+    def create(self, **request):
+        record = self._take(request)
+        if request.get("stream"):
+            return ReplayStream(record, self.scale)
+        if self.scale and record.get("elapsed"):
+            time.sleep(record["elapsed"] * self.scale)
+        tool_calls = [
+            SimpleNamespace(type="function", function=SimpleNamespace(name=call["name"], arguments=call["arguments"]))
+            for call in record.get("tool_calls") or []
+        ] or None
+        message = SimpleNamespace(role="assistant", content=record.get("content"), tool_calls=tool_calls)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(index=0, message=message, finish_reason=record.get("finish_reason"))],
+            usage=None
+        )
+
+
+def load_fixture(path: str) -> List[Dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def record_clients(client_manager, path: str) -> FixtureWriter:
+    """Wrap every registered client so its completions are recorded to `path`."""
+    writer = FixtureWriter(path)
+    for client_type, client in list(client_manager.clients.items()):
+        client_manager.register_client(client_type, RecordingClient(client, client_type, writer))
+    return writer
+
+
+def replay_clients(client_manager, path: str, speed: float = 1.0, strict: bool = False) -> Dict[str, ReplayClient]:
+    """Replace every registered client with a ReplayClient serving `path`."""
+    records = load_fixture(path)
+    replayers = {}
+    for client_type in list(client_manager.clients):
+        replayers[client_type] = ReplayClient(records, client_type, speed=speed, strict=strict)
+        client_manager.register_client(client_type, replayers[client_type])
+    return replayers
+
+
+def _run_turns(handler, texts: List[str], session_id: str = "replay") -> List[Dict]:
+    results = []
+    for text in texts:
+        started = time.perf_counter()
+        first = None
+        chunks = 0
+        full = ""
+        tool, response = handler.tool_selection(text, session_id)
+        for chunk in response:
+            if chunk:
+                if first is None:
+                    first = time.perf_counter() - started
+                chunks += 1
+                full += chunk
+        total = time.perf_counter() - started
+        handler.update_conversation_history(tool, text, full, session_id)
+        results.append({"tool": tool, "ttft": first or total, "total": total, "chunks": chunks})
+    return results
+
+
+def _summary(results: List[Dict]) -> Dict[str, float]:
+    total = sum(r["total"] for r in results)
+    chunks = sum(r["chunks"] for r in results)
+    return {
+        "turns": len(results),
+        "mean_ttft": round(sum(r["ttft"] for r in results) / len(results), 4),
+        "total_seconds": round(total, 4),
+        "chunks_per_second": round(chunks / total, 1) if total else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+    record = commands.add_parser("record", help="run queries against live backends and record them")
+    record.add_argument("queries", help="text file, one query per line")
+    record.add_argument("fixture")
+    bench = commands.add_parser("bench", help="replay a fixture and time every turn")
+    bench.add_argument("fixture")
+    bench.add_argument("--speed", type=float, default=1.0, help="timing multiplier; 0 replays without delays")
+    bench.add_argument("--strict", action="store_true", help="fail on requests without an exact recording")
+    bench.add_argument("--baseline", help="fail if slower than this baseline by more than --tolerance")
+    bench.add_argument("--save-baseline", help="write this run's summary as a baseline")
+    bench.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    from main import ToolHandler
+
+    handler = ToolHandler()
+    # Fixtures hold LLM routing calls; replayed decisions are not new training data
+    handler.router.distilled = None
+    if args.command == "bench":
+        handler.router.log = None
+    if args.command == "record":
+        with open(args.queries, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+        writer = record_clients(handler.client_manager, args.fixture)
+        for text in texts:
+            writer.write({"type": "turn", "text": text})
+        _run_turns(handler, texts)
+        writer.close()
+        print(f"Recorded {len(texts)} turns to {args.fixture}")
+        return
+
+    texts = [r["text"] for r in load_fixture(args.fixture) if r.get("type") == "turn"]
+    if not texts:
+        parser.exit(1, f"{args.fixture}: no records (no recorded turns to replay)\n")
+    replayers = replay_clients(handler.client_manager, args.fixture, speed=args.speed, strict=args.strict)
+    summary = _summary(_run_turns(handler, texts))
+    summary["speed"] = args.speed
+    print(json.dumps(summary, indent=2))
+    print("Matches:", {client_type: r.stats for client_type, r in replayers.items()})
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("speed") != args.speed:
+            print(f"Warning: baseline was recorded at speed {baseline.get('speed')}, this run used {args.speed}")
+        limit = baseline["total_seconds"] * (1 + args.tolerance)
+        if summary["total_seconds"] > limit:
+            print(f"REGRESSION: {summary['total_seconds']}s > {limit:.4f}s "
+                  f"(baseline {baseline['total_seconds']}s + {args.tolerance:.0%})")
+            sys.exit(1)
+        print(f"OK: within {args.tolerance:.0%} of baseline {baseline['total_seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
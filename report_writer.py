@@ -0,0 +1,167 @@
+"""
+Streaming conversation transcripts.
+
+Promoted from the ConversationReport prototype in test.ipynb. Instead of
+keeping every exchange in memory and writing the file in `save_transcript`,
+each exchange is appended as soon as it completes. Writes are buffered and
+flushed + fsynced at most `fsync_interval` seconds after they are appended
+(a timer covers sessions that go idle) and on close, so a crash loses at
+most that window. Files rotate to `<name>_part<N>` once they reach
+`max_bytes`.
+
+Formats: "text" (the original human-readable layout) or "jsonl" (one JSON
+object per line, header first).
+"""
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+REPORT_FORMATS = {"text": "txt", "jsonl": "jsonl"}
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+class ConversationReport:
+    def __init__(self, original_idea: str = "", project_name: str = "devduck",
+                 directory: str = "reports", fmt: str = "text",
+                 max_bytes: int = 5 * 1024 * 1024, fsync_interval: float = 5.0,
+                 buffer_size: int = 64 * 1024):
+        if fmt not in REPORT_FORMATS:
+            raise ValueError(f"Unknown report format '{fmt}', expected one of {tuple(REPORT_FORMATS)}")
+        self.timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.original_idea = original_idea
+        self.project_name = _UNSAFE.sub("_", project_name) or "devduck"
+        self.directory = directory
+        self.fmt = fmt
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        self.buffer_size = buffer_size
+        self.exchange_count = 0
+        self.part = 0
+        self._file = None
+        self._bytes = 0
+        self._last_sync = time.monotonic()
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._open_part()
+
+    @property
+    def filename(self) -> str:
+        suffix = f"_part{self.part}" if self.part else ""
+        extension = REPORT_FORMATS[self.fmt]
+        return os.path.join(self.directory, f"{self.project_name}_transcript_{self.timestamp}{suffix}.{extension}")
+
+    def _open_part(self):
+        self._file = open(self.filename, "a", encoding="utf-8", buffering=self.buffer_size)
+        self._bytes = os.path.getsize(self.filename)
+        if self.fmt == "text":
+            self._write(f"Project: {self.project_name}\n")
+            self._write(f"Original Idea: {self.original_idea}\n")
+            self._write(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+            if self.part:
+                self._write(f"Continued from part {self.part - 1}\n")
+            self._write("\nTranscript:\n\n")
+        else:
+            self._write_json({
+                "type": "header",
+                "project": self.project_name,
+                "original_idea": self.original_idea,
+                "generated_on": datetime.now().isoformat(timespec="seconds"),
+                "part": self.part,
+            })
+
+    def _write(self, text: str):
+        # Count bytes ourselves: tell() on a text file would flush the buffer
+        self._file.write(text)
+        self._bytes += len(text.encode("utf-8"))
+
+    def _write_json(self, record: Dict):
+        self._write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_sync = time.monotonic()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _schedule_sync(self):
+        """Sync unsynced writes once the interval is up, even if nothing else is appended."""
+        if self._timer is not None:
+            return
+        delay = max(0.0, self.fsync_interval - (time.monotonic() - self._last_sync))
+        self._timer = threading.Timer(delay, self._timed_sync)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _timed_sync(self):
+        with self._lock:
+            self._timer = None
+            if self._file is not None:
+                self._sync()
+
+    def add_exchange(self, assistant_msg: str, user_msg: str, tool: Optional[str] = None):
+        """Append an assistant prompt and the user's reply (the notebook's order)."""
+        self._append(("Assistant", assistant_msg), ("User", user_msg), tool)
+
+    def add_turn(self, user_msg: str, assistant_msg: str, tool: Optional[str] = None):
+        """Append a user message and the assistant's reply (the engine's order)."""
+        self._append(("User", user_msg), ("Assistant", assistant_msg), tool)
+
+    def _append(self, first, second, tool):
+        with self._lock:
+            if self._file is None:
+                raise ValueError("report is closed")
+            if self.fmt == "text":
+                self._write(f"{first[0]}: {first[1]}\n{second[0]}: {second[1]}\n\n")
+            else:
+                self._write_json({
+                    "type": "exchange",
+                    "index": self.exchange_count,
+                    "time": datetime.now().isoformat(timespec="seconds"),
+                    "tool": tool,
+                    first[0].lower(): first[1],
+                    second[0].lower(): second[1],
+                })
+            self.exchange_count += 1
+
+            if time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+            else:
+                self._schedule_sync()
+            if self._bytes >= self.max_bytes:
+                self._sync()
+                self._file.close()
+                self.part += 1
+                self._open_part()
+
+    def save_transcript(self, project_name: str = None) -> str:
+        """Make everything written so far durable and return the current file name.
+
+        Kept for the notebook API; `project_name` is fixed at construction now.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+            return self.filename
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._sync()
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,307 @@
+"""
+LLM tool router with constrained output.
+
+Modes:
+    free         the original prompt + `tools` request; the reply is free text
+    json_schema  response_format restricts the reply to {"tool": <registered name>}
+    codes        tools are listed as short numeric codes and the reply is capped
+                 at two tokens, so routing costs one or two output tokens
+
+Every reply goes through `parse_route`, which only ever returns a registered
+tool name (or None), and `Router.route` falls back to the previous or default
+tool when nothing valid comes back. `Router.route_many` asks for up to N
+tools at once for fan-out turns.
+
+When a distilled classifier is attached (see distill.py) it answers first and
+the LLM is only asked when its confidence is below `distilled_threshold`.
+When a RoutingLog is attached, valid LLM decisions for real turns are
+appended to it as training data for the next distilled model; speculative
+calls (pre-routes, audits) pass `log=False`.
+"""
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+ROUTER_MODES = ("free", "json_schema", "codes")
+
+CODES_PROMPT = (
+    "Choose the tool that should handle the user's message.\n"
+    "{catalogue}\n"
+    "Previously used tool: {previous_tool}. It might be a follow up question.\n"
+    "Message: {text}\n"
+    "Answer with the tool number only."
+)
+
+CODES_MULTI_SUFFIX = (
+    " If the message needs more than one tool, answer with up to {max_tools} numbers "
+    "separated by commas, most important first."
+)
+
+_CODE = re.compile(r"\d+")
+_SEPARATORS = re.compile(r"[\s\-]+")
+
+
+def _normalize(value: str) -> str:
+    return _SEPARATORS.sub("_", value.strip().strip("\"'`.").lower())
+
+
+def parse_routes(content: Optional[str], names: List[str], codes: Dict[str, str] = None,
+                 tool_calls=None, max_tools: int = 2) -> List[str]:
+    """Extract up to `max_tools` distinct registered tool names, in reply order."""
+    found: List[str] = []
+    for call in tool_calls or []:
+        if call.function.name in names and call.function.name not in found:
+            found.append(call.function.name)
+    if content:
+        if codes:
+            for code in _CODE.findall(content):
+                if code in codes and codes[code] not in found:
+                    found.append(codes[code])
+        text = content.strip()
+        if text.startswith("{"):
+            try:
+                candidates = json.loads(text).get("tools", [])
+            except (ValueError, AttributeError):
+                candidates = []
+            found.extend(c for c in candidates if c in names and c not in found)
+        normalized = _normalize(text)
+        positions = []
+        for name in names:
+            index = normalized.find(_normalize(name))
+            if index >= 0 and name not in found:
+                positions.append((index, name))
+        found.extend(name for _, name in sorted(positions))
+    return found[:max_tools]
+
+
+def parse_route(content: Optional[str], names: List[str], codes: Dict[str, str] = None,
+                tool_calls=None) -> Optional[str]:
+    """Extract a registered tool name from a router reply, or None."""
+    if tool_calls:
+        name = tool_calls[0].function.name
+        if name in names:
+            return name
+    if not content:
+        return None
+
+    if codes:
+        match = _CODE.search(content)
+        if match and match.group(0) in codes:
+            return codes[match.group(0)]
+
+    text = content.strip()
+    if text.startswith("{"):
+        try:
+            candidate = json.loads(text).get("tool", "")
+        except (ValueError, AttributeError):
+            candidate = ""
+        if candidate in names:
+            return candidate
+
+    normalized = _normalize(text)
+    by_normalized = {_normalize(name): name for name in names}
+    if normalized in by_normalized:
+        return by_normalized[normalized]
+    # Longest first so "search" never shadows "internet_search"
+    for key in sorted(by_normalized, key=len, reverse=True):
+        if key in normalized:
+            return by_normalized[key]
+    return None
+
+
+class RoutingLog:
+    """Append-only JSONL of LLM routing decisions: text, previous tool, chosen tool."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def append(self, text: str, previous_tool: Optional[str], tool: str, mode: str):
+        record = {"t": int(time.time()), "text": text, "prev": previous_tool, "tool": tool, "mode": mode}
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+class _CompiledRoutes:
+    """Mode-specific prompt pieces for one registry snapshot version."""
+
+    def __init__(self, snapshot):
+        self.version = snapshot.version
+        self.names = [tool["function"]["name"] for tool in snapshot.openai_tools]
+        self.codes = {str(i): name for i, name in enumerate(self.names, start=1)}
+        catalogue = "\n".join(
+            f"{code}. {name}: {tool['function']['description']}"
+            for (code, name), tool in zip(self.codes.items(), snapshot.openai_tools)
+        )
+        head, rest = CODES_PROMPT.split("{previous_tool}")
+        middle, tail = rest.split("{text}")
+        self.codes_prompt_parts = (head.replace("{catalogue}", catalogue), middle, tail)
+        self.response_format = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "route",
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {"tool": {"type": "string", "enum": self.names}},
+                    "required": ["tool"],
+                    "additionalProperties": False,
+                },
+            },
+        }
+
+    def codes_prompt(self, text: str, previous_tool: Optional[str], max_tools: int = 1) -> str:
+        head, middle, tail = self.codes_prompt_parts
+        prompt = head + str(previous_tool) + middle + text + tail
+        if max_tools > 1:
+            prompt += CODES_MULTI_SUFFIX.format(max_tools=max_tools)
+        return prompt
+
+    def multi_response_format(self, max_tools: int) -> Dict:
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "routes",
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "tools": {
+                            "type": "array",
+                            "items": {"type": "string", "enum": self.names},
+                            "minItems": 1,
+                            "maxItems": max_tools,
+                        }
+                    },
+                    "required": ["tools"],
+                    "additionalProperties": False,
+                },
+            },
+        }
+
+
+class Router:
+    def __init__(self, registry, client_manager, model: str = "llama-3.2-3b-instruct",
+                 mode: str = "codes", default_tool: str = "ideation", client_type: str = "local",
+                 log: RoutingLog = None, distilled=None, distilled_threshold: float = 0.8, ledger=None):
+        if mode not in ROUTER_MODES:
+            raise ValueError(f"Unknown router mode '{mode}', expected one of {ROUTER_MODES}")
+        self.registry = registry
+        self.client_manager = client_manager
+        self.model = model
+        self.mode = mode
+        self.default_tool = default_tool
+        self.client_type = client_type
+        self._compiled: Optional[_CompiledRoutes] = None
+        self.log = log
+        self.distilled = distilled
+        self.distilled_threshold = distilled_threshold
+        # Optional token_ledger.TokenLedger; router calls are booked as tool "router"
+        self.ledger = ledger
+        self.stats = {"routes": 0, "fallbacks": 0, "distilled": 0, "llm": 0}
+
+    def _routes(self) -> _CompiledRoutes:
+        snapshot = self.registry.snapshot
+        compiled = self._compiled
+        if compiled is None or compiled.version != snapshot.version:
+            compiled = self._compiled = _CompiledRoutes(snapshot)
+        return compiled
+
+    def _request(self, text: str, previous_tool: Optional[str], max_tools: int = 1) -> Dict:
+        snapshot = self.registry.snapshot
+        if self.mode == "free":
+            prompt = snapshot.router_prompt(text, previous_tool)
+            if max_tools > 1:
+                prompt += f" If more than one tool is needed, return up to {max_tools} tool names separated by commas."
+            return {
+                "messages": [{"role": "user", "content": prompt}],
+                "tools": snapshot.openai_tools,
+                "tool_choice": "auto",
+            }
+        routes = self._routes()
+        if self.mode == "json_schema":
+            return {
+                "messages": [{"role": "user", "content": snapshot.router_prompt(text, previous_tool)}],
+                "response_format": routes.response_format if max_tools == 1 else routes.multi_response_format(max_tools),
+                "max_tokens": 16 * max_tools,
+                "temperature": 0,
+            }
+        return {
+            "messages": [{"role": "user", "content": routes.codes_prompt(text, previous_tool, max_tools)}],
+            "max_tokens": 2 * max_tools,
+            "temperature": 0,
+        }
+
+    def _complete(self, request: Dict, session_id=None):
+        client = self.client_manager.get_client(self.client_type)
+        response = client.chat.completions.create(model=self.model, **request)
+        message = response.choices[0].message
+        if self.ledger is not None:
+            self.ledger.record_prompt(session_id, "router", request["messages"])
+            calls = getattr(message, "tool_calls", None) or ()
+            reply = message.content or "".join(call.function.name for call in calls)
+            self.ledger.record_completion(session_id, "router", reply)
+        return message
+
+    def route(self, text: str, previous_tool: Optional[str] = None, session_id=None, log: bool = True) -> str:
+        """Return a registered tool name for `text`; never an unvalidated model reply."""
+        routes = self._routes()
+        if self.distilled is not None:
+            tool, confidence = self.distilled.predict(text, previous_tool)
+            if confidence >= self.distilled_threshold and tool in routes.names:
+                self.stats["routes"] += 1
+                self.stats["distilled"] += 1
+                return tool
+        return self.route_llm(text, previous_tool, session_id, log)
+
+    def route_llm(self, text: str, previous_tool: Optional[str] = None, session_id=None, log: bool = True) -> str:
+        """Route with the LLM only (logging the decision for distillation unless `log` is False)."""
+        message = self._complete(self._request(text, previous_tool), session_id)
+        routes = self._routes()
+        selected = parse_route(
+            message.content,
+            routes.names,
+            codes=routes.codes if self.mode == "codes" else None,
+            tool_calls=getattr(message, "tool_calls", None),
+        )
+        self.stats["routes"] += 1
+        self.stats["llm"] += 1
+        if selected is None:
+            self.stats["fallbacks"] += 1
+            return previous_tool if previous_tool in routes.names else self.default_tool
+        if log and self.log is not None:
+            self.log.append(text, previous_tool, selected, self.mode)
+        return selected
+
+    def route_many(self, text: str, previous_tool: Optional[str] = None, max_tools: int = 2,
+                   session_id=None) -> List[str]:
+        """Return one to `max_tools` registered tool names for a fan-out, most relevant first."""
+        message = self._complete(self._request(text, previous_tool, max_tools), session_id)
+        routes = self._routes()
+        selected = parse_routes(
+            message.content,
+            routes.names,
+            codes=routes.codes if self.mode == "codes" else None,
+            tool_calls=getattr(message, "tool_calls", None),
+            max_tools=max_tools,
+        )
+        self.stats["routes"] += 1
+        if not selected:
+            self.stats["fallbacks"] += 1
+            selected = [previous_tool if previous_tool in routes.names else self.default_tool]
+        return selected
+
+    def warm(self):
+        """Evaluate the router prompt once so its prefix is cached before the first query."""
+        client = self.client_manager.get_client(self.client_type)
+        request = self._request("hi", None)
+        request["max_tokens"] = 1
+        client.chat.completions.create(model=self.model, **request)
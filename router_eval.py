@@ -0,0 +1,205 @@
+"""
+Routing strategy evaluation: accuracy versus latency.
+
+Runs each routing strategy over a labeled JSONL file in the same shape as
+requests.jsonl plus the expected tool, e.g.
+
+    {"request_id": "q-001", "title": "Outage news", "body": "Any news on the us-east-1 outage?", "tool": "internet_search"}
+
+(the query is `body`, or `text` when present; an optional `previous_tool`
+is passed to the router) and prints one table: accuracy, mean and p99
+latency, router tokens per query as reported by the server's `usage`, and the
+most frequent confusions. The most common routing errors are printed to
+stderr; full confusion matrices and error messages go to --json.
+
+    llm-codes, llm-json_schema, llm-free   Router.route_llm in each output mode (main.py)
+    tool-calls                             bare tool_choice="auto" request, as devduck.py routes
+    distilled                              newest distill.py artifact, in-process
+    distilled+llm                          distilled first, LLM (codes) below the confidence threshold
+
+The strategy marked * is the fastest (mean latency) that meets --min-accuracy.
+
+    python router_eval.py labeled.jsonl [--strategies llm-codes,distilled] [--min-accuracy 0.9] [--json out.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Optional
+
+from distill import load_latest
+from main import ToolHandler
+from measure import percentile
+from router import Router
+
+Route = Callable[[str, Optional[str]], str]
+
+
+class UsageMeter:
+    """Client wrapper that adds up the `usage` of every chat completion."""
+
+    def __init__(self, client):
+        self.client = client
+        self.tokens = 0
+        self.reported = 0
+        self.chat = self
+        self.completions = self
+
+    def create(self, **kwargs):
+        response = self.client.chat.completions.create(**kwargs)
+        usage = getattr(response, "usage", None)
+        if usage is not None and getattr(usage, "total_tokens", None) is not None:
+            self.tokens += usage.total_tokens
+            self.reported += 1
+        return response
+
+
+def _llm(mode: str) -> Callable[[ToolHandler], Route]:
+    def build(handler: ToolHandler) -> Route:
+        router = Router(handler.registry, handler.client_manager, model=handler.router.model, mode=mode,
+                        default_tool=handler.router.default_tool, client_type=handler.router.client_type)
+        return router.route_llm
+    return build
+
+
+def _tool_calls(handler: ToolHandler) -> Route:
+    client = handler.client_manager.get_client(handler.router.client_type)
+
+    def route(text: str, previous_tool: Optional[str]) -> str:
+        response = client.chat.completions.create(
+            model=handler.router.model,
+            messages=[{"role": "user", "content": text}],
+            tools=handler.registry.snapshot.openai_tools,
+            tool_choice="auto",
+        )
+        tool_calls = response.choices[0].message.tool_calls
+        return tool_calls[0].function.name if tool_calls else "ideation"
+    return route
+
+
+def _distilled(with_llm: bool) -> Callable[[ToolHandler], Optional[Route]]:
+    def build(handler: ToolHandler) -> Optional[Route]:
+        model = load_latest(os.getenv("DEVDUCK_ROUTER_MODEL", "router_models"))
+        if model is None:
+            return None
+        if not with_llm:
+            return lambda text, previous_tool: model.predict(text, previous_tool)[0]
+        router = Router(handler.registry, handler.client_manager, model=handler.router.model, mode="codes",
+                        default_tool=handler.router.default_tool, client_type=handler.router.client_type,
+                        distilled=model, distilled_threshold=handler.router.distilled_threshold)
+        return router.route
+    return build
+
+
+# name -> factory(handler) returning route(text, previous_tool), or None if unavailable
+STRATEGIES: Dict[str, Callable[[ToolHandler], Optional[Route]]] = {
+    "llm-codes": _llm("codes"),
+    "llm-json_schema": _llm("json_schema"),
+    "llm-free": _llm("free"),
+    "tool-calls": _tool_calls,
+    "distilled": _distilled(with_llm=False),
+    "distilled+llm": _distilled(with_llm=True),
+}
+
+
+def load_labeled(path: str) -> List[Dict]:
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            text = record.get("text") or record.get("body") or record.get("title")
+            if not text or not record.get("tool"):
+                raise ValueError(f"{path}: every line needs a query (text/body/title) and a 'tool' label")
+            records.append({"id": record.get("request_id"), "text": text, "tool": record["tool"],
+                            "previous_tool": record.get("previous_tool")})
+    return records
+
+
+def evaluate(route: Route, meter: UsageMeter, records: List[Dict]) -> Dict:
+    latencies, confusion, errors = [], defaultdict(Counter), Counter()
+    hits = 0
+    tokens_before, reported_before = meter.tokens, meter.reported
+    for record in records:
+        start = time.perf_counter()
+        try:
+            predicted = route(record["text"], record["previous_tool"])
+        except Exception as e:
+            predicted = "<error>"
+            errors[f"{type(e).__name__}: {e}"] += 1
+        latencies.append(time.perf_counter() - start)
+        confusion[record["tool"]][predicted] += 1
+        hits += predicted == record["tool"]
+    reported = meter.reported - reported_before
+    return {
+        "accuracy": hits / len(records),
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "tokens_per_query": (meter.tokens - tokens_before) / len(records) if reported else None,
+        "errors": sum(errors.values()),
+        "error_messages": dict(errors.most_common()),
+        "confusion": {label: dict(predicted) for label, predicted in confusion.items()},
+    }
+
+
+def top_confusions(confusion: Dict[str, Dict[str, int]], limit: int = 3) -> str:
+    mistakes = Counter({(label, predicted): count
+                        for label, row in confusion.items() for predicted, count in row.items() if predicted != label})
+    return ", ".join(f"{label}->{predicted}:{count}" for (label, predicted), count in mistakes.most_common(limit)) or "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("labeled", help="JSONL of queries with a 'tool' label")
+    parser.add_argument("--strategies", default=",".join(STRATEGIES), help="comma-separated subset to run")
+    parser.add_argument("--min-accuracy", type=float, default=0.9)
+    parser.add_argument("--json", help="write all results, including confusion matrices, to this file")
+    args = parser.parse_args()
+
+    records = load_labeled(args.labeled)
+    if not records:
+        parser.exit(1, f"{args.labeled}: no records (no labeled queries to evaluate)\n")
+    names = [name.strip() for name in args.strategies.split(",") if name.strip()]
+    unknown = [name for name in names if name not in STRATEGIES]
+    if unknown:
+        parser.error(f"unknown strategies {unknown}, expected some of {list(STRATEGIES)}")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        handler = ToolHandler(sticky="never")
+    # Evaluation queries are not training data for the distilled router
+    handler.router.log = None
+    meter = UsageMeter(handler.client_manager.get_client(handler.router.client_type))
+    handler.client_manager.register_client(handler.router.client_type, meter)
+
+    results = {}
+    for name in names:
+        route = STRATEGIES[name](handler)
+        if route is None:
+            print(f"Skipping {name}: not available (no distilled router artifact?)", file=sys.stderr)
+            continue
+        results[name] = evaluate(route, meter, records)
+        for message, count in list(results[name]["error_messages"].items())[:3]:
+            print(f"{name}: {count} x {message}", file=sys.stderr)
+
+    passing = [name for name, result in results.items() if result["accuracy"] >= args.min_accuracy]
+    best = min(passing, key=lambda name: results[name]["mean_ms"]) if passing else None
+    print(f"{len(records)} labeled queries, accuracy bar {args.min_accuracy:.0%}")
+    print(f"  {'strategy':<16} {'accuracy':>8} {'mean ms':>9} {'p99 ms':>9} {'tokens/q':>9} {'errors':>6}  top confusions")
+    for name, result in results.items():
+        tokens = "-" if result["tokens_per_query"] is None else f"{result['tokens_per_query']:.1f}"
+        print(f"{'*' if name == best else ' '} {name:<16} {result['accuracy']:>8.1%} {result['mean_ms']:>9.2f} "
+              f"{result['p99_ms']:>9.2f} {tokens:>9} {result['errors']:>6}  {top_confusions(result['confusion'])}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"queries": len(records), "min_accuracy": args.min_accuracy, "best": best,
+                       "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
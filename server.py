@@ -0,0 +1,370 @@
+"""
+Async HTTP/SSE front-end for the ToolHandler engine.
+
+One warm ToolHandler (clients, caches, models) is shared by every connection.
+Endpoints:
+    POST   /sessions/<session_id>/messages   body {"text": "..."} -> text/event-stream
+    DELETE /sessions/<session_id>            cancel the session's running and queued turns
+    GET    /sessions/<session_id>/tokens     token ledger rows for one session
+    GET    /tokens                           token ledger rows for every session
+    GET    /health
+    GET    /metrics
+
+Sessions with no turn running or queued for `idle_timeout` seconds are
+dropped the same way.
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+from urllib.parse import unquote
+
+from cancellation import CancellationToken
+from main import ToolHandler
+
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    503: "Service Unavailable",
+}
+
+MAX_BODY_BYTES = 64 * 1024
+
+
+@dataclass
+class Turn:
+    """A single user message waiting in (or running from) a session queue."""
+    text: str
+    events: asyncio.Queue = field(default_factory=asyncio.Queue)
+    cancel_token: CancellationToken = field(default_factory=CancellationToken)
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_token.cancelled
+
+
+class Session:
+    """Per-session FIFO so turns of one conversation never run concurrently."""
+
+    def __init__(self, session_id: str, server: "ChatServer"):
+        self.session_id = session_id
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.current: Optional[Turn] = None
+        self.last_active = time.monotonic()
+        self.worker = asyncio.create_task(server._session_worker(self))
+
+    def idle_for(self, now: float) -> float:
+        if self.current is not None or not self.queue.empty():
+            return 0.0
+        return now - self.last_active
+
+
+class ChatServer:
+    def __init__(self, handler: ToolHandler = None, max_workers: int = 8, max_queue: int = 16,
+                 idle_timeout: float = 1800.0):
+        self.handler = handler or ToolHandler()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="devduck-turn")
+        self.max_queue = max_queue
+        self.idle_timeout = idle_timeout
+        self.sessions: Dict[str, Session] = {}
+        self.started_at = time.time()
+        self.metrics = {
+            "requests_total": 0,
+            "turns_completed": 0,
+            "turns_cancelled": 0,
+            "turns_failed": 0,
+            "sessions_evicted": 0,
+            "tokens_streamed": 0,
+            "active_streams": 0,
+            "ttft_seconds_sum": 0.0,
+            "ttft_count": 0,
+        }
+        # Updated from worker threads and the event loop alike
+        self._metrics_lock = threading.Lock()
+
+    def _count(self, **deltas):
+        with self._metrics_lock:
+            for name, delta in deltas.items():
+                self.metrics[name] += delta
+
+    # ------------------------------------------------------------------ engine
+
+    def _run_turn(self, session_id: str, turn: Turn, loop: asyncio.AbstractEventLoop):
+        """Run one turn on a worker thread, pushing events back onto the loop."""
+        def emit(kind, data):
+            loop.call_soon_threadsafe(turn.events.put_nowait, (kind, data))
+
+        tool, response = self.handler.tool_selection(turn.text, session_id, turn.cancel_token)
+        emit("tool", tool)
+        full_response = ""
+        first_token = True
+        try:
+            for chunk in response:
+                if turn.cancelled:
+                    break
+                if chunk is None:
+                    continue
+                if first_token:
+                    self._count(ttft_seconds_sum=time.monotonic() - turn.enqueued_at, ttft_count=1)
+                    first_token = False
+                full_response += chunk
+                self._count(tokens_streamed=1)
+                emit("token", chunk)
+        finally:
+            if hasattr(response, "close"):
+                response.close()
+
+        if turn.cancelled:
+            return tool, None
+        self.handler.update_conversation_history(tool, turn.text, full_response, session_id)
+        return tool, full_response
+
+    async def _session_worker(self, session: Session):
+        loop = asyncio.get_running_loop()
+        while True:
+            turn = await session.queue.get()
+            session.current = turn
+            try:
+                if turn.cancelled:
+                    self._count(turns_cancelled=1)
+                    continue
+                tool, full_response = await loop.run_in_executor(
+                    self.executor, self._run_turn, session.session_id, turn, loop
+                )
+                if full_response is None:
+                    self._count(turns_cancelled=1)
+                else:
+                    self._count(turns_completed=1)
+                turn.events.put_nowait(("done", tool))
+            except Exception as e:
+                self._count(turns_failed=1)
+                turn.events.put_nowait(("error", str(e)))
+            finally:
+                session.current = None
+                session.last_active = time.monotonic()
+                session.queue.task_done()
+
+    def get_session(self, session_id: str) -> Session:
+        if session_id not in self.sessions:
+            self.sessions[session_id] = Session(session_id, self)
+        return self.sessions[session_id]
+
+    def drop_session(self, session_id: str, reason: str = "session deleted") -> bool:
+        """Cancel the running and queued turns (their streams end with an error event) and stop the worker."""
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        turns = [session.current] if session.current is not None else []
+        while not session.queue.empty():
+            turns.append(session.queue.get_nowait())
+        for turn in turns:
+            turn.cancel_token.cancel()
+            turn.events.put_nowait(("error", reason))
+            self._count(turns_cancelled=1)
+        session.worker.cancel()
+        self.handler.close_report(session_id)
+        return True
+
+    async def _evict_idle_sessions(self):
+        while True:
+            await asyncio.sleep(min(60.0, self.idle_timeout / 2))
+            now = time.monotonic()
+            for session_id, session in list(self.sessions.items()):
+                if session.idle_for(now) >= self.idle_timeout:
+                    self.drop_session(session_id, reason="session expired")
+                    self._count(sessions_evicted=1)
+
+    # -------------------------------------------------------------------- http
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await self._read_request(reader)
+            if request is None:
+                return
+            method, path, body = request
+            self._count(requests_total=1)
+            await self._dispatch(method, path, body, reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, bytes]]:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        parts = request_line.decode("latin-1").split()
+        if len(parts) < 2:
+            return None
+        method, path = parts[0].upper(), unquote(parts[1].split("?", 1)[0])
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length", 0) or 0)
+        if length > MAX_BODY_BYTES:
+            raise ConnectionError("request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method, path, body
+
+    async def _dispatch(self, method, path, body, reader, writer):
+        segments = [s for s in path.split("/") if s]
+
+        if segments == ["health"]:
+            if method != "GET":
+                return await self._send_json(writer, 405, {"error": "method not allowed"})
+            return await self._send_json(writer, 200, {
+                "status": "ok",
+                "uptime_seconds": round(time.time() - self.started_at, 3),
+                "tools": list(self.handler.registry.tools),
+            })
+
+        if segments == ["metrics"]:
+            if method != "GET":
+                return await self._send_json(writer, 405, {"error": "method not allowed"})
+            return await self._send_json(writer, 200, self.snapshot_metrics())
+
+        if segments == ["tokens"] or (len(segments) == 3 and segments[0] == "sessions" and segments[2] == "tokens"):
+            if method != "GET":
+                return await self._send_json(writer, 405, {"error": "method not allowed"})
+            session_id = segments[1] if len(segments) == 3 else None
+            return await self._send_json(writer, 200, {
+                "tokenizer": self.handler.token_counter.name,
+                "rows": self.handler.token_ledger.rows(session_id),
+            })
+
+        if len(segments) == 3 and segments[0] == "sessions" and segments[2] == "messages":
+            if method != "POST":
+                return await self._send_json(writer, 405, {"error": "method not allowed"})
+            try:
+                text = json.loads(body or b"{}").get("text", "").strip()
+            except (ValueError, AttributeError):
+                text = ""
+            if not text:
+                return await self._send_json(writer, 400, {"error": "'text' is required"})
+            return await self._stream_turn(segments[1], text, reader, writer)
+
+        if len(segments) == 2 and segments[0] == "sessions":
+            if method != "DELETE":
+                return await self._send_json(writer, 405, {"error": "method not allowed"})
+            if not self.drop_session(segments[1]):
+                return await self._send_json(writer, 404, {"error": "unknown session"})
+            return await self._send_json(writer, 200, {"deleted": segments[1]})
+
+        return await self._send_json(writer, 404, {"error": "not found"})
+
+    async def _stream_turn(self, session_id, text, reader, writer):
+        session = self.get_session(session_id)
+        if session.queue.qsize() >= self.max_queue:
+            return await self._send_json(writer, 503, {"error": "session queue full"})
+
+        turn = Turn(text=text)
+        session.last_active = time.monotonic()
+        await session.queue.put(turn)
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        await writer.drain()
+
+        # The client never sends anything after the request, so EOF on the
+        # reader means it has disconnected.
+        disconnect = asyncio.create_task(reader.read(1))
+        self._count(active_streams=1)
+        try:
+            while True:
+                next_event = asyncio.create_task(turn.events.get())
+                done, _ = await asyncio.wait({next_event, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+                if next_event not in done:
+                    next_event.cancel()
+                    turn.cancel_token.cancel()
+                    return
+                kind, data = next_event.result()
+                writer.write(f"event: {kind}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+                await writer.drain()
+                if kind in ("done", "error"):
+                    return
+        except (ConnectionError, OSError):
+            turn.cancel_token.cancel()
+        finally:
+            self._count(active_streams=-1)
+            disconnect.cancel()
+
+    async def _send_json(self, writer, status: int, payload: Dict):
+        body = json.dumps(payload).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+
+    def snapshot_metrics(self) -> Dict:
+        with self._metrics_lock:
+            metrics = dict(self.metrics)
+        count = metrics.pop("ttft_count")
+        metrics["ttft_seconds_avg"] = round(metrics.pop("ttft_seconds_sum") / count, 4) if count else None
+        metrics["sessions"] = len(self.sessions)
+        metrics["queued_turns"] = sum(s.queue.qsize() for s in self.sessions.values())
+        metrics.update(self.handler.client_manager.cancellation_stats.snapshot())
+        metrics["throughput"] = self.handler.client_manager.throughput.snapshot()
+        metrics["routing"] = dict(self.handler.routing_stats)
+        metrics["router"] = dict(self.handler.router.stats)
+        metrics["tokens"] = self.handler.token_ledger.totals()
+        metrics["compaction"] = dict(self.handler.compaction_stats, prompt_savings=self.handler.registry.prompt_savings)
+        return metrics
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"DevDuck server listening on http://{host}:{port}")
+        evictor = asyncio.create_task(self._evict_idle_sessions()) if self.idle_timeout else None
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if evictor is not None:
+                evictor.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the DevDuck ToolHandler over HTTP/SSE.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=8, help="Max concurrent turns across all sessions")
+    parser.add_argument("--max-queue", type=int, default=16, help="Max queued turns per session")
+    parser.add_argument("--idle-timeout", type=float, default=1800.0,
+                        help="Drop sessions idle for this many seconds (0 keeps them)")
+    args = parser.parse_args()
+
+    chat_server = ChatServer(max_workers=args.workers, max_queue=args.max_queue, idle_timeout=args.idle_timeout)
+    try:
+        asyncio.run(chat_server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("\nShutting down.")
+    finally:
+        chat_server.handler.close_reports()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Bounded worker pool with one ordered queue per session.
+
+The Tk front-ends used to start a fresh thread for every message and every
+recording. A SessionExecutor runs that work on at most `max_workers` threads
+instead: tasks submitted under the same key run one at a time in submission
+order, while different keys (sessions) run in parallel. A key is only ever
+handed to one worker at a time, so two turns of a session never interleave on
+its display or history.
+
+Nobody waits on most of the returned futures, so a task that raises is also
+reported: printed with its traceback and passed to `on_error(key, exc)` if
+given (ui2.py shows it in the chat).
+"""
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, Hashable, Optional, Tuple
+
+
+class SessionExecutor:
+    def __init__(self, max_workers: int = 4, name: str = "session-worker",
+                 on_error: Optional[Callable[[Hashable, BaseException], None]] = None):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        self.max_workers = max_workers
+        self.name = name
+        self.on_error = on_error
+        self._queues: Dict[Hashable, Deque[Tuple[Future, Callable, tuple, dict]]] = {}
+        self._ready: Deque[Hashable] = deque()
+        self._running = set()
+        self._threads = []
+        self._idle = 0
+        self._shutdown = False
+        self._completed = 0
+        self._condition = threading.Condition()
+
+    def submit(self, key: Hashable, fn: Callable, *args, **kwargs) -> Future:
+        """Queue `fn(*args, **kwargs)` behind earlier work for `key`."""
+        future = Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("cannot submit after shutdown")
+            pending = self._queues.setdefault(key, deque())
+            pending.append((future, fn, args, kwargs))
+            if len(pending) == 1 and key not in self._running:
+                self._ready.append(key)
+                self._condition.notify()
+            if self._idle < len(self._ready) and len(self._threads) < self.max_workers:
+                thread = threading.Thread(target=self._work, daemon=True,
+                                          name=f"{self.name}-{len(self._threads)}")
+                self._threads.append(thread)
+                thread.start()
+        return future
+
+    def _work(self):
+        while True:
+            with self._condition:
+                self._idle += 1
+                while not self._ready and not self._shutdown:
+                    self._condition.wait()
+                self._idle -= 1
+                if not self._ready:
+                    return
+                key = self._ready.popleft()
+                future, fn, args, kwargs = self._queues[key].popleft()
+                self._running.add(key)
+
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+                    self._report(key, e)
+
+            with self._condition:
+                self._running.discard(key)
+                self._completed += 1
+                if self._queues[key]:
+                    self._ready.append(key)
+                    self._condition.notify()
+                else:
+                    del self._queues[key]
+
+    def _report(self, key: Hashable, error: BaseException):
+        print(f"Task for {key!r} failed:")
+        traceback.print_exception(type(error), error, error.__traceback__)
+        if self.on_error is not None:
+            try:
+                self.on_error(key, error)
+            except Exception as e:
+                print(f"Error handler for {key!r} failed: {e}")
+
+    def queue_depth(self, key: Hashable = None) -> int:
+        """Tasks waiting to start, for one key or in total."""
+        with self._condition:
+            if key is not None:
+                return len(self._queues.get(key, ()))
+            return sum(len(pending) for pending in self._queues.values())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                "threads": len(self._threads),
+                "max_workers": self.max_workers,
+                "busy": len(self._running),
+                "idle": self._idle,
+                "queued": sum(len(pending) for pending in self._queues.values()),
+                "per_session": {key: len(pending) for key, pending in self._queues.items() if pending},
+                "completed": self._completed,
+            }
+
+    def shutdown(self, wait: bool = True, cancel_pending: bool = False):
+        with self._condition:
+            self._shutdown = True
+            if cancel_pending:
+                for pending in self._queues.values():
+                    for future, *_ in pending:
+                        future.cancel()
+            self._condition.notify_all()
+            threads = list(self._threads)
+        if wait:
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,187 @@
+"""
+Single-flight coalescing of identical in-flight streaming requests.
+
+The first caller for a key starts the upstream stream on a pump thread; every
+concurrent caller with the same key subscribes to it instead of opening its
+own. Subscribers that join late get the chunks emitted so far replayed before
+following the live stream. Once the upstream finishes the key is released, so
+this never serves stale results - it only merges requests that overlap in time.
+"""
+import asyncio
+import hashlib
+import json
+import re
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_messages(messages: List[Dict[str, Any]]) -> List[List[str]]:
+    """Reduce messages to (role, content) pairs with whitespace collapsed."""
+    return [
+        [m.get("role", ""), _WHITESPACE.sub(" ", str(m.get("content", ""))).strip()]
+        for m in messages
+    ]
+
+
+def make_key(tool_name: str, client_type: str, request: Dict[str, Any]) -> str:
+    """Key a completion request on tool, backend, model, normalized messages and options."""
+    payload = {
+        "tool": tool_name,
+        "client": client_type,
+        "model": request.get("model"),
+        "messages": normalize_messages(request.get("messages", [])),
+        "options": {k: v for k, v in sorted(request.items()) if k not in ("model", "messages")},
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class Flight:
+    """One upstream stream shared by every subscriber with the same key."""
+
+    def __init__(self, key: str, on_finish: Callable[["Flight"], None],
+                 on_abandon: Callable[["Flight"], None] = None):
+        self.key = key
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Exception = None
+        self.subscribers = 0
+        self.cancelled = False
+        self._cond = threading.Condition()
+        self._on_finish = on_finish
+        self._on_abandon = on_abandon
+
+    def start(self, source_factory: Callable[[], Iterable[Any]]):
+        threading.Thread(target=self._pump, args=(source_factory,), daemon=True,
+                         name=f"singleflight-{self.key[:8]}").start()
+
+    def _pump(self, source_factory):
+        source = None
+        try:
+            source = source_factory()
+            for item in source:
+                with self._cond:
+                    if self.cancelled:
+                        break
+                    self.chunks.append(item)
+                    self._cond.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            if hasattr(source, "close"):
+                source.close()
+            with self._cond:
+                self.done = True
+                self._cond.notify_all()
+            self._on_finish(self)
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _wait(self, index: int, cancel_token=None):
+        """Block until chunk `index` exists or the flight ended. Returns (has_item, item)."""
+        with self._cond:
+            while index >= len(self.chunks) and not self.done:
+                if cancel_token is not None and cancel_token.cancelled:
+                    return False, None
+                self._cond.wait()
+            if cancel_token is not None and cancel_token.cancelled:
+                return False, None
+            if index < len(self.chunks):
+                return True, self.chunks[index]
+            if self.error is not None:
+                raise self.error
+            return False, None
+
+    def _leave(self):
+        with self._cond:
+            self.subscribers -= 1
+            # Nobody is listening any more: stop pulling from upstream.
+            abandoned = self.subscribers == 0 and not self.done and not self.cancelled
+            if abandoned:
+                self.cancelled = True
+        if abandoned and self._on_abandon is not None:
+            self._on_abandon(self)
+
+    def iterate(self, cancel_token=None) -> Iterator[Any]:
+        unregister = cancel_token.register(self._wake) if cancel_token is not None else None
+        index = 0
+        try:
+            while True:
+                has_item, item = self._wait(index, cancel_token)
+                if not has_item:
+                    return
+                index += 1
+                yield item
+        finally:
+            if unregister is not None:
+                unregister()
+            self._leave()
+
+    async def iterate_async(self, cancel_token=None) -> AsyncIterator[Any]:
+        loop = asyncio.get_running_loop()
+        unregister = cancel_token.register(self._wake) if cancel_token is not None else None
+        index = 0
+        try:
+            while True:
+                has_item, item = await loop.run_in_executor(None, self._wait, index, cancel_token)
+                if not has_item:
+                    return
+                index += 1
+                yield item
+        finally:
+            if unregister is not None:
+                unregister()
+            self._leave()
+
+
+class SingleFlight:
+    """Registry of in-flight streams keyed by request identity."""
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+        self.stats = {"flights": 0, "coalesced": 0}
+
+    def _join(self, key: str, source_factory: Callable[[], Iterable[Any]],
+              on_abandon: Callable[[Flight], None] = None) -> Flight:
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and not flight.cancelled:
+                self.stats["coalesced"] += 1
+                with flight._cond:
+                    flight.subscribers += 1
+                return flight
+            flight = Flight(key, self._finish, on_abandon)
+            flight.subscribers = 1
+            self._flights[key] = flight
+            self.stats["flights"] += 1
+        flight.start(source_factory)
+        return flight
+
+    def _finish(self, flight: Flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def stream(self, key: str, source_factory: Callable[[], Iterable[Any]],
+               cancel_token=None, on_abandon: Callable[[Flight], None] = None) -> Iterator[Any]:
+        """Subscribe to the stream for `key`, starting it with `source_factory` if needed.
+
+        The subscription ends as soon as `cancel_token` is cancelled. When the
+        last subscriber leaves early, `on_abandon(flight)` (from the caller that
+        started the flight) is called once to close the upstream connection.
+        """
+        return self._join(key, source_factory, on_abandon).iterate(cancel_token)
+
+    def stream_async(self, key: str, source_factory: Callable[[], Iterable[Any]],
+                     cancel_token=None, on_abandon: Callable[[Flight], None] = None) -> AsyncIterator[Any]:
+        """Async variant of `stream` for asyncio consumers such as server.py."""
+        return self._join(key, source_factory, on_abandon).iterate_async(cancel_token)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
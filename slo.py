@@ -0,0 +1,142 @@
+"""
+Latency-SLO-driven generation settings.
+
+ThroughputStats keeps an exponentially weighted time to first token and
+decode rate (tokens/sec) per model, fed by BaseTool.stream_completion.
+SLOPlanner uses them to pick, per request, the model and `max_tokens` that let
+a tool's reply finish within its `latency_slo`: the tool's own model when it
+can still produce at least `min_tokens` in time (with `max_tokens` capped to
+what fits), otherwise the first of its `model_variants` that can. When no
+model can, the reply is not truncated: the tool's own model and `max_tokens`
+are used and a notice is printed. Models with no observations yet are
+trusted as-is. Every `explore_every`-th request to a tool that was moved off
+its own model goes back to that model so a recovered model is noticed.
+
+Every selection is kept in `recent` and, with DEVDUCK_SLO_LOG=<file>,
+appended there as JSON lines so budgets and variants can be tuned offline.
+"""
+import json
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional, Tuple
+
+
+class ThroughputStats:
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._models: Dict[str, Dict[str, float]] = {}
+
+    def record(self, model: str, ttft: float, tokens: int, decode_seconds: float):
+        with self._lock:
+            stats = self._models.get(model)
+            tps = (tokens - 1) / decode_seconds if tokens > 1 and decode_seconds > 0 else None
+            if stats is None:
+                if tps is None:
+                    return
+                self._models[model] = {"ttft": ttft, "tps": tps, "samples": 1}
+                return
+            stats["ttft"] += self.alpha * (ttft - stats["ttft"])
+            if tps is not None:
+                stats["tps"] += self.alpha * (tps - stats["tps"])
+            stats["samples"] += 1
+
+    def estimate(self, model: str) -> Optional[Tuple[float, float]]:
+        """(ttft seconds, tokens/sec) for `model`, or None before its first measured reply."""
+        with self._lock:
+            stats = self._models.get(model)
+            return (stats["ttft"], stats["tps"]) if stats else None
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {model: {k: round(v, 3) for k, v in stats.items()} for model, stats in self._models.items()}
+
+
+@dataclass
+class Selection:
+    tool: str
+    model: str
+    max_tokens: Optional[int]
+    predicted_seconds: Optional[float]
+    reason: str
+
+
+class SLOPlanner:
+    def __init__(self, stats: ThroughputStats, min_tokens: int = 64, headroom: float = 0.9,
+                 log_path: str = None, history: int = 200, explore_every: int = 20):
+        self.stats = stats
+        self.min_tokens = min_tokens
+        self.headroom = headroom
+        self.log_path = log_path
+        self.recent = deque(maxlen=history)
+        self.explore_every = explore_every
+        self._demotions: Dict[str, int] = {}
+        self._unreachable = set()
+        self._lock = threading.Lock()
+
+    def _budget(self, model: str, slo: float) -> Optional[int]:
+        """Tokens `model` can generate within `slo`, or None if it is unmeasured."""
+        estimate = self.stats.estimate(model)
+        if estimate is None:
+            return None
+        ttft, tps = estimate
+        return int(max(0.0, slo * self.headroom - ttft) * tps)
+
+    def _predict(self, model: str, max_tokens: Optional[int]) -> Optional[float]:
+        estimate = self.stats.estimate(model)
+        if estimate is None or not max_tokens:
+            return None
+        ttft, tps = estimate
+        return round(ttft + max_tokens / tps, 3)
+
+    def plan(self, tool, default_model: str, default_max_tokens: Optional[int]) -> Selection:
+        """Choose model and max_tokens for one request to `tool` (a registry Tool)."""
+        slo = getattr(tool, "latency_slo", None)
+        if not slo or not default_model:
+            return Selection(tool.name, default_model, default_max_tokens, None, "no slo")
+
+        for model in (default_model, *(getattr(tool, "model_variants", None) or ())):
+            budget = self._budget(model, slo)
+            if budget is None:
+                selection = Selection(tool.name, model, default_max_tokens, None, "unmeasured")
+                break
+            if budget >= self.min_tokens:
+                max_tokens = min(budget, default_max_tokens) if default_max_tokens else budget
+                reason = "fits" if model == default_model else "variant fits"
+                selection = Selection(tool.name, model, max_tokens, self._predict(model, max_tokens), reason)
+                break
+        else:
+            selection = Selection(tool.name, default_model, default_max_tokens,
+                                  self._predict(default_model, default_max_tokens), "slo unreachable")
+
+        with self._lock:
+            if selection.reason != "slo unreachable":
+                self._unreachable.discard(tool.name)
+            elif tool.name not in self._unreachable:
+                self._unreachable.add(tool.name)
+                print(f"Latency SLO of {slo}s for {tool.name} is out of reach for every model; "
+                      f"using {default_model} untruncated")
+
+        if selection.model != default_model:
+            with self._lock:
+                demotions = self._demotions[tool.name] = self._demotions.get(tool.name, 0) + 1
+            if self.explore_every and demotions % self.explore_every == 0:
+                selection = Selection(tool.name, default_model, default_max_tokens,
+                                      self._predict(default_model, default_max_tokens), "explore")
+        self._log(selection, slo)
+        return selection
+
+    def _log(self, selection: Selection, slo: float):
+        record = asdict(selection)
+        record["time"] = round(time.time(), 3)
+        record["slo"] = slo
+        estimate = self.stats.estimate(selection.model)
+        if estimate:
+            record["ttft"], record["tps"] = round(estimate[0], 3), round(estimate[1], 1)
+        with self._lock:
+            self.recent.append(record)
+            if self.log_path:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
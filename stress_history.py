@@ -0,0 +1,116 @@
+"""
+Stress check: concurrent writers and readers on the conversation history.
+
+Writer threads append numbered exchanges to a few shared sessions while
+reader threads keep taking snapshots (the way an in-flight request does) and
+check every one of them: whole exchanges only, each user message followed by
+its own reply, and each writer's exchanges in the order it wrote them. It
+also checks that a request's message list is private to that request.
+
+    python stress_history.py [--writers 16] [--readers 8] [--sessions 4] [--exchanges 500]
+"""
+import argparse
+import sys
+import threading
+import time
+
+from history import ConversationStore
+
+TOOLS = ("ideation", "therapist", "internet_search")
+
+
+def check_snapshot(snapshot) -> str:
+    """Return a description of the first problem in `snapshot`, or ''."""
+    if len(snapshot) % 2:
+        return f"odd length {len(snapshot)}: torn exchange"
+    last_seen = {}
+    for i in range(0, len(snapshot), 2):
+        user, assistant = snapshot[i], snapshot[i + 1]
+        if user["role"] != "user" or assistant["role"] != "assistant":
+            return f"roles out of order at {i}"
+        writer, number = user["content"].split(":")
+        if assistant["content"] != f"reply to {writer}:{number}":
+            return f"reply at {i + 1} does not belong to {user['content']}"
+        if int(number) <= last_seen.get(writer, -1):
+            return f"writer {writer} out of order at {i}"
+        last_seen[writer] = int(number)
+    return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--exchanges", type=int, default=500, help="exchanges per writer")
+    args = parser.parse_args()
+
+    store = ConversationStore()
+    errors = []
+    snapshots = [0]
+    done = threading.Event()
+    start = threading.Barrier(args.writers + args.readers)
+
+    def writer(index):
+        session, tool = index % args.sessions, TOOLS[index % len(TOOLS)]
+        start.wait()
+        for number in range(args.exchanges):
+            store.append_exchange(session, tool, f"w{index}:{number}", f"reply to w{index}:{number}")
+
+    def reader(index):
+        start.wait()
+        count = 0
+        while not done.is_set():
+            session = count % args.sessions
+            for tool in TOOLS:
+                problem = check_snapshot(store.snapshot(session, tool))
+                if problem:
+                    errors.append(f"session {session}/{tool}: {problem}")
+                    return
+                # A request extends its copy; the stored history must not change
+                request = store.messages(session, tool)
+                before = len(store.snapshot(session, tool))
+                request.append({"role": "user", "content": "in flight"})
+                if any(m["content"] == "in flight" for m in store.snapshot(session, tool)):
+                    errors.append(f"session {session}/{tool}: request list aliases the history")
+                    return
+                if len(store.snapshot(session, tool)) < before:
+                    errors.append(f"session {session}/{tool}: history shrank")
+                    return
+                count += 1
+        snapshots[0] += count
+
+    writers = [threading.Thread(target=writer, args=(i,)) for i in range(args.writers)]
+    readers = [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+    started = time.perf_counter()
+    for thread in writers + readers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    done.set()
+    for thread in readers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    total = sum(len(store.snapshot(s, t)) for s in range(args.sessions) for t in TOOLS)
+    expected = 2 * args.writers * args.exchanges
+    if total != expected:
+        errors.append(f"lost writes: {total} messages, expected {expected}")
+    for session in range(args.sessions):
+        for tool in TOOLS:
+            problem = check_snapshot(store.snapshot(session, tool))
+            if problem:
+                errors.append(f"final session {session}/{tool}: {problem}")
+
+    print(f"{args.writers} writers x {args.exchanges} exchanges, {args.readers} readers, "
+          f"{snapshots[0]} checked snapshots in {elapsed:.2f}s")
+    if errors:
+        print("FAILED")
+        for error in errors[:20]:
+            print(f"  {error}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
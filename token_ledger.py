@@ -0,0 +1,223 @@
+"""
+Token accounting with a local tokenizer.
+
+TokenCounter picks the tokenizer from DEVDUCK_TOKENIZER:
+
+    <path>/tokenizer.json   a Hugging Face tokenizer file (needs the
+                            `tokenizers` package)
+    tiktoken:<encoding>     a tiktoken encoding such as cl100k_base; tiktoken
+                            downloads it on first use, and it is OpenAI's
+                            vocabulary, so counts differ from the Llama
+                            tokenizer's
+    (unset)                 the local model's tokenizer.json if it is in the
+                            Hugging Face cache, otherwise the regex estimate
+                            from compaction.py
+
+A tokenizer that cannot be loaded (missing package or file, tiktoken offline)
+falls back to the estimate with a notice.
+
+Counts are cached (LRU) under the text's length and hash rather than the text
+itself, so system prompts and history messages that are re-sent with every
+request are only tokenized once without the cache keeping long replies
+alive. Chat messages add `per_message` tokens each for the role header of the
+chat template.
+
+TokenLedger books prompt tokens when a request's messages are sent and
+completion tokens as each chunk streams, per (session, tool); router calls
+are booked under the tool name "router". `table()` renders it for the CLI
+("tokens" at the prompt) and the GUIs (Token Usage button); `export` writes
+CSV or JSON lines for capacity planning (DEVDUCK_TOKEN_LEDGER=<file> exports
+on exit), and this module summarises an export:
+
+    python token_ledger.py ledger.csv [--by tool|session]
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from compaction import estimate_tokens
+
+FIELDS = ("session", "tool", "requests", "prompt_tokens", "completion_tokens", "total_tokens")
+
+
+def find_local_tokenizer(model: str) -> Optional[str]:
+    """tokenizer.json of `model` (e.g. "llama-3.2-3b-instruct") in the Hugging Face cache, if present."""
+    hub = os.getenv("HF_HUB_CACHE") or os.path.join(
+        os.getenv("HF_HOME") or os.path.join(os.path.expanduser("~"), ".cache", "huggingface"), "hub")
+    for path in sorted(glob.glob(os.path.join(hub, "models--*", "snapshots", "*", "tokenizer.json"))):
+        repo = os.path.basename(path.split(os.sep + "snapshots" + os.sep)[0])
+        if repo.lower().endswith("--" + model.lower()):
+            return path
+    return None
+
+
+def _tokenizer_file(path: str) -> Callable[[str], int]:
+    from tokenizers import Tokenizer
+
+    tokenizer = Tokenizer.from_file(path)
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+def _tiktoken(encoding: str) -> Callable[[str], int]:
+    import tiktoken
+
+    encoder = tiktoken.get_encoding(encoding)
+    return lambda text: len(encoder.encode(text, disallowed_special=()))
+
+
+def _load_encoder(spec: Optional[str], model: str = None) -> Tuple[str, Callable[[str], int]]:
+    """(name, count function) for a DEVDUCK_TOKENIZER value; the estimate if nothing loads."""
+    name = spec or (find_local_tokenizer(model) if model else None)
+    if not name:
+        return "estimate", estimate_tokens
+    try:
+        if name.startswith("tiktoken:"):
+            return name, _tiktoken(name.partition(":")[2])
+        return name, _tokenizer_file(name)
+    except ImportError:
+        print(f"Tokenizer {name} needs the tokenizers/tiktoken package; estimating token counts")
+    except Exception as e:
+        # tiktoken fetches encodings on first use, which fails offline
+        print(f"Tokenizer {name} unavailable ({e}); estimating token counts")
+    return "estimate", estimate_tokens
+
+
+class TokenCounter:
+    def __init__(self, spec: str = None, model: str = None, cache_size: int = 4096, per_message: int = 4):
+        self.name, self._encode = _load_encoder(spec, model)
+        self.cache_size = cache_size
+        self.per_message = per_message
+        self._cache: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+        self._hits = self._misses = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, text: str) -> int:
+        if not text:
+            return 0
+        key = (len(text), hash(text))
+        with self._lock:
+            count = self._cache.get(key)
+            if count is not None:
+                self._cache.move_to_end(key)
+                self._hits += 1
+                return count
+            self._misses += 1
+        count = self._encode(text)
+        with self._lock:
+            self._cache[key] = count
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return count
+
+    def messages(self, messages: Iterable[Dict[str, str]]) -> int:
+        return sum(self.per_message + self(str(message.get("content") or "")) for message in messages)
+
+    def cache_info(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses, "size": len(self._cache), "maxsize": self.cache_size}
+
+
+class TokenLedger:
+    def __init__(self, counter: TokenCounter):
+        self.counter = counter
+        self._entries: Dict[Tuple[Hashable, str], Dict[str, int]] = defaultdict(
+            lambda: {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0})
+        self._lock = threading.Lock()
+
+    def add(self, session_id, tool: str, prompt_tokens: int = 0, completion_tokens: int = 0, requests: int = 0):
+        with self._lock:
+            entry = self._entries[(session_id, tool)]
+            entry["requests"] += requests
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+
+    def record_prompt(self, session_id, tool: str, messages: Iterable[Dict[str, str]]) -> int:
+        """Book one request and its prompt tokens; returns the count."""
+        tokens = self.counter.messages(messages)
+        self.add(session_id, tool, prompt_tokens=tokens, requests=1)
+        return tokens
+
+    def record_completion(self, session_id, tool: str, text: str) -> int:
+        tokens = self.counter(text)
+        self.add(session_id, tool, completion_tokens=tokens)
+        return tokens
+
+    def rows(self, session_id=None, tool: str = None) -> List[Dict]:
+        """One row per (session, tool), optionally filtered."""
+        with self._lock:
+            items = [(key, dict(entry)) for key, entry in self._entries.items()]
+        rows = []
+        for (session, tool_name), entry in items:
+            if (session_id is None or session == session_id) and (tool is None or tool_name == tool):
+                rows.append({"session": session, "tool": tool_name, **entry,
+                             "total_tokens": entry["prompt_tokens"] + entry["completion_tokens"]})
+        return rows
+
+    def totals(self, session_id=None, tool: str = None) -> Dict[str, int]:
+        totals = summarize(self.rows(session_id, tool), by=None)[0]
+        del totals["total"]
+        return totals
+
+    def table(self, session_id=None, by: str = "tool") -> str:
+        return format_table(summarize(self.rows(session_id), by), by, title=f"Tokens ({self.counter.name})")
+
+    def export(self, path: str) -> int:
+        """Write all rows as CSV (.csv) or JSON lines; returns the row count."""
+        rows = self.rows()
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            if path.endswith(".csv"):
+                writer = csv.DictWriter(f, fieldnames=FIELDS)
+                writer.writeheader()
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    f.write(json.dumps(row, default=str) + "\n")
+        return len(rows)
+
+
+def summarize(rows: Iterable[Dict], by: Optional[str] = "tool") -> List[Dict]:
+    """Rows added up per `by` ("tool" or "session"), or into one total row when `by` is None."""
+    groups: Dict[Hashable, Dict] = {}
+    for row in rows:
+        key = row[by] if by else "total"
+        group = groups.setdefault(key, {by or "total": key, "requests": 0, "prompt_tokens": 0,
+                                        "completion_tokens": 0, "total_tokens": 0})
+        for field in ("requests", "prompt_tokens", "completion_tokens", "total_tokens"):
+            group[field] += int(row[field])
+    if not groups and by is None:
+        return [{"total": "total", "requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}]
+    return sorted(groups.values(), key=lambda group: -group["total_tokens"])
+
+
+def format_table(groups: List[Dict], by: str, title: str = "Tokens") -> str:
+    lines = [title, f"  {by:<20} {'requests':>8} {'prompt':>10} {'completion':>10} {'total':>10}"]
+    for group in groups:
+        lines.append(f"  {str(group[by]):<20} {group['requests']:>8} {group['prompt_tokens']:>10} "
+                     f"{group['completion_tokens']:>10} {group['total_tokens']:>10}")
+    if not groups:
+        lines.append("  (nothing recorded yet)")
+    return "\n".join(lines)
+
+
+def read_export(path: str) -> List[Dict]:
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            return list(csv.DictReader(f))
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("export", help="ledger exported as .csv or JSON lines")
+    parser.add_argument("--by", choices=("tool", "session"), default="tool")
+    args = parser.parse_args()
+    print(format_table(summarize(read_export(args.export), args.by), args.by, title=f"Tokens in {args.export}"))
+
+
+if __name__ == "__main__":
+    main()
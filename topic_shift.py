@@ -0,0 +1,98 @@
+"""
+Cheap local topic-shift detection for sticky routing.
+
+Follow-up turns stay with the session's current tool; the router is only
+asked again when a message drifts away from the last few turns. Drift is
+measured locally, without a model call:
+
+    keywords   share of the message's content words that do not appear in the
+               recent turns (default, dependency-free)
+    embedding  cosine distance between the message and the mean of the recent
+               turns, with any `embed(text) -> vector` callable (e.g.
+               vector_memory.HashingEmbedder or LocalEmbedder)
+
+Short messages ("why?", "tell me more") and messages that open by referring
+back ("and...", "it...", "that...") are always treated as follow-ups.
+"""
+import math
+import re
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, Hashable, Optional, Sequence, Tuple
+
+_WORD = re.compile(r"[a-z0-9']+")
+
+STOPWORDS = frozenset("""
+a about above after again all also am an and any are as at be because been before being below between both
+but by can could did do does doing down during each few for from further had has have having he her here
+hers him his how i if in into is it its itself just me more most my no nor not now of off on once only or
+other our out over own same she should so some such than that the their them then there these they this
+those through to too under until up very was we were what when where which while who whom why will with
+would you your yours yourself let lets get got tell know think want like really thing things im ive dont
+""".split())
+
+FOLLOW_UP_OPENERS = frozenset("and but so also it its that this those these they then ok okay".split())
+
+
+def keywords(text: str) -> frozenset:
+    return frozenset(w for w in _WORD.findall(text.lower()) if len(w) > 2 and w not in STOPWORDS)
+
+
+def _cosine(a: Sequence[float], b: Sequence[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class TopicShiftDetector:
+    def __init__(self, window: int = 3, threshold: float = 0.8, min_keywords: int = 3,
+                 embed: Callable[[str], Sequence[float]] = None, min_similarity: float = 0.25):
+        self.window = window
+        self.threshold = threshold
+        self.min_keywords = min_keywords
+        self.embed = embed
+        self.min_similarity = min_similarity
+        self._recent: Dict[Hashable, Deque[Tuple[frozenset, Optional[Sequence[float]]]]] = {}
+        self._lock = threading.Lock()
+
+    def drift(self, session_id, text: str) -> Optional[float]:
+        """0 (same topic) .. 1 (unrelated) against the session's recent turns; None if it can't tell."""
+        words = keywords(text)
+        opener = _WORD.match(text.strip().lower())
+        if len(words) < self.min_keywords or (opener and opener.group(0) in FOLLOW_UP_OPENERS):
+            return None
+        with self._lock:
+            recent = list(self._recent.get(session_id, ()))
+        if not recent:
+            return None
+
+        if self.embed is not None and all(vector is not None for _, vector in recent):
+            vector = self.embed(text)
+            dims = len(vector)
+            centroid = [sum(v[i] for _, v in recent) / len(recent) for i in range(dims)]
+            return 1.0 - _cosine(vector, centroid)
+        seen = frozenset().union(*(turn_words for turn_words, _ in recent))
+        return len(words - seen) / len(words)
+
+    def is_shift(self, session_id, text: str) -> bool:
+        drift = self.drift(session_id, text)
+        if drift is None:
+            return False
+        limit = 1.0 - self.min_similarity if self.embed is not None else self.threshold
+        return drift >= limit
+
+    def observe(self, session_id, text: str, new_topic: bool = False):
+        """Record a turn; `new_topic` starts the window over from this turn."""
+        vector = self.embed(text) if self.embed is not None else None
+        with self._lock:
+            recent = self._recent.get(session_id)
+            if recent is None or new_topic:
+                recent = self._recent[session_id] = deque(maxlen=self.window)
+            recent.append((keywords(text), vector))
+
+    def forget(self, session_id=None):
+        with self._lock:
+            if session_id is None:
+                self._recent.clear()
+            else:
+                self._recent.pop(session_id, None)
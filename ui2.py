@@ -1,13 +1,21 @@
 import customtkinter as ctk
 import speech_recognition as sr
-import threading
 import pyaudio
 import wave
 import os
+import io
+import time
 from main import ToolHandler, ClientManager
+from postprocess import speech_pipeline
+from session_executor import SessionExecutor
+from cancellation import CancellationToken
+from prerouting import PreRouter
 import pyttsx3
 
 class VoiceChatApp(ctk.CTk):
+    # Seconds between partial transcriptions while recording
+    PARTIAL_TRANSCRIBE_INTERVAL = 2.0
+
     def __init__(self):
         super().__init__()
 
@@ -47,6 +55,9 @@ class VoiceChatApp(ctk.CTk):
                                                        command=self.change_appearance_mode)
         self.mode_menu.grid(row=5, column=0, padx=20, pady=(10, 10))
 
+        self.tokens_button = ctk.CTkButton(self.sidebar_frame, text="Token Usage", command=self.show_token_usage)
+        self.tokens_button.grid(row=6, column=0, padx=20, pady=(10, 20))
+
         # Create main frame
         self.main_frame = ctk.CTkFrame(self, corner_radius=0)
         self.main_frame.grid(row=0, column=1, sticky="nsew")
@@ -88,15 +99,37 @@ class VoiceChatApp(ctk.CTk):
         self.speech_engine = pyttsx3.init()
         
         # Initialize ToolHandler and session management
-        self.tool_handler = ToolHandler()
+        self.tool_handler = ToolHandler(report_dir="reports")
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        # Turns of a session run in order; sessions and audio run in parallel
+        # (recording holds a worker for as long as it lasts)
+        self.executor = SessionExecutor(max_workers=int(os.getenv("DEVDUCK_WORKERS", "4")),
+                                        on_error=self.show_error)
         
+        # Token for the generation currently streaming into the display
+        self.current_generation = None
+
+        # Route (and warm the tool) on partial transcripts while recording
+        self.prerouter = PreRouter(
+            route=lambda text: self.tool_handler.predict_tool(text, self.session_menu.get()),
+            warm=lambda tool, text: self.tool_handler.warm_tool(tool, text, self.session_menu.get())
+        )
+
         # Dictionary to hold chat sessions
         self.sessions = {}
         self.new_session()
         
+    def cancel_generation(self):
+        """Stop a reply that is still streaming; it has been superseded."""
+        if self.current_generation is not None:
+            self.current_generation.cancel()
+            self.current_generation = None
+
     def new_session(self):
         session_name = f"Session {len(self.sessions) + 1}"
         if session_name not in self.sessions:
+            self.cancel_generation()
             self.sessions[session_name] = []
             
             # Get current values and add the new session
@@ -111,10 +144,11 @@ class VoiceChatApp(ctk.CTk):
             self.chat_display.delete("1.0", ctk.END)
             welcome_message = f"Welcome to {session_name}!\n"
             self.chat_display.insert(ctk.END, welcome_message)
-            self.tool_handler.reset()
+            self.tool_handler.reset(session_name)
         
     def change_session(self, session_name):
         if session_name in self.sessions:
+            self.cancel_generation()
             # Load the selected session's chat history into the display
             chat_history = "\n".join(self.sessions[session_name])
             self.chat_display.delete("1.0", ctk.END)  # Clear current display
@@ -123,6 +157,19 @@ class VoiceChatApp(ctk.CTk):
 
     def change_appearance_mode(self, new_appearance_mode: str):
         ctk.set_appearance_mode(new_appearance_mode)
+
+    def show_token_usage(self):
+        session_name = self.session_menu.get()
+        table = self.tool_handler.token_ledger.table(session_name)
+        self.chat_display.insert(ctk.END, f"\n{table}\n")
+        self.chat_display.see(ctk.END)
+
+    def on_close(self):
+        self.is_recording = False
+        self.executor.shutdown(wait=False, cancel_pending=True)
+        self.tool_handler.close_reports()
+        self.tool_handler.export_token_ledger()
+        self.destroy()
     
     def start_recording(self):
         self.is_recording = True
@@ -132,13 +179,40 @@ class VoiceChatApp(ctk.CTk):
         self.chat_display.insert(ctk.END, "\nRecording started...\n")
         
         self.stream = self.audio.open(format=pyaudio.paInt16, channels=1, rate=44100, input=True, frames_per_buffer=1024)
-        threading.Thread(target=self.record_audio).start()
+        self.prerouter.reset()
+        self.executor.submit("audio", self.record_audio)
+        self.executor.submit("audio-partials", self.transcribe_partials)
         
     def record_audio(self):
         while self.is_recording:
             data = self.stream.read(1024)
             self.frames.append(data)
 
+    def frames_to_wav(self, frames):
+        buffer = io.BytesIO()
+        wf = wave.open(buffer, 'wb')
+        wf.setnchannels(1)
+        wf.setsampwidth(self.audio.get_sample_size(pyaudio.paInt16))
+        wf.setframerate(44100)
+        wf.writeframes(b''.join(frames))
+        wf.close()
+        buffer.seek(0)
+        return buffer
+
+    def transcribe_partials(self):
+        """Feed what has been said so far to the pre-router while still recording."""
+        while self.is_recording:
+            time.sleep(self.PARTIAL_TRANSCRIBE_INTERVAL)
+            frames = list(self.frames)
+            if not self.is_recording or not frames:
+                continue
+            try:
+                with sr.AudioFile(self.frames_to_wav(frames)) as source:
+                    audio = self.recognizer.record(source)
+                self.prerouter.feed(self.recognizer.recognize_google(audio))
+            except (sr.UnknownValueError, sr.RequestError):
+                continue
+
     def stop_recording(self):
         self.is_recording = False
         self.start_button.configure(state=ctk.NORMAL)
@@ -164,12 +238,16 @@ class VoiceChatApp(ctk.CTk):
         try:
             text = self.recognizer.recognize_google(audio)
             self.chat_display.insert(ctk.END, f"\nYou: {text}\n")
-            self.process_input(text)
+            self.process_input(text, selected_tool=self.prerouter.final_tool(text), voice=True)
         except sr.UnknownValueError:
             self.chat_display.insert(ctk.END, "\nSorry, I didn't catch that.\n")
         except sr.RequestError:
             self.chat_display.insert(ctk.END, "\nSorry, there was an error processing your request.\n")
 
+    def show_error(self, key, error):
+        self.chat_display.insert(ctk.END, f"\nSorry, something went wrong: {error}\n")
+        self.chat_display.see(ctk.END)
+
     def send_text(self):
         text = self.text_entry.get()
         if text:
@@ -177,24 +255,44 @@ class VoiceChatApp(ctk.CTk):
             self.text_entry.delete(0, ctk.END)
             self.process_input(text)
 
-    def process_input(self, text):
+    def process_input(self, text, selected_tool=None, voice=False):
+        self.cancel_generation()
+        self.current_generation = CancellationToken()
         self.chat_display.insert("end", "\nAI: ")
-        threading.Thread(target=self.stream_response, args=(text,)).start()
+        session_id = self.session_menu.get()
+        self.executor.submit(session_id, self.stream_response,
+                             text, session_id, self.current_generation, selected_tool, voice)
 
-    def stream_response(self, text):
-        tool, response = self.tool_handler.tool_selection(text, self.session_menu.get())
+    def stream_response(self, text, session_id, cancel_token, selected_tool=None, voice=False):
+        tool, response = self.tool_handler.tool_selection(text, session_id, cancel_token, selected_tool)
+        if voice:
+            if selected_tool is None:
+                self.prerouter.record_final(tool)
+        if cancel_token.cancelled:
+            return
         self.chat_display.insert(ctk.END, f"Using {tool} tool:")
         full_response = ""
+        # Queue each sentence for speech as soon as it is complete
+        speech = speech_pipeline()
         for chunk in response:
+            if cancel_token.cancelled:
+                break
             if chunk is not None:
                 full_response += chunk
                 self.chat_display.insert(ctk.END, chunk)
                 self.chat_display.see(ctk.END)
-                
-        self.tool_handler.update_conversation_history(tool, text, full_response, self.session_menu.get())
+                for sentence in speech.push(chunk):
+                    self.speech_engine.say(sentence)
+
+        # A superseded reply must not reach the (possibly different) session's history
+        if cancel_token.cancelled:
+            self.speech_engine.stop()
+            return
+        self.tool_handler.update_conversation_history(tool, text, full_response, session_id)
         
-        # Speak the full response
-        self.speech_engine.say(full_response)
+        # Speak the rest of the response
+        for sentence in speech.finish():
+            self.speech_engine.say(sentence)
         # self.speech_engine.runAndWait()
         
         self.chat_display.see(ctk.END)
@@ -0,0 +1,224 @@
+"""
+Vector-indexed long-term conversation memory.
+
+Each completed exchange is embedded and appended to a memory-mapped float32
+matrix (`vectors.f32`), with its text and metadata appended to `index.jsonl`
+under the same row id. Vectors are L2-normalised on insert, so retrieval is a
+single matrix-vector product followed by a partial sort for the top k.
+
+Embeddings are truncated to `dim` dimensions before normalising (Matryoshka
+style, which nomic-embed-text v1.5 supports); 256 dimensions keeps a 100k-turn
+matrix around 100 MB.
+
+A brute-force scan of that matrix is bound by memory bandwidth (10+ ms at
+100k rows), so once there are `ivf_min_rows` vectors search switches to an
+inverted-file index: rows are clustered around about sqrt(n) k-means
+centroids and a query only scores the rows of its `nprobe` nearest
+clusters, a few percent of the matrix. The index lives in memory, is built
+on the first search past the threshold (and rebuilt when the store has
+doubled since), and new rows are assigned to their nearest centroid as they
+are added.
+
+LocalEmbedder.probe checks the embedding model at startup; if it is not
+available, callers fall back to HashingEmbedder.
+"""
+import json
+import os
+import re
+import threading
+import zlib
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_WORD = re.compile(r"[a-z0-9']+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token)."""
+    return max(1, len(text) // 4)
+
+
+class LocalEmbedder:
+    """Embeds text through an OpenAI-compatible /embeddings endpoint (LM Studio)."""
+
+    def __init__(self, client, model: str = "text-embedding-nomic-embed-text-v1.5"):
+        self.client = client
+        self.model = model
+
+    def __call__(self, text: str) -> Sequence[float]:
+        response = self.client.embeddings.create(model=self.model, input=text)
+        return response.data[0].embedding
+
+    def probe(self) -> bool:
+        """True if the embedding model answers."""
+        try:
+            return len(self("ping")) > 0
+        except Exception as e:
+            print(f"Embedding model {self.model} unavailable ({e}); using hashed embeddings")
+            return False
+
+
+class HashingEmbedder:
+    """Dependency-free fallback: hashed bag of words and bigrams."""
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def __call__(self, text: str) -> Sequence[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        words = _WORD.findall(text.lower())
+        for gram in words + [a + " " + b for a, b in zip(words, words[1:])]:
+            vector[zlib.crc32(gram.encode("utf-8")) % self.dim] += 1.0
+        return vector
+
+
+class VectorMemory:
+    def __init__(self, directory: str = "memory_store", embed: Callable[[str], Sequence[float]] = None,
+                 dim: int = 256, initial_capacity: int = 1024, ivf_min_rows: int = 20000, nprobe: int = 16):
+        self.directory = directory
+        self.embed = embed or HashingEmbedder(dim)
+        self.dim = dim
+        self.records: List[Dict] = []
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._index_path = os.path.join(directory, "index.jsonl")
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = nprobe
+        self._centroids: Optional[np.ndarray] = None
+        self._assign = np.empty(0, dtype=np.int32)
+        self._ivf_rows = 0
+
+        if os.path.exists(self._index_path):
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                self.records = [json.loads(line) for line in f if line.strip()]
+        self.capacity = max(initial_capacity, len(self.records))
+        self._open_matrix(self.capacity)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def _open_matrix(self, capacity: int):
+        size = capacity * self.dim * 4
+        with open(self._vectors_path, "a+b") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < size:
+                f.truncate(size)
+        self.vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        self.capacity = capacity
+
+    def _encode(self, text: str) -> np.ndarray:
+        vector = np.asarray(self.embed(text), dtype=np.float32)[: self.dim]
+        if vector.shape[0] < self.dim:
+            vector = np.pad(vector, (0, self.dim - vector.shape[0]))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def add(self, user_message: str, assistant_message: str, session_id: str = "default",
+            tool: str = None) -> int:
+        """Embed and store one exchange; returns its row id."""
+        vector = self._encode(f"User: {user_message}\nAssistant: {assistant_message}")
+        record = {
+            "session": session_id,
+            "tool": tool,
+            "user": user_message,
+            "assistant": assistant_message,
+            "tokens": estimate_tokens(user_message) + estimate_tokens(assistant_message),
+        }
+        with self._lock:
+            row = len(self.records)
+            if row >= self.capacity:
+                self.vectors.flush()
+                del self.vectors
+                self._open_matrix(self.capacity * 2)
+            self.vectors[row] = vector
+            if self._centroids is not None:
+                if row >= len(self._assign):
+                    self._assign = np.resize(self._assign, max(2 * len(self._assign), row + 1))
+                self._assign[row] = int(np.argmax(self._centroids @ vector))
+            record["id"] = row
+            self.records.append(record)
+            with open(self._index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+        return row
+
+    def _build_ivf(self, count: int, iterations: int = 8, sample: int = 16000):
+        """Cluster the first `count` rows (spherical k-means on a sample) and assign every row."""
+        rng = np.random.default_rng(0)
+        lists = max(1, int(np.sqrt(count)))
+        data = np.asarray(self.vectors[:count])
+        train = data[rng.choice(count, min(count, sample), replace=False)]
+        centroids = train[rng.choice(len(train), lists, replace=False)].copy()
+        for _ in range(iterations):
+            nearest = np.argmax(train @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, nearest, train)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Empty clusters keep their previous centroid
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+        assign = np.empty(max(count, self.capacity), dtype=np.int32)
+        for start in range(0, count, 8192):
+            stop = min(count, start + 8192)
+            assign[start:stop] = np.argmax(data[start:stop] @ centroids.T, axis=1)
+        self._centroids, self._assign, self._ivf_rows = centroids.astype(np.float32), assign, count
+
+    def _candidates(self, vector: np.ndarray, count: int) -> Optional[np.ndarray]:
+        """Rows to score for `vector`, or None to scan everything."""
+        if count < self.ivf_min_rows:
+            return None
+        if self._centroids is None or count >= 2 * self._ivf_rows:
+            self._build_ivf(count)
+        probe = np.argpartition(-(self._centroids @ vector), min(self.nprobe, len(self._centroids)) - 1)
+        return np.flatnonzero(np.isin(self._assign[:count], probe[:self.nprobe]))
+
+    def search(self, query: str, k: int = 5, exclude: Callable[[Dict], bool] = None) -> List[Tuple[float, Dict]]:
+        """Top-k stored exchanges by cosine similarity to `query` (approximate past `ivf_min_rows`)."""
+        vector = self._encode(query)
+        with self._lock:
+            count = len(self.records)
+            if count == 0:
+                return []
+            rows = self._candidates(vector, count)
+            if rows is None:
+                rows = np.arange(count)
+                scores = self.vectors[:count] @ vector
+            else:
+                scores = self.vectors[rows] @ vector
+        if len(rows) == 0:
+            return []
+        # Over-fetch so excluded rows don't starve the result
+        fetch = min(len(rows), k * 4 if exclude else k)
+        top = np.argpartition(-scores, fetch - 1)[:fetch]
+        top = top[np.argsort(-scores[top])]
+        results = []
+        for index in top:
+            record = self.records[int(rows[index])]
+            if exclude is not None and exclude(record):
+                continue
+            results.append((float(scores[index]), record))
+            if len(results) == k:
+                break
+        return results
+
+    def recall(self, query: str, token_budget: int = 512, k: int = 8, min_score: float = 0.2,
+               exclude: Callable[[Dict], bool] = None) -> List[Dict]:
+        """Relevant past exchanges, best first, fitting within `token_budget`."""
+        selected, used = [], 0
+        for score, record in self.search(query, k=k, exclude=exclude):
+            if score < min_score:
+                break
+            if used + record["tokens"] > token_budget:
+                continue
+            selected.append(record)
+            used += record["tokens"]
+        return selected
+
+    @staticmethod
+    def format_recall(records: List[Dict]) -> Optional[str]:
+        if not records:
+            return None
+        lines = ["Relevant earlier conversation:"]
+        for record in records:
+            lines.append(f"- User: {record['user']}\n  Assistant: {record['assistant']}")
+        return "\n".join(lines)
@@ -0,0 +1,100 @@
+"""
+Model warm-up and keep-alive for local backends.
+
+LM Studio loads (or pages back in) a model on its first request and evaluates
+a long system prompt from scratch, so the first query after startup or an idle
+stretch is much slower than steady state. The ModelWarmer runs on a background
+thread: at start it sends a one-token request to every local model a
+registered tool or the router uses and primes each tool's system prompt; then,
+if `keepalive_interval` is set, it re-pings whenever the engine has been idle
+that long so the models stay resident.
+"""
+import threading
+import time
+from typing import Dict, List, Tuple
+
+
+class ModelWarmer:
+    def __init__(self, tool_handler, keepalive_interval: float = None):
+        self.tool_handler = tool_handler
+        self.keepalive_interval = keepalive_interval
+        self.last_activity = time.monotonic()
+        self.warmup_seconds: Dict[str, float] = {}
+        self.pings = 0
+        self.ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def local_models(self) -> List[Tuple[str, str]]:
+        """(client_type, model) pairs used by registered tools and the router, local only."""
+        handler = self.tool_handler
+        models = []
+        for name, handler_class in handler.registry.tool_handlers.items():
+            pair = (getattr(handler_class, "client_type", None), getattr(handler_class, "model", None))
+            if pair[0] == "local" and pair[1] and pair not in models:
+                models.append(pair)
+        router_pair = (handler.router.client_type, handler.router.model)
+        if router_pair[0] == "local" and router_pair not in models:
+            models.append(router_pair)
+        return models
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name="model-warmer")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def touch(self):
+        """Record engine activity; keep-alive pings only fire after idle periods."""
+        self.last_activity = time.monotonic()
+
+    def _ping(self, client_type: str, model: str):
+        client = self.tool_handler.client_manager.get_client(client_type)
+        client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": "hi"}],
+            max_tokens=1
+        )
+
+    def warm_all(self):
+        for client_type, model in self.local_models():
+            started = time.monotonic()
+            try:
+                self._ping(client_type, model)
+                self.warmup_seconds[model] = round(time.monotonic() - started, 3)
+            except Exception as e:
+                print(f"Warm-up of {model} failed: {e}")
+
+        # Prime each tool's system prompt and the router prompt so their
+        # prefixes are already evaluated for the first real query
+        # Plugin tools that were never selected stay unloaded
+        handler = self.tool_handler
+        for tool_name in list(handler.registry.tool_handlers):
+            try:
+                handler_class = handler.registry.tool_handlers[tool_name]
+                system = [{"role": "system", "content": handler.registry.get_system_prompt(tool_name)}]
+                handler_class(handler.client_manager).warm("hi", system)
+            except Exception as e:
+                print(f"Warm-up of {tool_name} prompt failed: {e}")
+        try:
+            handler.router.warm()
+        except Exception as e:
+            print(f"Warm-up of router prompt failed: {e}")
+
+    def _run(self):
+        self.warm_all()
+        self.ready.set()
+        if not self.keepalive_interval:
+            return
+        while not self._stop.wait(timeout=self.keepalive_interval / 4):
+            if time.monotonic() - self.last_activity < self.keepalive_interval:
+                continue
+            for client_type, model in self.local_models():
+                try:
+                    self._ping(client_type, model)
+                    self.pings += 1
+                except Exception as e:
+                    print(f"Keep-alive ping to {model} failed: {e}")
+            self.touch()